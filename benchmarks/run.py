@@ -0,0 +1,303 @@
+"""
+phantom_alembic のベンチマーク
+
+    python benchmarks/run.py [--filter SUBSTRING] [--repeat N] [--output results.json]
+                             [--baseline benchmarks/baseline.json] [--threshold 0.25] [--update-baseline]
+
+各ケースの準備 (合成リビジョンの生成など) は計測の外で行い、計測対象だけを repeat 回実行して
+最小値・中央値を JSON で出力する。--baseline のファイルと中央値を比較し、
+threshold を超えて遅くなったケースがあれば終了コード 1、ベースラインが無ければ終了コード 2 で終わる。
+計測値はマシンに依存するため、比較するマシンで先に --update-baseline を付けて記録しておく
+
+    tox -e benchmark                        # ベースラインと比較する
+    tox -e benchmark -- --update-baseline   # ベースラインを記録・更新する
+"""
+
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import textwrap
+import time
+from argparse import ArgumentParser
+from contextlib import ExitStack
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Any, Callable, Iterator, Optional
+
+from phantom_alembic import PhantomAlembic, __version__
+from phantom_alembic.store import open_store
+
+DEFAULT_BASELINE = Path(__file__).parent / "baseline.json"
+
+Case = Callable[[Path], Callable[[], Any]]
+CASES: dict[str, Case] = {}
+
+
+def case(name: str) -> Callable[[Case], Case]:
+    def register(setup: Case) -> Case:
+        CASES[name] = setup
+        return setup
+
+    return register
+
+
+def revision_source(revision: str, down_revision: Any) -> str:
+    return textwrap.dedent(f'''\
+        """{revision}"""
+        revision = {revision!r}
+        down_revision = {down_revision!r}
+        branch_labels = None
+        depends_on = None
+
+
+        def upgrade() -> None:
+            pass
+
+
+        def downgrade() -> None:
+            pass
+        ''')
+
+
+def linear_history(count: int) -> Iterator[tuple[str, Any]]:
+    down_revision = None
+    for i in range(count):
+        revision = f"{i:012x}"
+        yield revision, down_revision
+        down_revision = revision
+
+
+def branched_history(branches: int, length: int) -> Iterator[tuple[str, Any]]:
+    """
+    1つの根から branches 本のブランチを伸ばし、最後に1つのリビジョンでマージする
+    """
+    root = "0" * 12
+    yield root, None
+    tips = []
+    for b in range(branches):
+        down_revision = root
+        for i in range(length):
+            revision = f"{b + 1:04x}{i:08x}"
+            yield revision, down_revision
+            down_revision = revision
+        tips.append(down_revision)
+    yield "f" * 12, tuple(tips)
+
+
+def write_store(path: Path, history: Iterator[tuple[str, Any]], backend: str = "jsonl") -> Path:
+    store = open_store(path, backend)
+    store.put({f"{revision}_.py": revision_source(revision, down_revision) for revision, down_revision in history})
+    store.close()
+    return path
+
+
+def sqlite_ini(database_path: Path) -> str:
+    # env.py の fileConfig が要求する最小限の logging 設定
+    return textwrap.dedent(f"""\
+        [alembic]
+        sqlalchemy.url = sqlite:///{database_path}
+
+        [loggers]
+        keys = root
+
+        [handlers]
+        keys =
+
+        [formatters]
+        keys =
+
+        [logger_root]
+        level = WARNING
+        handlers =
+        """)
+
+
+for _count in [10, 100, 1000, 10000]:
+
+    def _setup_context(workdir: Path, count: int = _count) -> Callable[[], Any]:
+        pa = PhantomAlembic(write_store(workdir / "versions.jsonl", linear_history(count)), in_memory=False)
+
+        def run() -> None:
+            with pa.context():
+                pass
+
+        return run
+
+    def _setup_memory_context(workdir: Path, count: int = _count, backend: str = "jsonl") -> Callable[[], Any]:
+        pa = PhantomAlembic(
+            write_store(workdir / f"versions.{backend}", linear_history(count), backend), store_backend=backend
+        )
+
+        def run() -> None:
+            with pa.memory_context() as context:
+                context.script_directory.get_heads()
+
+        return run
+
+    def _setup_sqlite_memory_context(workdir: Path, count: int = _count) -> Callable[[], Any]:
+        return _setup_memory_context(workdir, count, "sqlite")
+
+    case(f"context_enter_exit[{_count}]")(_setup_context)
+    case(f"memory_context_heads[{_count}]")(_setup_memory_context)
+    case(f"memory_context_heads[sqlite-{_count}]")(_setup_sqlite_memory_context)
+
+
+@case("memory_context_heads[archived-10000]")
+def _setup_archived_memory_context(workdir: Path) -> Callable[[], Any]:
+    # 10000 件のうち最後の 10 件だけを末尾セグメントに残す
+    history = list(linear_history(10000))
+    pa = PhantomAlembic(write_store(workdir / "versions.jsonl", iter(history)))
+    pa.archive(history[-10][0])
+
+    def run() -> None:
+        with pa.memory_context() as context:
+            context.script_directory.get_heads()
+
+    return run
+
+
+def write_app(workdir: Path) -> Path:
+    write_store(workdir / "versions.jsonl", linear_history(100))
+    app_path = workdir / "bench_app.py"
+    ini_content = sqlite_ini(workdir / "app.db")
+    app_path.write_text(
+        textwrap.dedent(f"""\
+            from pathlib import Path
+
+            from phantom_alembic import PhantomAlembic
+
+            pa = PhantomAlembic(Path(__file__).parent / "versions.jsonl", ini_content={ini_content!r})
+            """),
+        encoding="utf-8",
+    )
+    return app_path
+
+
+@case("load_object_from_path[cold]")
+def _setup_load_object(workdir: Path) -> Callable[[], Any]:
+    app_path = write_app(workdir)
+    code = f"from phantom_alembic.main import load_object_from_path; load_object_from_path({str(app_path) + ':pa'!r})"
+    return lambda: subprocess.run([sys.executable, "-c", code], check=True, cwd=workdir)
+
+
+@case("load_object_from_path[pyproject]")
+def _setup_load_pyproject(workdir: Path) -> Callable[[], Any]:
+    write_store(workdir / "versions.jsonl", linear_history(100))
+    (workdir / "pyproject.toml").write_text(
+        '[tool.phantom_alembic]\nversion_data_path = "versions.jsonl"\n', encoding="utf-8"
+    )
+    code = "from phantom_alembic.main import load_object_from_path; load_object_from_path('pyproject.toml')"
+    return lambda: subprocess.run([sys.executable, "-c", code], check=True, cwd=workdir)
+
+
+@case("cli_help[cold]")
+def _setup_cli_help(workdir: Path) -> Callable[[], Any]:
+    argv = [sys.executable, "-c", "from phantom_alembic.main import main; main()", "--help"]
+    return lambda: subprocess.run(argv, check=True, cwd=workdir, stdout=subprocess.DEVNULL)
+
+
+@case("cli_check_head[cold]")
+def _setup_cli(workdir: Path) -> Callable[[], Any]:
+    app_path = write_app(workdir)
+    cli = [sys.executable, "-c", "from phantom_alembic.main import main; main()", f"{app_path}:pa"]
+    subprocess.run(cli + ["upgrade", "head"], check=True, cwd=workdir)
+    return lambda: subprocess.run(cli + ["check-head"], check=True, cwd=workdir, stderr=subprocess.DEVNULL)
+
+
+def _setup_upgrade(workdir: Path, history: Iterator[tuple[str, Any]]) -> Callable[[], Any]:
+    database_path = workdir / "app.db"
+    pa = PhantomAlembic(write_store(workdir / "versions.jsonl", history), ini_content=sqlite_ini(database_path))
+
+    def run() -> None:
+        database_path.unlink(missing_ok=True)
+        pa.upgrade("head")
+
+    return run
+
+
+@case("upgrade_head[linear-1000]")
+def _setup_upgrade_linear(workdir: Path) -> Callable[[], Any]:
+    return _setup_upgrade(workdir, linear_history(1000))
+
+
+@case("upgrade_head[branched-50x20]")
+def _setup_upgrade_branched(workdir: Path) -> Callable[[], Any]:
+    return _setup_upgrade(workdir, branched_history(50, 20))
+
+
+def measure(setup: Case, repeat: int) -> dict[str, Any]:
+    with TemporaryDirectory() as workdir:
+        run = setup(Path(workdir))
+        run()  # ウォームアップ
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run()
+            timings.append(time.perf_counter() - start)
+    return {"min": min(timings), "median": statistics.median(timings), "repeat": repeat}
+
+
+def compare(results: dict[str, Any], baseline: dict[str, Any], threshold: float) -> list[str]:
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            print(f"new\t\t{name}", file=sys.stderr)
+            continue
+        ratio = result["median"] / base["median"]
+        marker = "REGRESSION" if ratio > 1 + threshold else "ok"
+        print(f"{marker}\t{ratio:6.2f}x\t{name}", file=sys.stderr)
+        if ratio > 1 + threshold:
+            regressions.append(name)
+    return regressions
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = ArgumentParser(description="phantom_alembic benchmarks")
+    parser.add_argument("--filter", "-k", default=None, type=str, help="run only cases whose name contains this")
+    parser.add_argument("--repeat", "-n", default=5, type=int)
+    parser.add_argument("--output", "-o", default=None, type=str, help="write results as JSON (default: stdout)")
+    parser.add_argument("--baseline", default=str(DEFAULT_BASELINE), type=str)
+    parser.add_argument("--threshold", default=0.25, type=float, help="allowed slowdown of the median (0.25 = 25%%)")
+    parser.add_argument("--update-baseline", action="store_true", help="overwrite the baseline with these results")
+    args = parser.parse_args(argv)
+
+    results = {}
+    for name, setup in CASES.items():
+        if args.filter is not None and args.filter not in name:
+            continue
+        results[name] = measure(setup, args.repeat)
+        print(f"{results[name]['median'] * 1000:10.2f} ms\t{name}", file=sys.stderr)
+    report = {
+        "meta": {
+            "phantom_alembic": __version__,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "results": results,
+    }
+    with ExitStack() as stack:
+        output = sys.stdout if args.output is None else stack.enter_context(open(args.output, "w", encoding="utf-8"))
+        json.dump(report, output, indent=2)
+        output.write("\n")
+
+    baseline_path = Path(args.baseline)
+    if args.update_baseline:
+        baseline = json.loads(baseline_path.read_text(encoding="utf-8")) if baseline_path.exists() else {"results": {}}
+        baseline["meta"] = report["meta"]
+        baseline["results"].update(results)
+        baseline_path.write_text(json.dumps(baseline, indent=2) + "\n", encoding="utf-8")
+        return 0
+    if not baseline_path.exists():
+        print(f"no baseline at {baseline_path}; record one with --update-baseline", file=sys.stderr)
+        return 2
+    regressions = compare(results, json.loads(baseline_path.read_text(encoding="utf-8"))["results"], args.threshold)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
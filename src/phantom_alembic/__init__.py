@@ -1,5 +1,17 @@
 from .core import PhantomAlembic
+from .events import report_rows
+from .parallel import UpgradeResult
+from .report import MigrationReport, UpgradeReport, partial_report
+from .session import PhantomAlembicSession
 
 __version__ = "0.1.0"
 
-__all__ = ["PhantomAlembic"]
+__all__ = [
+    "MigrationReport",
+    "PhantomAlembic",
+    "PhantomAlembicSession",
+    "UpgradeReport",
+    "UpgradeResult",
+    "partial_report",
+    "report_rows",
+]
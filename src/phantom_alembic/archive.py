@@ -0,0 +1,162 @@
+"""
+古いリビジョンを圧縮して凍結したアーカイブセグメント (`<versions.jsonl>.archive`)
+
+ファイルは1行目が非圧縮の JSON ヘッダーで、その後に zlib で圧縮した本体 (ファイル名・グラフ情報・内容の JSONL) が続く。
+ヘッダーには、アーカイブに残っていないリビジョンから参照されている境界のリビジョン (スタブ) のグラフ情報だけを置く。
+普段のコマンドはリビジョンストア (末尾セグメント) とヘッダーだけを読み、スタブを down_revision の無い根として扱う。
+本体を展開するのは、マイグレーションの経路が実際にアーカイブ側へ入るときだけ
+"""
+
+import json
+import zlib
+from pathlib import Path
+from typing import Mapping, Optional
+
+from .cache import content_hash
+from .lock import file_lock
+from .store import (
+    MemoryRecords,
+    RevisionMetadata,
+    RevisionRecords,
+    StoreBackend,
+    atomic_write,
+    file_hash,
+)
+
+ARCHIVE_FORMAT = 1
+
+
+def archive_path(path: Path) -> Path:
+    return path.with_name(path.name + ".archive")
+
+
+class ArchiveSegment:
+    def __init__(self, path: Path) -> None:
+        self._path = path
+        self._stubs: Optional[dict[str, RevisionMetadata]] = None
+
+    @property
+    def path(self) -> Path:
+        return self._path
+
+    def digest(self) -> str:
+        return file_hash(self.path)
+
+    def stubs(self) -> Mapping[str, RevisionMetadata]:
+        """
+        ファイル名 -> アーカイブの外から参照されているリビジョンのグラフ情報 (ヘッダーだけを読む)
+        """
+        if self._stubs is None:
+            with open(self.path, "rb") as f:
+                header = json.loads(f.readline())
+            if header.get("format") != ARCHIVE_FORMAT:
+                raise ValueError(f"{self.path} has an unsupported archive format: {header.get('format')}")
+            self._stubs = {name: RevisionMetadata.from_json(metadata) for name, metadata in header["stubs"]}
+        return self._stubs
+
+    def load(self) -> MemoryRecords:
+        """
+        本体を展開して全レコードを読み込む
+        """
+        with open(self.path, "rb") as f:
+            f.readline()
+            body = zlib.decompress(f.read())
+        contents: dict[str, str] = {}
+        metadata: dict[str, Optional[RevisionMetadata]] = {}
+        for line in body.splitlines():
+            name, value, content = json.loads(line)
+            contents[name] = content
+            metadata[name] = None if value is None else RevisionMetadata.from_json(value)
+        return MemoryRecords(contents, metadata)
+
+    def write(self, records: RevisionRecords, stubs: Mapping[str, RevisionMetadata]) -> None:
+        header = {"format": ARCHIVE_FORMAT, "records": len(records), "stubs": [[n, list(m)] for n, m in stubs.items()]}
+        body = b"".join(
+            (json.dumps([name, _dump(records.metadata.get(name)), records[name]]) + "\n").encode("utf-8")
+            for name in sorted(records)
+        )
+        atomic_write(self.path, json.dumps(header).encode("utf-8") + b"\n" + zlib.compress(body, 9))
+        self._stubs = dict(stubs)
+
+
+def _dump(metadata: Optional[RevisionMetadata]) -> Optional[list[object]]:
+    return None if metadata is None else list(metadata)
+
+
+def open_archive(store: StoreBackend) -> Optional[ArchiveSegment]:
+    """
+    ストアのアーカイブセグメント (ファイルを持たないストアやアーカイブが無い場合は None)
+    """
+    if store.path is None or not archive_path(store.path).exists():
+        return None
+    return ArchiveSegment(archive_path(store.path))
+
+
+def history_digest(store: StoreBackend) -> str:
+    """
+    ストアとアーカイブを合わせた全履歴のハッシュ (アーカイブが無ければ StoreBackend.digest と同じ)
+    """
+    archive = open_archive(store)
+    if archive is None:
+        return store.digest()
+    return content_hash(store.digest().encode("ascii"), archive.digest().encode("ascii"))
+
+
+def with_archive(records: RevisionRecords, archive: Optional[ArchiveSegment]) -> RevisionRecords:
+    """
+    末尾セグメントのレコードにアーカイブのレコードを合わせた全履歴 (同じファイル名は末尾セグメントを優先する)
+    """
+    if archive is None:
+        return records
+    archived = archive.load()
+    return MemoryRecords({**archived, **records}, {**archived.metadata, **records.metadata})
+
+
+def archive_revisions(store: StoreBackend, revision: str) -> list[str]:
+    """
+    revision の祖先 (down_revision / depends_on を辿れるリビジョン) をストアからアーカイブへ移し、移したファイル名を返す
+    """
+    if store.path is None:
+        raise ValueError(f"{type(store).__name__} has no file to archive next to")
+    segment = ArchiveSegment(archive_path(store.path))
+    with file_lock(segment.path.with_name(segment.path.name + ".lock")):
+        try:
+            records = store.load()
+            names: dict[str, str] = {}
+            for name, metadata in records.metadata.items():
+                if name.endswith(".py") and metadata is None:
+                    raise ValueError(f"Cannot archive revisions: the graph of {name} cannot be read statically")
+                if metadata is not None:
+                    names[metadata.revision] = name
+            if revision not in names:
+                raise ValueError(f"Revision {revision} is not in the active segment of {store.path}")
+            moved: set[str] = set()
+            pending = list(_references(records, names[revision]))
+            while pending:
+                ancestor = names.get(pending.pop())
+                if ancestor is not None and ancestor not in moved:
+                    moved.add(ancestor)
+                    pending.extend(_references(records, ancestor))
+            if not moved:
+                return []
+            archived = with_archive(
+                MemoryRecords({n: records[n] for n in moved}, {n: records.metadata[n] for n in moved}),
+                open_archive(store),
+            )
+            referenced = {ref for name in records.keys() - moved for ref in _references(records, name)}
+            stubs = {
+                name: metadata
+                for name, metadata in archived.metadata.items()
+                if metadata is not None and metadata.revision in referenced
+            }
+            # アーカイブを書き終えてからストアから消す (途中で失敗しても両方に残るだけで、リビジョンは失われない)
+            segment.write(archived, stubs)
+            store.put({}, removed=moved)
+        finally:
+            store.close()
+    return sorted(moved)
+
+
+def _references(records: RevisionRecords, name: str) -> tuple[str, ...]:
+    metadata = records.metadata.get(name)
+    return metadata.references if metadata is not None else ()
@@ -0,0 +1,47 @@
+"""
+空のデータベースを一気に立ち上げるためのベースライン
+
+`squash --to <rev>` は空のデータベースから rev までの upgrade をオフライン SQL として実行し、
+各マイグレーションが出力した文だけを dialect ごとのレコード `baseline.<dialect>.json` としてリビジョンストアに記録する
+(alembic_version の更新や BEGIN / COMMIT は含めない)。
+空のデータベースへの upgrade は、経路が rev を通るならベースラインの文を実行して rev を stamp し、
+rev 以降のリビジョンだけを適用する。既存のデータベースはこれまで通りリビジョンを順に辿る
+"""
+
+import json
+from typing import Mapping, NamedTuple, Optional
+
+BASELINE_FORMAT = 1
+
+
+def baseline_name(dialect: str) -> str:
+    return f"baseline.{dialect}.json"
+
+
+class Baseline(NamedTuple):
+    revision: str
+    dialect: str
+    statements: list[str]
+
+    def dumps(self) -> str:
+        return json.dumps(
+            {
+                "format": BASELINE_FORMAT,
+                "revision": self.revision,
+                "dialect": self.dialect,
+                "statements": self.statements,
+            },
+            indent=1,
+        )
+
+    @classmethod
+    def loads(cls, content: str) -> "Baseline":
+        value = json.loads(content)
+        if value.get("format") != BASELINE_FORMAT:
+            raise ValueError(f"unsupported baseline format: {value.get('format')}")
+        return cls(value["revision"], value["dialect"], value["statements"])
+
+
+def read_baseline(records: Mapping[str, str], dialect: str) -> Optional[Baseline]:
+    content = records.get(baseline_name(dialect))
+    return Baseline.loads(content) if content is not None else None
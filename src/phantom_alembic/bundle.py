@@ -0,0 +1,140 @@
+"""
+読み取り専用のファイルシステムでも起動を速くするための、コンパイル済みマイグレーションバンドル
+
+バンドルはマジック (と Python のバイトコードのマジックナンバー) に続けて、次の内容を marshal したもの:
+リビジョンストア (versions.jsonl) と env_content のハッシュ、env.py のコードオブジェクト、
+各リビジョンのファイル名・グラフ情報・コードオブジェクト、リビジョン以外のレコード (ベースラインなど)
+"""
+
+import marshal
+import sys
+from importlib.util import MAGIC_NUMBER
+from pathlib import Path
+from types import CodeType, MappingProxyType, ModuleType
+from typing import Any, Callable, Iterator, Mapping, NamedTuple, Optional
+
+from alembic import util
+from alembic.config import Config
+from alembic.script import Script
+from alembic.script.revision import RevisionMap
+
+from .cache import content_hash
+from .events import Observer
+from .script import LazyScript, PhantomScriptDirectory, load_module_from_code
+from .store import RevisionMetadata, RevisionRecords, atomic_write
+
+BUNDLE_MAGIC = b"PHANTOM-ALEMBIC-BUNDLE\n" + MAGIC_NUMBER
+BUNDLE_FORMAT = 1
+
+
+class BundleError(Exception):
+    pass
+
+
+class BundledRevision(NamedTuple):
+    name: str
+    metadata: Optional[RevisionMetadata]
+    code: CodeType
+
+
+class Bundle(NamedTuple):
+    store_hash: str
+    env_hash: str
+    env_code: CodeType
+    revisions: list[BundledRevision]
+    records: Mapping[str, str] = MappingProxyType({})
+
+    def verify(self, store_hash: Optional[str], env_content: str) -> None:
+        """
+        バンドルが現在のリビジョンストア (アーカイブを含む archive.history_digest) と env_content から作られたものか確かめる
+        (ストアが無い環境では store_hash に None を渡し、バンドルをそのまま信用する)
+        """
+        if self.env_hash != content_hash(env_content.encode("utf-8")):
+            raise BundleError("bundle was built from a different env_content; rebuild it with `phantom_alembic bundle`")
+        if store_hash is not None and self.store_hash != store_hash:
+            raise BundleError("bundle is stale for the revision store; rebuild it with `phantom_alembic bundle`")
+
+
+def build_bundle(records: RevisionRecords, store_hash: str, env_content: str) -> bytes:
+    revisions = []
+    others: dict[str, str] = {}
+    for name in sorted(records):
+        if not name.endswith(".py"):
+            others[name] = records[name]
+            continue
+        metadata = records.metadata.get(name)
+        revisions.append(
+            (
+                name,
+                tuple(metadata) if metadata is not None else None,
+                compile(records[name], name, "exec", dont_inherit=True),
+            )
+        )
+    payload = {
+        "format": BUNDLE_FORMAT,
+        "store_hash": store_hash,
+        "env_hash": content_hash(env_content.encode("utf-8")),
+        "env": compile(env_content, "env.py", "exec", dont_inherit=True),
+        "revisions": revisions,
+        "records": others,
+    }
+    return BUNDLE_MAGIC + marshal.dumps(payload)
+
+
+def write_bundle(path: Path, records: RevisionRecords, store_hash: str, env_content: str) -> None:
+    atomic_write(path, build_bundle(records, store_hash, env_content))
+
+
+def read_bundle(path: Path) -> Bundle:
+    with open(path, "rb") as f:
+        data = f.read()
+    if not data.startswith(BUNDLE_MAGIC):
+        raise BundleError(f"{path} is not a bundle built by this Python version ({sys.version.split()[0]})")
+    try:
+        payload: dict[str, Any] = marshal.loads(data[len(BUNDLE_MAGIC) :])
+    except (EOFError, ValueError, TypeError) as e:
+        raise BundleError(f"{path} is corrupted") from e
+    if payload.get("format") != BUNDLE_FORMAT:
+        raise BundleError(f"unsupported bundle format: {payload.get('format')}")
+    return Bundle(
+        payload["store_hash"],
+        payload["env_hash"],
+        payload["env"],
+        [
+            BundledRevision(name, RevisionMetadata(*metadata) if metadata is not None else None, code)
+            for name, metadata, code in payload["revisions"]
+        ],
+        payload.get("records", {}),
+    )
+
+
+class BundleScriptDirectory(PhantomScriptDirectory):
+    """
+    バンドルのコードオブジェクトからリビジョンマップを構築する ScriptDirectory (ソースのコンパイルを行わない)
+    """
+
+    _bundle: Bundle
+
+    @classmethod
+    def from_bundle(cls, config: Config, bundle: Bundle, emit: Optional[Observer] = None) -> "BundleScriptDirectory":
+        script_directory = cls._from_config(config, emit)
+        script_directory._bundle = bundle
+        script_directory.revision_map = RevisionMap(script_directory._load_revisions)
+        return script_directory
+
+    def _load_revisions(self) -> Iterator[Script]:
+        for revision in self._bundle.revisions:
+            path = self._singular_version_location / revision.name
+            if revision.metadata is not None:
+                yield LazyScript(revision.metadata, path, self._code_loader(revision, path))
+                continue
+            module = self._code_loader(revision, path)()
+            if not hasattr(module, "revision"):
+                raise util.CommandError(f"Could not determine revision id from filename {revision.name}.")
+            yield Script(module, module.revision, path)
+
+    def _code_loader(self, revision: BundledRevision, path: Path) -> Callable[[], ModuleType]:
+        return self._observed(revision.name, lambda: load_module_from_code(revision.name, revision.code, path))
+
+    def run_env(self) -> None:
+        load_module_from_code("env.py", self._bundle.env_code, Path(self.env_py_location))
@@ -0,0 +1,155 @@
+"""
+PhantomAlembic.context() が展開する alembic のディレクトリツリーを、実行をまたいで再利用するキャッシュ
+
+エントリはリビジョンストアのパスと env_content / ini_content のハッシュごとに作る。エントリ内の manifest.json には
+ツリー全体のキー (versions.jsonl / env_content / ini_content のハッシュ) とファイルごとのハッシュを記録し、
+キーが一致すれば何も書き込まず (manifest.json の mtime だけを更新する)、一致しなければ内容の変わったファイルだけを書き直す。
+ツリーは同じパスに残るので、alembic の import が作った __pycache__ もそのまま再利用される
+
+コマンドの実行中はエントリの .lock を共有ロックし (同じエントリで複数のコマンドが並行して動ける)、
+ツリーを同期・書き戻す間だけ .build.lock を排他ロックする。evict は .lock を待たずに排他ロックできたエントリだけを消す
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import Any, Iterable, NamedTuple, Optional
+
+from .lock import try_file_lock
+from .store import atomic_write
+
+MANIFEST_FILENAME = "manifest.json"
+LOCK_FILENAME = ".lock"
+BUILD_LOCK_FILENAME = ".build.lock"
+
+
+def content_hash(*parts: bytes) -> str:
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(hashlib.sha256(part).digest())
+    return h.hexdigest()
+
+
+class ManifestFile(NamedTuple):
+    hash: str
+    mtime_ns: int
+
+
+class Manifest(NamedTuple):
+    key: Optional[str]
+    files: dict[str, ManifestFile]
+
+    @classmethod
+    def read(cls, entry_path: Path) -> "Manifest":
+        try:
+            with open(entry_path / MANIFEST_FILENAME, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            return cls(data["key"], {name: ManifestFile(*value) for name, value in data["files"].items()})
+        except (OSError, ValueError, KeyError, TypeError):
+            return cls(None, {})
+
+    def write(self, entry_path: Path) -> None:
+        data: dict[str, Any] = {"key": self.key, "files": {name: list(value) for name, value in self.files.items()}}
+        atomic_write(entry_path / MANIFEST_FILENAME, json.dumps(data).encode("utf-8"))
+
+    @staticmethod
+    def touch(entry_path: Path) -> None:
+        """
+        エントリを使ったことを記録する (evict は manifest の mtime を最後に使った時刻とみなす)
+        """
+        try:
+            os.utime(entry_path / MANIFEST_FILENAME)
+        except FileNotFoundError:
+            pass
+
+
+def remove_bytecode(path: Path) -> None:
+    """
+    同じ秒・同じサイズで書き換えられたソースに古い .pyc が使われないよう、対応する .pyc を消す
+    """
+    pycache = path.parent / "__pycache__"
+    if pycache.is_dir():
+        for pyc in pycache.glob(f"{path.stem}.*.pyc"):
+            pyc.unlink(missing_ok=True)
+
+
+class MaterializationCache:
+    def __init__(
+        self, root: Path, max_bytes: Optional[int] = 512 * 1024 * 1024, max_age: Optional[float] = 30 * 24 * 3600
+    ) -> None:
+        self._root = root
+        self._max_bytes = max_bytes
+        self._max_age = max_age
+
+    @property
+    def root(self) -> Path:
+        return self._root
+
+    def entry_path(self, store_path: Optional[Path], env_content: str, ini_content: Optional[str]) -> Path:
+        """
+        リビジョンストアごとのエントリ (同じ env / ini で別のストアを使うプロジェクトが cache_dir を共有しても、
+        互いのツリーを書き換え合わない)。ファイルを持たないストアは1つのエントリを共有する
+        """
+        key = content_hash(
+            str(store_path.resolve() if store_path is not None else "").encode("utf-8"),
+            env_content.encode("utf-8"),
+            (ini_content or "").encode("utf-8"),
+        )
+        return self.root / key[:32]
+
+    def evict(self, keep: Iterable[Path] = ()) -> None:
+        """
+        max_age より古いエントリを消し、合計サイズが max_bytes を超えていれば古い順に消す
+        使用中のエントリ (.lock を他のコンテキストがロックしているもの) は消さない
+        """
+        if not self.root.is_dir():
+            return
+        keep = {p.resolve() for p in keep}
+        entries = []
+        for entry in self.root.iterdir():
+            if not entry.is_dir() or entry.resolve() in keep:
+                continue
+            try:
+                last_used = (entry / MANIFEST_FILENAME).stat().st_mtime
+            except FileNotFoundError:
+                last_used = entry.stat().st_mtime
+            entries.append((last_used, entry))
+        entries.sort()
+        now = time.time()
+        if self._max_age is not None:
+            for last_used, entry in [e for e in entries if now - e[0] > self._max_age]:
+                if _remove_unused(entry):
+                    entries.remove((last_used, entry))
+        if self._max_bytes is not None:
+            total = sum(_tree_size(entry) for entry in self.root.iterdir() if entry.is_dir())
+            for _, entry in entries:
+                if total <= self._max_bytes:
+                    break
+                size = _tree_size(entry)
+                if _remove_unused(entry):
+                    total -= size
+
+
+def _remove_unused(entry: Path) -> bool:
+    """
+    エントリのロックを待たずに取れた場合だけ、ロックしたまま消す
+    (消している間にロックを待っていたコンテキストは、ロックファイルが消えたことに気付いてエントリを作り直す)
+    """
+    with try_file_lock(entry / LOCK_FILENAME) as locked:
+        if locked:
+            shutil.rmtree(entry, ignore_errors=True)
+    return locked
+
+
+def _tree_size(path: Path) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for fn in files:
+            try:
+                total += os.lstat(os.path.join(root, fn)).st_size
+            except FileNotFoundError:
+                pass
+    return total
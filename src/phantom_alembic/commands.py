@@ -0,0 +1,330 @@
+"""
+alembic.command の各コマンドを、ScriptDirectory.from_config ではなく呼び出し側が用意した
+ScriptDirectory に対して実行する
+"""
+
+from functools import wraps
+from typing import (
+    Any,
+    Callable,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+    TextIO,
+    Tuple,
+    Union,
+    cast,
+)
+
+from alembic import autogenerate as autogen
+from alembic import util
+from alembic.config import Config
+from alembic.runtime.environment import EnvironmentContext
+from alembic.runtime.migration import MigrationContext, MigrationStep, StampStep
+from alembic.script import Script, ScriptDirectory
+from alembic.script.revision import RevisionError
+
+from .baseline import Baseline
+from .events import Observer, StepTimer
+from .reflection import ReflectionCache, ReflectionScope, autogenerate_configured
+
+
+def revision(
+    config: Config,
+    script_directory: ScriptDirectory,
+    message: Optional[str] = None,
+    autogenerate: bool = False,
+    scope: Optional[ReflectionScope] = None,
+    reflection_cache: Optional[ReflectionCache] = None,
+) -> Union[Optional[Script], List[Optional[Script]]]:
+    revision_context = autogen.RevisionContext(
+        config,
+        script_directory,
+        dict(
+            message=message,
+            autogenerate=autogenerate,
+            sql=False,
+            head="head",
+            splice=False,
+            branch_label=None,
+            version_path=None,
+            rev_id=None,
+            depends_on=None,
+        ),
+    )
+
+    def retrieve_migrations(rev: Tuple[str, ...], context: MigrationContext) -> Iterable[Any]:
+        if autogenerate:
+            with autogenerate_configured(context, rev, scope, reflection_cache):
+                revision_context.run_autogenerate(rev, context)
+        else:
+            revision_context.run_no_autogenerate(rev, context)
+        return []
+
+    if autogenerate or util.asbool(config.get_main_option("revision_environment")):
+        with EnvironmentContext(
+            config,
+            script_directory,
+            fn=retrieve_migrations,
+            as_sql=False,
+            template_args=revision_context.template_args,
+            revision_context=revision_context,
+        ):
+            script_directory.run_env()
+
+    scripts = [script for script in revision_context.generate_scripts()]
+    if len(scripts) == 1:
+        return scripts[0]
+    return scripts
+
+
+def check(
+    config: Config,
+    script_directory: ScriptDirectory,
+    scope: Optional[ReflectionScope] = None,
+    reflection_cache: Optional[ReflectionCache] = None,
+) -> None:
+    revision_context = autogen.RevisionContext(
+        config,
+        script_directory,
+        dict(
+            message=None,
+            autogenerate=True,
+            sql=False,
+            head="head",
+            splice=False,
+            branch_label=None,
+            version_path=None,
+            rev_id=None,
+            depends_on=None,
+        ),
+    )
+
+    def retrieve_migrations(rev: Tuple[str, ...], context: MigrationContext) -> Iterable[Any]:
+        with autogenerate_configured(context, rev, scope, reflection_cache):
+            revision_context.run_autogenerate(rev, context)
+        return []
+
+    with EnvironmentContext(
+        config,
+        script_directory,
+        fn=retrieve_migrations,
+        as_sql=False,
+        template_args=revision_context.template_args,
+        revision_context=revision_context,
+    ):
+        script_directory.run_env()
+
+    migration_script = revision_context.generated_revisions[-1]
+    diffs = []
+    for upgrade_ops in migration_script.upgrade_ops_list:
+        diffs.extend(upgrade_ops.as_diffs())
+    if diffs:
+        raise util.AutogenerateDiffsDetected(
+            f"New upgrade operations detected: {diffs}", revision_context=revision_context, diffs=diffs
+        )
+    config.print_stdout("No new upgrade operations detected.")
+
+
+def _split_range(revision: str, sql: bool) -> Tuple[Optional[str], str]:
+    if ":" not in revision:
+        return None, revision
+    if not sql:
+        raise util.CommandError("Range revision not allowed")
+    starting_rev, destination_rev = revision.split(":", 2)
+    return starting_rev, destination_rev
+
+
+class BaselineStep(StampStep):
+    """
+    空のデータベースにベースラインの文を実行し、ベースラインのリビジョンを stamp するステップ
+    """
+
+    def __init__(self, baseline: Baseline, context: MigrationContext, script_directory: ScriptDirectory) -> None:
+        super().__init__((), baseline.revision, True, True, script_directory.revision_map)
+        self._baseline = baseline
+        self._context = context
+        self.migration_fn = self.baseline
+
+    def baseline(self, **kw: Any) -> None:
+        impl = self._context.impl
+        for statement in self._baseline.statements:
+            if self._context.as_sql:
+                impl.static_output(statement + impl.command_terminator)
+            else:
+                assert self._context.connection is not None
+                self._context.connection.exec_driver_sql(statement)
+
+
+def _baseline_steps(
+    script_directory: ScriptDirectory, destination: str, baseline: Baseline, context: MigrationContext
+) -> Optional[List[MigrationStep]]:
+    """
+    空のデータベースから destination への経路がベースラインのリビジョンを通るなら、
+    ベースラインを適用してから残りのリビジョンを適用するステップ (通らなければ None)
+    """
+    revision_map = script_directory.revision_map
+    try:
+        targets = revision_map.get_revisions(destination)
+        ancestors = {r.revision for r in revision_map._get_ancestor_nodes(targets)}
+        if baseline.revision not in ancestors:
+            return None
+        steps: List[MigrationStep] = [BaselineStep(baseline, context, script_directory)]
+        steps.extend(script_directory._upgrade_revs(destination, baseline.revision))
+    except (util.CommandError, RevisionError):
+        return None
+    return steps
+
+
+def upgrade(
+    config: Config,
+    script_directory: ScriptDirectory,
+    revision: str,
+    sql: bool = False,
+    tag: Optional[str] = None,
+    emit: Optional[Observer] = None,
+    baseline: Optional[Callable[[str], Optional[Baseline]]] = None,
+) -> None:
+    """
+    baseline は dialect 名からベースラインを返す関数 (データベースが空のときだけ呼ぶ)
+    """
+    starting_rev, revision = _split_range(revision, sql)
+
+    def upgrade(rev: Any, context: MigrationContext) -> Iterable[Any]:
+        if not rev and baseline is not None:
+            found = baseline(context.dialect.name)
+            steps = _baseline_steps(script_directory, revision, found, context) if found is not None else None
+            if steps is not None:
+                return steps
+        return script_directory._upgrade_revs(revision, rev)
+
+    with EnvironmentContext(
+        config,
+        script_directory,
+        fn=StepTimer(emit).wrap(upgrade) if emit is not None else upgrade,
+        as_sql=sql,
+        starting_rev=starting_rev,
+        destination_rev=revision,
+        tag=tag,
+    ):
+        script_directory.run_env()
+
+
+def downgrade(
+    config: Config,
+    script_directory: ScriptDirectory,
+    revision: str,
+    sql: bool = False,
+    tag: Optional[str] = None,
+    emit: Optional[Observer] = None,
+) -> None:
+    starting_rev, revision = _split_range(revision, sql)
+    if sql and starting_rev is None:
+        raise util.CommandError("downgrade with --sql requires <fromrev>:<torev>")
+
+    def downgrade(rev: Any, context: MigrationContext) -> Iterable[Any]:
+        return script_directory._downgrade_revs(revision, rev)
+
+    with EnvironmentContext(
+        config,
+        script_directory,
+        fn=StepTimer(emit).wrap(downgrade) if emit is not None else downgrade,
+        as_sql=sql,
+        starting_rev=starting_rev,
+        destination_rev=revision,
+        tag=tag,
+    ):
+        script_directory.run_env()
+
+
+def stamp(
+    config: Config,
+    script_directory: ScriptDirectory,
+    revision: Union[str, Sequence[str]],
+    sql: bool = False,
+    tag: Optional[str] = None,
+    purge: bool = False,
+    emit: Optional[Observer] = None,
+) -> None:
+    starting_revs = set()
+    destination_revs = []
+    for _revision in util.to_list(revision):
+        starting_rev, _revision = _split_range(_revision, sql)
+        starting_revs.add(starting_rev)
+        destination_revs.append(_revision)
+    if len(starting_revs) > 1:
+        raise util.CommandError("Stamp operation with --sql only supports a single starting revision at a time")
+
+    def do_stamp(rev: Any, context: MigrationContext) -> Iterable[Any]:
+        return script_directory._stamp_revs(util.to_tuple(destination_revs), rev)
+
+    with EnvironmentContext(
+        config,
+        script_directory,
+        fn=StepTimer(emit).wrap(do_stamp) if emit is not None else do_stamp,
+        as_sql=sql,
+        starting_rev=starting_revs.pop(),
+        destination_rev=util.to_tuple(destination_revs),
+        tag=tag,
+        purge=purge,
+    ):
+        script_directory.run_env()
+
+
+class _StatementRecorder:
+    """
+    オフライン SQL の出力先の代わりに置き、static_output が1文ごとに書き込む内容を文として集める
+    """
+
+    def __init__(self, terminator: str) -> None:
+        self._terminator = terminator
+        self.statements: List[str] = []
+
+    def write(self, text: str) -> int:
+        statement = text.strip()
+        if statement.endswith(self._terminator):
+            statement = statement[: -len(self._terminator)].rstrip()
+        if statement:
+            self.statements.append(statement)
+        return len(text)
+
+    def flush(self) -> None:
+        pass
+
+
+def squash(config: Config, script_directory: ScriptDirectory, revision: str) -> Baseline:
+    """
+    空のデータベースから revision までの upgrade をオフラインで実行し、
+    各マイグレーションが出力した文 (alembic_version の操作は含まない) をベースラインとして返す
+    """
+    target = script_directory.get_revision(revision)
+    if target is None:
+        raise util.CommandError(f"Cannot squash to {revision}")
+    statements: List[str] = []
+    dialects: List[str] = []
+
+    def recorded(context: MigrationContext, migration_fn: Callable[..., None]) -> Callable[..., None]:
+        @wraps(migration_fn)
+        def run(**kw: Any) -> None:
+            output_buffer = context.impl.output_buffer
+            recorder = _StatementRecorder(context.impl.command_terminator)
+            context.impl.output_buffer = cast(TextIO, recorder)
+            try:
+                migration_fn(**kw)
+            finally:
+                context.impl.output_buffer = output_buffer
+            statements.extend(recorder.statements)
+
+        return run
+
+    def capture(rev: Any, context: MigrationContext) -> Iterable[Any]:
+        dialects.append(context.dialect.name)
+        steps = script_directory._upgrade_revs(target.revision, rev)
+        for step in steps:
+            step.migration_fn = recorded(context, step.migration_fn)
+        return steps
+
+    with EnvironmentContext(config, script_directory, fn=capture, as_sql=True, destination_rev=target.revision):
+        script_directory.run_env()
+    return Baseline(target.revision, dialects[0], statements)
@@ -1,20 +1,85 @@
-import json
+import io
+import sys
 from contextlib import AbstractContextManager, contextmanager
+from functools import partial
 from pathlib import Path
 from tempfile import TemporaryDirectory
 from types import TracebackType
-from typing import Generator, Optional, Type
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    ContextManager,
+    Generator,
+    Hashable,
+    Iterable,
+    Optional,
+    Sequence,
+    TextIO,
+    Type,
+    TypeVar,
+    Union,
+    cast,
+)
 
-from alembic import command
-from alembic.config import Config
+from .archive import archive_revisions, history_digest, open_archive, with_archive
+from .cache import (
+    BUILD_LOCK_FILENAME,
+    LOCK_FILENAME,
+    Manifest,
+    ManifestFile,
+    MaterializationCache,
+    content_hash,
+    remove_bytecode,
+)
+from .defaults import (
+    ASYNC_ENV_CONTENT_TEMPLATE,
+    ENV_CONTENT_TEMPLATE,
+    SCRIPT_MAKO_STRING,
+)
+from .events import Event, Observer, fan_out, phase
+from .lock import file_lock
+from .report import UpgradeReport, collect_report
+from .store import (
+    MemoryRecords,
+    RevisionRecords,
+    StoreBackend,
+    atomic_write,
+    open_store,
+    record_digest,
+)
 
-from .defaults import ENV_CONTENT_TEMPLATE, SCRIPT_MAKO_STRING
+if TYPE_CHECKING:
+    from alembic.config import Config
+    from alembic.script import ScriptDirectory
+    from sqlalchemy.engine import Connection, Engine
+    from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+    from .baseline import Baseline
+    from .bundle import Bundle, BundleScriptDirectory
+    from .metadata import MetadataProvider, MetadataSource
+    from .parallel import UpgradeResult
+    from .script import PhantomScriptDirectory
+    from .session import PhantomAlembicSession
+    from .template import DatabaseTemplate
+
+    Connectable = Union[Engine, Connection]
+    AsyncConnectable = Union[AsyncEngine, AsyncConnection]
+
+
+_C = TypeVar("_C", bound="PhantomAlembicContext")
+_R = TypeVar("_R")
 
 
 class PhantomAlembicContext(AbstractContextManager["PhantomAlembicContext"]):
     def __init__(self, phantom_alembic: "PhantomAlembic", dir_path: Path) -> None:
         self._phantom_alembic = phantom_alembic
         self._dir_path = dir_path
+        self._version_store = phantom_alembic.open_store()
+        self._records: RevisionRecords = MemoryRecords({}, {})
+        self._loaded_names: frozenset[str] = frozenset()
+        self._archived_names: frozenset[str] = frozenset()
+        self._alembic_config: Optional["Config"] = None
 
     @property
     def phantom_alembic(self) -> "PhantomAlembic":
@@ -24,6 +89,10 @@ class PhantomAlembicContext(AbstractContextManager["PhantomAlembicContext"]):
     def version_data_path(self) -> Path:
         return self.phantom_alembic.version_data_path
 
+    @property
+    def version_store(self) -> StoreBackend:
+        return self._version_store
+
     @property
     def migrations_path(self) -> Path:
         return self.phantom_alembic._get_migrations_path(self.dir_path)
@@ -37,19 +106,42 @@ class PhantomAlembicContext(AbstractContextManager["PhantomAlembicContext"]):
         return self._dir_path
 
     @property
-    def alembic_config(self) -> Config:
-        return self.phantom_alembic.gen_alembic_config(self.dir_path)
+    def alembic_config(self) -> "Config":
+        if self._alembic_config is None:
+            self._alembic_config = self.phantom_alembic.gen_alembic_config(self.dir_path)
+        return self._alembic_config
+
+    @property
+    def script_directory(self) -> "ScriptDirectory":
+        from alembic.script import ScriptDirectory
+
+        return ScriptDirectory.from_config(self.alembic_config)
+
+    def baseline(self, dialect: str) -> Optional["Baseline"]:
+        """
+        コンテキストが読み込んだレコードにある dialect のベースライン (upgrade の途中でストアを開き直さない)
+        """
+        from .baseline import read_baseline
+
+        return read_baseline(self._records, dialect)
 
     def __exit__(
         self, exc_type: Optional[Type[BaseException]], exc_val: Optional[BaseException], exc_tb: Optional[TracebackType]
     ) -> None:
         if exc_val is not None:
             raise exc_val
-        with open(self.version_data_path, "w", encoding="utf-8") as fout:
-            for fn in self.version_path.glob("*.py"):
-                with open(fn, "r", encoding="utf-8") as fin:
-                    fout.write(json.dumps({"name": fn.name, "content": fin.read()}))
-                    fout.write("\n")
+        records = {}
+        for fn in self.version_path.glob("*.py"):
+            # アーカイブから展開したリビジョンは凍結されているので書き戻さない
+            if fn.name in self._archived_names:
+                continue
+            with open(fn, "r", encoding="utf-8") as fin:
+                records[fn.name] = fin.read()
+        # 削除は展開したリビジョンに対してだけ行い、並行して他のプロセスが追加したレコードや
+        # リビジョン以外のレコード (ベースラインなど) は残す
+        loaded_revisions = {name for name in self._loaded_names if name.endswith(".py")}
+        self.version_store.put(records, removed=loaded_revisions - records.keys())
+        self.version_store.close()
 
     def __enter__(self) -> "PhantomAlembicContext":
         self.version_path.mkdir(parents=True, exist_ok=True)
@@ -60,32 +152,320 @@ class PhantomAlembicContext(AbstractContextManager["PhantomAlembicContext"]):
             f.write(self.phantom_alembic.env_content)
         with open(self.migrations_path / "script.py.mako", "w", encoding="utf-8") as f:
             f.write(SCRIPT_MAKO_STRING)
-        if self.version_data_path.exists():
-            with open(self.version_data_path, "r", encoding="utf-8") as f:
-                version_data = [json.loads(ln.strip()) for ln in f.readlines()]
-        else:
-            version_data = []
-        for version_data_item in version_data:
-            with open(self.version_path / version_data_item["name"], "w", encoding="utf-8") as f:
-                f.write(version_data_item["content"])
+        tail = self._records = self.version_store.load()
+        self._loaded_names = frozenset(tail)
+        # ディスク上の alembic は全履歴を必要とするので、アーカイブのリビジョンも展開する
+        records = with_archive(tail, open_archive(self.version_store))
+        self._archived_names = frozenset(records.keys() - tail.keys())
+        for name, content in records.items():
+            with open(self.version_path / name, "w", encoding="utf-8") as f:
+                f.write(content)
+        return self
+
+
+class PhantomAlembicMemoryContext(PhantomAlembicContext):
+    """
+    リビジョンを一時ディレクトリに書き出さず、versions.jsonl のレコードから直接 alembic に渡すコンテキスト
+    ディスクに書き込むのは alembic.ini と revision コマンドが生成する新しいリビジョンファイルのみ
+    """
+
+    def __init__(self, phantom_alembic: "PhantomAlembic", dir_path: Path) -> None:
+        super().__init__(phantom_alembic, dir_path)
+        self._script_directory: Optional["PhantomScriptDirectory"] = None
+
+    @property
+    def script_directory(self) -> "PhantomScriptDirectory":
+        from .script import PhantomScriptDirectory
+
+        if self._script_directory is None:
+            self._script_directory = PhantomScriptDirectory.from_records(
+                self.alembic_config,
+                self._records,
+                self.phantom_alembic.env_content,
+                self._records.metadata,
+                emit=self.phantom_alembic.emit,
+                archive=open_archive(self.version_store),
+            )
+        return self._script_directory
+
+    def __exit__(
+        self, exc_type: Optional[Type[BaseException]], exc_val: Optional[BaseException], exc_tb: Optional[TracebackType]
+    ) -> None:
+        if exc_val is not None:
+            raise exc_val
+        records = {}
+        for fn in self.version_path.glob("*.py"):
+            with open(fn, "r", encoding="utf-8") as fin:
+                records[fn.name] = fin.read()
+        self.version_store.put(records)
+        self.version_store.close()
+
+    def __enter__(self) -> "PhantomAlembicMemoryContext":
+        # 空の versions ディレクトリを先に作っておく (無いと revision コマンドが "Creating directory" を標準出力に書く)
+        self.version_path.mkdir(parents=True, exist_ok=True)
+        if self.phantom_alembic.ini_content is not None:
+            with open(self.dir_path / "alembic.ini", "w", encoding="utf-8") as f:
+                f.write(self.phantom_alembic.ini_content)
+        self._records = self.version_store.load()
+        return self
+
+
+class PhantomAlembicCachedContext(PhantomAlembicContext):
+    """
+    MaterializationCache のエントリにツリーを展開するコンテキスト
+    前回から変わったファイルだけを書き直し、__exit__ でも変更のあったリビジョンファイルだけを読み戻す
+    """
+
+    def __init__(self, phantom_alembic: "PhantomAlembic", cache: MaterializationCache) -> None:
+        super().__init__(
+            phantom_alembic,
+            cache.entry_path(
+                phantom_alembic.open_store().path, phantom_alembic.env_content, phantom_alembic.ini_content
+            ),
+        )
+        self._cache = cache
+        self._manifest = Manifest(None, {})
+        self._lock: Optional[AbstractContextManager[None]] = None
+        self._is_new_entry = False
+
+    def _key(self) -> str:
+        archive = open_archive(self.version_store)
+        return content_hash(
+            self.version_store.digest().encode("ascii"),
+            (archive.digest() if archive is not None else "").encode("ascii"),
+            self.phantom_alembic.env_content.encode("utf-8"),
+            (self.phantom_alembic.ini_content or "").encode("utf-8"),
+        )
+
+    def _relative(self, path: Path) -> str:
+        return path.relative_to(self.dir_path).as_posix()
+
+    def __enter__(self) -> "PhantomAlembicCachedContext":
+        self._is_new_entry = not self.dir_path.exists()
+        self._lock = self._acquire()
+        try:
+            with file_lock(self.dir_path / BUILD_LOCK_FILENAME):
+                self._sync()
+        except BaseException:
+            self._lock.__exit__(None, None, None)
+            raise
+        return self
+
+    def _acquire(self) -> AbstractContextManager[None]:
+        while True:
+            self.version_path.mkdir(parents=True, exist_ok=True)
+            lock = file_lock(self.dir_path / LOCK_FILENAME, shared=True)
+            try:
+                lock.__enter__()
+            except FileNotFoundError:
+                # ロックを待っている間に evict がエントリを消したので作り直す
+                continue
+            return lock
+
+    def _sync(self) -> None:
+        manifest = Manifest.read(self.dir_path)
+        key = self._key()
+        tail = self._records = self.version_store.load()
+        if manifest.key == key:
+            Manifest.touch(self.dir_path)
+            self._manifest = manifest
+            self._archived_names = self._untracked_names(tail)
+            return
+        records = with_archive(tail, open_archive(self.version_store))
+        files: dict[str, tuple[str, Callable[[], str]]] = {
+            "migrations/env.py": (
+                content_hash(self.phantom_alembic.env_content.encode("utf-8")),
+                lambda: self.phantom_alembic.env_content,
+            ),
+            "migrations/script.py.mako": (content_hash(SCRIPT_MAKO_STRING.encode("utf-8")), lambda: SCRIPT_MAKO_STRING),
+        }
+        if self.phantom_alembic.ini_content is not None:
+            ini_content = self.phantom_alembic.ini_content
+            files["alembic.ini"] = (content_hash(ini_content.encode("utf-8")), lambda: ini_content)
+        for name in records:
+            files[self._relative(self.version_path / name)] = (
+                records.digest(name),
+                partial(records.__getitem__, name),
+            )
+        synced: dict[str, ManifestFile] = {}
+        for relative, (digest, read_content) in files.items():
+            path = self.dir_path / relative
+            cached = manifest.files.get(relative)
+            if cached is None or cached.hash != digest or not path.exists():
+                # 同じエントリで実行中の他のコマンドが書きかけのファイルを読まないよう、rename で置き換える
+                atomic_write(path, read_content().encode("utf-8"), durable=False)
+                remove_bytecode(path)
+            synced[relative] = ManifestFile(digest, path.stat().st_mtime_ns)
+        for relative in manifest.files.keys() - files.keys():
+            (self.dir_path / relative).unlink(missing_ok=True)
+        self._manifest = Manifest(key, synced)
+        self._manifest.write(self.dir_path)
+        self._archived_names = self._untracked_names(tail)
+
+    def _untracked_names(self, tail: RevisionRecords) -> frozenset[str]:
+        """
+        展開したリビジョンのうち、ストアの末尾セグメントに無いもの (アーカイブから展開したもの)
+        """
+        version_prefix = self._relative(self.version_path) + "/"
+        names = {
+            relative[len(version_prefix) :] for relative in self._manifest.files if relative.startswith(version_prefix)
+        }
+        return frozenset(names - tail.keys())
+
+    def __exit__(
+        self, exc_type: Optional[Type[BaseException]], exc_val: Optional[BaseException], exc_tb: Optional[TracebackType]
+    ) -> None:
+        assert self._lock is not None
+        try:
+            if exc_val is not None:
+                raise exc_val
+            with file_lock(self.dir_path / BUILD_LOCK_FILENAME):
+                self._write_back()
+        finally:
+            self.version_store.close()
+            self._lock.__exit__(None, None, None)
+        if self._is_new_entry:
+            self._cache.evict(keep=[self.dir_path])
+
+    def _write_back(self) -> None:
+        changed: dict[str, str] = {}
+        present: set[str] = set()
+        for fn in self.version_path.glob("*.py"):
+            present.add(fn.name)
+            if fn.name in self._archived_names:
+                continue
+            cached = self._manifest.files.get(self._relative(fn))
+            if cached is None or cached.mtime_ns != fn.stat().st_mtime_ns:
+                with open(fn, "r", encoding="utf-8") as fin:
+                    changed[fn.name] = fin.read()
+        version_prefix = self._relative(self.version_path) + "/"
+        removed = [
+            relative[len(version_prefix) :]
+            for relative in self._manifest.files
+            if relative.startswith(version_prefix)
+            and relative.endswith(".py")
+            and relative[len(version_prefix) :] not in present
+            and relative[len(version_prefix) :] not in self._archived_names
+        ]
+        if not self.version_store.put(changed, removed=removed):
+            return
+        # 並行して実行した他のコマンドが書き戻した分を失わないよう、最新の manifest に重ねる
+        files = dict(Manifest.read(self.dir_path).files or self._manifest.files)
+        for name in removed:
+            files.pop(self._relative(self.version_path / name), None)
+        for name, content in changed.items():
+            path = self.version_path / name
+            files[self._relative(path)] = ManifestFile(record_digest(name, content), path.stat().st_mtime_ns)
+        self._manifest = Manifest(self._key(), files)
+        self._manifest.write(self.dir_path)
+
+
+class PhantomAlembicBundleContext(PhantomAlembicContext):
+    """
+    build_bundle で作ったバンドルのコードオブジェクトからマイグレーションを実行するコンテキスト
+    リビジョンストアには書き込まない
+    """
+
+    def __init__(self, phantom_alembic: "PhantomAlembic", dir_path: Path, bundle: "Bundle") -> None:
+        super().__init__(phantom_alembic, dir_path)
+        self._bundle = bundle
+        self._records = MemoryRecords(dict(bundle.records), {})
+        self._script_directory: Optional["BundleScriptDirectory"] = None
+
+    @property
+    def script_directory(self) -> "BundleScriptDirectory":
+        from .bundle import BundleScriptDirectory
+
+        if self._script_directory is None:
+            self._script_directory = BundleScriptDirectory.from_bundle(
+                self.alembic_config, self._bundle, emit=self.phantom_alembic.emit
+            )
+        return self._script_directory
+
+    def __exit__(
+        self, exc_type: Optional[Type[BaseException]], exc_val: Optional[BaseException], exc_tb: Optional[TracebackType]
+    ) -> None:
+        if exc_val is not None:
+            raise exc_val
+
+    def __enter__(self) -> "PhantomAlembicBundleContext":
+        self.migrations_path.mkdir(parents=True, exist_ok=True)
+        if self.phantom_alembic.ini_content is not None:
+            with open(self.dir_path / "alembic.ini", "w", encoding="utf-8") as f:
+                f.write(self.phantom_alembic.ini_content)
         return self
 
 
+class FlushingWriter:
+    """
+    オフライン SQL をバッファに溜めずに書き出すため、書き込みのたびに flush するラッパー
+    """
+
+    def __init__(self, stream: TextIO) -> None:
+        self._stream = stream
+
+    def write(self, text: str) -> int:
+        written = self._stream.write(text)
+        self._stream.flush()
+        return written
+
+    def flush(self) -> None:
+        self._stream.flush()
+
+
 class PhantomAlembic:
     def __init__(
         self,
-        version_data_path: Path,
+        version_data_path: Union[Path, StoreBackend],
         ini_content: Optional[str] = None,
         env_content: Optional[str] = None,
+        in_memory: bool = True,
+        use_async_engine: bool = False,
+        cache_dir: Optional[Path] = None,
+        cache_max_bytes: Optional[int] = 512 * 1024 * 1024,
+        cache_max_age: Optional[float] = 30 * 24 * 3600,
+        bundle_path: Optional[Path] = None,
+        target_metadata: Optional["MetadataSource"] = None,
+        store_backend: str = "jsonl",
     ) -> None:
         self._ini_content = ini_content
-        self._version_data_path = version_data_path
+        self._version_data_path = version_data_path if isinstance(version_data_path, Path) else None
+        self._store = version_data_path if isinstance(version_data_path, StoreBackend) else None
+        self._store_backend = store_backend
         self._env_content = env_content
+        self._in_memory = in_memory
+        self._use_async_engine = use_async_engine
+        self._cache = (
+            MaterializationCache(cache_dir, max_bytes=cache_max_bytes, max_age=cache_max_age)
+            if cache_dir is not None
+            else None
+        )
+        self._bundle_path = bundle_path
+        self._target_metadata = target_metadata
+        self._heads_cache: Optional[tuple[Optional[Hashable], tuple[str, ...]]] = None
+        self._observers: list[Observer] = []
 
     @property
     def version_data_path(self) -> Path:
+        if self._version_data_path is None:
+            path = self.open_store().path
+            if path is None:
+                raise ValueError(f"{type(self._store).__name__} has no version data path")
+            return path
         return self._version_data_path
 
+    def open_store(self) -> StoreBackend:
+        """
+        リビジョンストアのバックエンド
+        パスを指定した場合は store_backend ("jsonl" / "sqlite") で開き、呼び出しごとに新しく開く。
+        StoreBackend を直接渡した場合は StoreBackend.reopen で別のハンドルを開く
+        (呼び出し側が close しても、渡されたインスタンスや開いているセッションのレコードは閉じない)
+        """
+        if self._store is not None:
+            return self._store.reopen()
+        assert self._version_data_path is not None
+        return open_store(self._version_data_path, self._store_backend)
+
     @property
     def ini_content(self) -> str | None:
         return self._ini_content
@@ -93,39 +473,457 @@ class PhantomAlembic:
     @property
     def env_content(self) -> str:
         if self._env_content is None:
-            return ENV_CONTENT_TEMPLATE.format()
+            template = ASYNC_ENV_CONTENT_TEMPLATE if self.use_async_engine else ENV_CONTENT_TEMPLATE
+            return template.format(imports="", metadata="None")
         return self._env_content
 
+    @property
+    def in_memory(self) -> bool:
+        return self._in_memory
+
+    @property
+    def use_async_engine(self) -> bool:
+        return self._use_async_engine
+
+    @property
+    def bundle_path(self) -> Optional[Path]:
+        """
+        指定されている場合、upgrade / downgrade はこのバンドルのコンパイル済みコードから実行する
+        """
+        return self._bundle_path
+
+    def add_observer(self, observer: Observer) -> None:
+        """
+        コマンドの各フェーズと各マイグレーションの所要時間を Event として observer に通知する
+        """
+        self._observers.append(observer)
+
+    def remove_observer(self, observer: Observer) -> None:
+        self._observers.remove(observer)
+
+    @property
+    def emit(self) -> Optional[Observer]:
+        """
+        observer が登録されていればイベントを配信する callable、無ければ None (計測をしない)
+        """
+        if not self._observers:
+            return None
+        return self._dispatch
+
+    def _dispatch(self, event: Event) -> None:
+        for observer in tuple(self._observers):
+            observer(event)
+
+    def _phase(self, name: str, **attributes: Any) -> ContextManager[None]:
+        return phase(self.emit, name, **attributes)
+
+    @contextmanager
+    def _entered(self, context: _C) -> Generator[_C, None, None]:
+        kind = type(context).__name__
+        with self._phase("context.enter", context=kind):
+            context.__enter__()
+        try:
+            yield context
+        except BaseException as e:
+            context.__exit__(type(e), e, e.__traceback__)
+            raise
+        with self._phase("context.exit", context=kind):
+            context.__exit__(None, None, None)
+
+    def _prepare_script_directory(self, context: PhantomAlembicContext) -> "ScriptDirectory":
+        with self._phase("script_directory"):
+            script_directory = context.script_directory
+            if self.emit is not None:
+                # リビジョンマップの構築 (リビジョンの読み込み) もこのフェーズで計測する
+                script_directory.revision_map.heads
+        return script_directory
+
+    @property
+    def target_metadata(self) -> Optional["MetadataSource"]:
+        """
+        autogenerate / check のときだけ解決する MetaData ('module:attribute' 形式のパスまたは callable)
+        """
+        return self._target_metadata
+
     @contextmanager
     def context(self) -> Generator[PhantomAlembicContext, None, None]:
+        """
+        alembic のディレクトリツリーをディスク上に展開したコンテキスト
+        cache_dir を指定した場合はキャッシュ済みのツリーを再利用する
+        """
+        if self._cache is not None:
+            with self._entered(PhantomAlembicCachedContext(self, self._cache)) as cached_context:
+                yield cached_context
+            return
         with TemporaryDirectory() as temp_dir:
             temp_dir_path = Path(temp_dir)
-            with PhantomAlembicContext(self, temp_dir_path) as context:
+            with self._entered(PhantomAlembicContext(self, temp_dir_path)) as context:
                 yield context
 
+    @contextmanager
+    def memory_context(self) -> Generator[PhantomAlembicMemoryContext, None, None]:
+        with TemporaryDirectory() as temp_dir:
+            temp_dir_path = Path(temp_dir)
+            with self._entered(PhantomAlembicMemoryContext(self, temp_dir_path)) as context:
+                yield context
+
+    @contextmanager
+    def bundle_context(self) -> Generator[PhantomAlembicBundleContext, None, None]:
+        bundle = self.load_bundle()
+        with TemporaryDirectory() as temp_dir:
+            with self._entered(PhantomAlembicBundleContext(self, Path(temp_dir), bundle)) as context:
+                yield context
+
+    @contextmanager
+    def session(self) -> Generator["PhantomAlembicSession", None, None]:
+        """
+        複数のコマンドを1つのコンテキストで実行するセッション (リビジョンストアへの書き込みは終了時の1回)
+        """
+        from .session import PhantomAlembicSession
+
+        with self._command_context() as context:
+            yield PhantomAlembicSession(self, context)
+
+    def _command_context(self) -> AbstractContextManager[PhantomAlembicContext]:
+        if self.in_memory:
+            return self.memory_context()
+        return self.context()
+
+    def _migration_context(self) -> AbstractContextManager[PhantomAlembicContext]:
+        if self.bundle_path is not None:
+            return self.bundle_context()
+        return self._command_context()
+
+    def _default_bundle_path(self) -> Path:
+        return self.version_data_path.with_name(self.version_data_path.name + ".bundle")
+
+    def bundle(self, path: Optional[Path] = None) -> Path:
+        """
+        env_content と全リビジョン (アーカイブしたものを含む) をコンパイルしたバンドルを書き出す
+        (既定の出力先は bundle_path、未指定なら versions.jsonl.bundle)
+        """
+        from .bundle import write_bundle
+
+        path = path or self.bundle_path or self._default_bundle_path()
+        store = self.open_store()
+        try:
+            write_bundle(path, with_archive(store.load(), open_archive(store)), history_digest(store), self.env_content)
+        finally:
+            store.close()
+        return path
+
+    def load_bundle(self) -> "Bundle":
+        """
+        bundle_path のバンドルを読み込み、リビジョンストアと env_content に対して検証する
+        """
+        from .bundle import read_bundle
+
+        bundle = read_bundle(self.bundle_path or self._default_bundle_path())
+        store = self.open_store()
+        bundle.verify(history_digest(store) if store.signature() is not None else None, self.env_content)
+        return bundle
+
+    def archive(self, before: str) -> list[str]:
+        """
+        before より前のリビジョン (before の祖先) を圧縮したアーカイブセグメント `<versions.jsonl>.archive` に移し、
+        移したファイル名を返す。移したリビジョンは、マイグレーションの経路がそこを通るときにだけ読み込まれる
+        """
+        with self._phase("command", command="archive", revision=before):
+            with self.memory_context() as context:
+                revision = context.script_directory.get_revision(before)
+            if revision is None:
+                raise ValueError(f"Cannot archive before {before}")
+            return archive_revisions(self.open_store(), revision.revision)
+
+    def database_template(self, template_dir: Path, revision: str = "head") -> "DatabaseTemplate":
+        """
+        revision までマイグレーションしたテンプレートデータベースを template_dir にキャッシュし、
+        そのコピーとしてデータベースを作る DatabaseTemplate (テストでの upgrade の繰り返しを省く)
+        """
+        from .template import DatabaseTemplate
+
+        return DatabaseTemplate(self, template_dir, revision)
+
     def _get_migrations_path(self, temp_dir_path: Path) -> Path:
         return temp_dir_path / "migrations"
 
     def _get_version_path(self, temp_dir_path: Path) -> Path:
         return self._get_migrations_path(temp_dir_path) / "versions"
 
-    def gen_alembic_config(self, asset_path: Path) -> Config:
-        if self.ini_content is not None:
-            config = Config(asset_path / "alembic.ini")
-        else:
-            config = Config()
-        config.set_main_option("script_location", str(self._get_migrations_path(asset_path)))
-        config.set_main_option("version_path", str(self._get_version_path(asset_path)))
+    def gen_alembic_config(self, asset_path: Path) -> "Config":
+        from alembic.config import Config
+
+        with self._phase("config"):
+            if self.ini_content is not None:
+                config = Config(asset_path / "alembic.ini", stdout=sys.stdout)
+            else:
+                config = Config(stdout=sys.stdout)
+            config.set_main_option("script_location", str(self._get_migrations_path(asset_path)))
+            config.set_main_option("version_path", str(self._get_version_path(asset_path)))
         return config
 
-    def revision(self, message: Optional[str] = None, autogenerate: bool = False) -> None:
-        with self.context() as context:
-            command.revision(
+    def revision(
+        self,
+        message: Optional[str] = None,
+        autogenerate: bool = False,
+        connection: Optional["Connectable"] = None,
+        schemas: Optional[Sequence[str]] = None,
+        tables: Optional[Sequence[str]] = None,
+        reflection_cache_dir: Optional[Path] = None,
+    ) -> None:
+        """
+        autogenerate のとき、schemas / tables (fnmatch パターン) を指定するとリフレクションの前に比較対象を絞り込む
+        reflection_cache_dir を指定すると、データベースのリビジョンが同じ間はリフレクション結果を再利用する
+        """
+        from . import commands
+
+        with self._phase("command", command="revision"), self._command_context() as context:
+            self._configure(context.alembic_config, connection, False, None)
+            if autogenerate:
+                self._configure_target_metadata(context.alembic_config, self._metadata_provider())
+            commands.revision(
                 context.alembic_config,
+                self._prepare_script_directory(context),
                 message=message if message is not None else "empty message",
                 autogenerate=autogenerate,
+                **self._autogenerate_options(schemas, tables, reflection_cache_dir),
             )
 
-    def upgrade(self, revision: str) -> None:
-        with self.context() as context:
-            command.upgrade(context.alembic_config, revision)
+    def upgrade_many(
+        self, urls: Iterable[str], revision: str, max_workers: Optional[int] = None, fail_fast: bool = False
+    ) -> list["UpgradeResult"]:
+        from .parallel import upgrade_many
+
+        return upgrade_many(self, urls, revision, max_workers=max_workers, fail_fast=fail_fast)
+
+    def upgrade(
+        self,
+        revision: str,
+        connection: Optional["Connectable"] = None,
+        sql: bool = False,
+        output: Optional[TextIO] = None,
+        report: bool = False,
+    ) -> Optional[UpgradeReport]:
+        """
+        sql=True の場合はデータベースに接続せず、生成した SQL を output (既定は標準出力) に
+        マイグレーションごとに書き出す。revision には "rev_a:rev_b" の範囲も指定できる
+
+        report=True の場合は、適用したステップごとの所要時間・結果・report_rows で報告された行数を
+        UpgradeReport として返す (それ以外は None を返し、observer が無ければ計測もしない)。
+        途中で失敗した場合は例外を送出し、失敗したステップまでのレポートは report.partial_report で取り出せる
+        """
+        from . import commands
+
+        with (
+            collect_report(revision, report) as collector,
+            self._phase("command", command="upgrade", revision=revision),
+            self._migration_context() as context,
+        ):
+            self._configure(context.alembic_config, connection, sql, output)
+            commands.upgrade(
+                context.alembic_config,
+                self._prepare_script_directory(context),
+                revision,
+                sql=sql,
+                emit=fan_out(collector, self.emit) if collector is not None else self.emit,
+                baseline=context.baseline,
+            )
+        return collector.report() if collector is not None else None
+
+    def downgrade(
+        self,
+        revision: str,
+        connection: Optional["Connectable"] = None,
+        sql: bool = False,
+        output: Optional[TextIO] = None,
+    ) -> None:
+        from . import commands
+
+        with self._phase("command", command="downgrade", revision=revision), self._migration_context() as context:
+            self._configure(context.alembic_config, connection, sql, output)
+            commands.downgrade(
+                context.alembic_config, self._prepare_script_directory(context), revision, sql=sql, emit=self.emit
+            )
+
+    def squash(self, to: str, dialect: Optional[str] = None) -> "Baseline":
+        """
+        空のデータベースから to までの upgrade をオフライン SQL で取り込み、dialect ごとのベースラインとして記録する
+        以後、空のデータベースへの upgrade はベースラインを実行して to を stamp し、to より後のリビジョンだけを適用する
+        dialect を省略した場合は sqlalchemy.url の dialect で取り込む
+        """
+        from . import commands
+        from .baseline import baseline_name
+
+        with self._phase("command", command="squash", revision=to), self._command_context() as context:
+            if dialect is not None:
+                context.alembic_config.set_main_option("sqlalchemy.url", f"{dialect}://")
+            self._configure(context.alembic_config, None, True, io.StringIO())
+            baseline = commands.squash(context.alembic_config, self._prepare_script_directory(context), to)
+        store = self.open_store()
+        try:
+            store.put({baseline_name(baseline.dialect): baseline.dumps()})
+        finally:
+            store.close()
+        return baseline
+
+    def _configure(
+        self, config: "Config", connection: Optional["Connectable"], sql: bool, output: Optional[TextIO]
+    ) -> None:
+        if connection is not None:
+            config.attributes["connection"] = connection
+        if sql:
+            config.output_buffer = cast(TextIO, FlushingWriter(output if output is not None else sys.stdout))
+
+    def check(
+        self,
+        connection: Optional["Connectable"] = None,
+        schemas: Optional[Sequence[str]] = None,
+        tables: Optional[Sequence[str]] = None,
+        reflection_cache_dir: Optional[Path] = None,
+    ) -> None:
+        """
+        autogenerate で比較し、新しいマイグレーションが必要なら alembic.util.AutogenerateDiffsDetected を送出する
+        schemas / tables / reflection_cache_dir は revision と同じ
+        """
+        from . import commands
+
+        with self._phase("command", command="check"), self._command_context() as context:
+            self._configure(context.alembic_config, connection, False, None)
+            self._configure_target_metadata(context.alembic_config, self._metadata_provider())
+            commands.check(
+                context.alembic_config,
+                self._prepare_script_directory(context),
+                **self._autogenerate_options(schemas, tables, reflection_cache_dir),
+            )
+
+    def _autogenerate_options(
+        self, schemas: Optional[Sequence[str]], tables: Optional[Sequence[str]], reflection_cache_dir: Optional[Path]
+    ) -> dict[str, Any]:
+        from .reflection import ReflectionCache, ReflectionScope
+
+        return {
+            "scope": ReflectionScope.of(schemas, tables),
+            "reflection_cache": ReflectionCache(reflection_cache_dir) if reflection_cache_dir is not None else None,
+        }
+
+    def _metadata_provider(self) -> Optional["MetadataProvider"]:
+        if self.target_metadata is None:
+            return None
+        from .metadata import MetadataProvider
+
+        return MetadataProvider(self.target_metadata, self.emit)
+
+    def _configure_target_metadata(self, config: "Config", provider: Optional["MetadataProvider"]) -> None:
+        if provider is not None:
+            config.attributes["target_metadata"] = provider
+
+    def heads(self) -> tuple[str, ...]:
+        """
+        リビジョンストアのインデックスから求めた head (ストアが変わるまでキャッシュする)
+        """
+        signature = self.open_store().signature()
+        if self._heads_cache is None or self._heads_cache[0] != signature:
+            self._heads_cache = (signature, self._load_heads())
+        return self._heads_cache[1]
+
+    def _load_heads(self) -> tuple[str, ...]:
+        store = self.open_store()
+        heads = store.load().heads()
+        store.close()
+        if heads is not None:
+            return heads
+        with self.memory_context() as context:
+            return tuple(sorted(context.script_directory.get_heads()))
+
+    def current(self, connection: Optional["Connectable"] = None) -> tuple[str, ...]:
+        """
+        alembic_version テーブルを直接読み、データベースの現在のリビジョンを返す
+        (マイグレーションモジュールは一切読み込まない)
+        connection が無く、use_async_engine または sqlalchemy.url が非同期ドライバのときは AsyncEngine で読む
+        sqlalchemy.url は upgrade と同じコンテキストの alembic の Config から読む (%(here)s などの展開を揃える)
+        """
+        if connection is not None:
+            return self._current_heads(connection)
+        from sqlalchemy import create_engine, pool
+        from sqlalchemy.engine import make_url
+
+        with self._migration_context() as context:
+            url = context.alembic_config.get_main_option("sqlalchemy.url")
+            if url is None:
+                raise ValueError("sqlalchemy.url is not configured in ini_content")
+            if self.use_async_engine or make_url(url).get_dialect().is_async:
+                return self._current_async(url)
+            engine = create_engine(url, poolclass=pool.NullPool)
+            try:
+                return self._current_heads(engine)
+            finally:
+                engine.dispose()
+
+    def is_up_to_date(self, connection: Optional["Connectable"] = None) -> bool:
+        return set(self.current(connection)) == set(self.heads())
+
+    def _current_heads(self, connection: "Connectable") -> tuple[str, ...]:
+        from alembic.runtime.migration import MigrationContext
+        from sqlalchemy.engine import Connection, Engine
+
+        if isinstance(connection, Engine):
+            with connection.connect() as engine_connection:
+                return self._current_heads(engine_connection)
+        if not isinstance(connection, Connection):
+            raise TypeError(
+                f"current() requires an Engine or Connection, not {type(connection).__name__} "
+                "(call it without a connection to read sqlalchemy.url with an AsyncEngine)"
+            )
+        return tuple(sorted(MigrationContext.configure(connection).get_current_heads()))
+
+    def _current_async(self, url: str) -> tuple[str, ...]:
+        import asyncio
+
+        from sqlalchemy import pool
+        from sqlalchemy.ext.asyncio import create_async_engine
+
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            pass
+        else:
+            raise RuntimeError("current() cannot create an AsyncEngine inside a running event loop")
+
+        async def read() -> tuple[str, ...]:
+            engine = create_async_engine(url, poolclass=pool.NullPool)
+            try:
+                async with engine.connect() as connection:
+                    return await connection.run_sync(self._current_heads)
+            finally:
+                await engine.dispose()
+
+        return asyncio.run(read())
+
+    async def revision_async(
+        self,
+        message: Optional[str] = None,
+        autogenerate: bool = False,
+        connection: Optional["AsyncConnectable"] = None,
+    ) -> None:
+        await self._run_async(partial(self.revision, message=message, autogenerate=autogenerate), connection)
+
+    async def upgrade_async(
+        self, revision: str, connection: Optional["AsyncConnectable"] = None, report: bool = False
+    ) -> Optional[UpgradeReport]:
+        return await self._run_async(partial(self.upgrade, revision, report=report), connection)
+
+    async def _run_async(self, run: Callable[..., _R], connection: Optional["AsyncConnectable"]) -> _R:
+        """
+        connection が無ければ別スレッドで実行し、イベントループをブロックしない
+        AsyncEngine / AsyncConnection が渡された場合は run_sync 経由でその接続上で実行する
+        """
+        if connection is None:
+            import asyncio
+
+            return await asyncio.to_thread(run)
+        from sqlalchemy.ext.asyncio import AsyncEngine
+
+        if isinstance(connection, AsyncEngine):
+            async with connection.connect() as async_connection:
+                return await async_connection.run_sync(lambda sync_connection: run(connection=sync_connection))
+        return await connection.run_sync(lambda sync_connection: run(connection=sync_connection))
@@ -0,0 +1,150 @@
+"""
+phantom_alembic serve で起動する常駐プロセスと、そこへコマンドを転送するクライアント
+
+常駐プロセスは解決済みの PhantomAlembic とインポート済みのモジュールを保持したまま、
+Unix ドメインソケット経由で受け取ったコマンドを実行する。
+クライアントとの照合には、指定された文字列ではなく module_identity で解決した識別子を使う
+(別のディレクトリで実行した "pyproject.toml" や "app:pa" は別のプロジェクトを指すため)
+"""
+
+import io
+import json
+import os
+import signal
+import socket
+import socketserver
+import sys
+import threading
+import traceback
+from contextlib import redirect_stderr, redirect_stdout
+from importlib.machinery import PathFinder
+from typing import Any, Callable, Optional
+
+SOCKET_ENV = "PHANTOM_ALEMBIC_SOCKET"
+
+
+def module_identity(module: str) -> str:
+    """
+    'pyproject.toml' / 'path/to/file.py:object' / 'module:object' を、カレントディレクトリによらない識別子にする
+    ファイルは絶対パスに、モジュールはトップレベルのパッケージが見つかった場所に置き換える (import はしない)。
+    見つからない場合はカレントディレクトリと sys.path を含める
+    """
+    if module.endswith(".toml"):
+        return os.path.realpath(module)
+    path, _, attr_name = module.partition(":")
+    # loader.load_object と同じ規則でファイルとモジュールを見分ける
+    if os.path.exists(path) or path.endswith(".py"):
+        abs_path = os.path.realpath(path)
+        if not abs_path.endswith(".py") and os.path.isfile(abs_path + ".py"):
+            abs_path += ".py"
+        return f"{abs_path}:{attr_name}"
+    spec = PathFinder.find_spec(path.split(".")[0], [*sys.path, os.getcwd()])
+    if spec is not None and (spec.origin is not None or spec.submodule_search_locations):
+        location = spec.origin if spec.origin is not None else os.pathsep.join(spec.submodule_search_locations or ())
+        return f"{module}@{os.path.realpath(location)}"
+    return json.dumps([module, os.getcwd(), sys.path])
+
+
+def _read_message(sock_file: Any) -> Any:
+    line = sock_file.readline()
+    if not line:
+        return None
+    return json.loads(line)
+
+
+def _write_message(sock_file: Any, message: Any) -> None:
+    sock_file.write(json.dumps(message).encode("utf-8") + b"\n")
+    sock_file.flush()
+
+
+def execute_captured(execute: Callable[[list[str]], None], argv: list[str], cwd: str) -> dict[str, Any]:
+    stdout, stderr = io.StringIO(), io.StringIO()
+    original_cwd = os.getcwd()
+    exit_code = 0
+    try:
+        os.chdir(cwd)
+        with redirect_stdout(stdout), redirect_stderr(stderr):
+            try:
+                execute(argv)
+            except SystemExit as e:
+                exit_code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+            except Exception:
+                traceback.print_exc()
+                exit_code = 1
+    finally:
+        os.chdir(original_cwd)
+    return {"exit_code": exit_code, "stdout": stdout.getvalue(), "stderr": stderr.getvalue()}
+
+
+class PhantomAlembicServer(socketserver.UnixStreamServer):
+    def __init__(self, socket_path: str, module: str, execute: Callable[[list[str]], None]) -> None:
+        self.module = module
+        self.execute = execute
+        super().__init__(socket_path, PhantomAlembicRequestHandler)
+
+
+class PhantomAlembicRequestHandler(socketserver.StreamRequestHandler):
+    server: PhantomAlembicServer
+
+    def handle(self) -> None:
+        request = _read_message(self.rfile)
+        if request is None:
+            return
+        if request.get("module") != self.server.module:
+            _write_message(
+                self.wfile, {"error": f"this daemon serves {self.server.module}, not {request.get('module')}"}
+            )
+            return
+        _write_message(self.wfile, execute_captured(self.server.execute, request["argv"], request["cwd"]))
+
+
+def is_running(socket_path: str) -> bool:
+    if not hasattr(socket, "AF_UNIX"):
+        return False
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(socket_path)
+        except OSError:
+            return False
+    return True
+
+
+def _raise_keyboard_interrupt(signum: int, frame: Any) -> None:
+    raise KeyboardInterrupt
+
+
+def serve(socket_path: str, module: str, execute: Callable[[list[str]], None]) -> None:
+    if is_running(socket_path):
+        raise RuntimeError(f"phantom_alembic daemon is already running on {socket_path}")
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGTERM, _raise_keyboard_interrupt)
+    with PhantomAlembicServer(socket_path, module, execute) as server:
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.unlink(socket_path)
+
+
+def forward(socket_path: str, module: str, argv: list[str]) -> Optional[dict[str, Any]]:
+    """
+    常駐プロセスにコマンドを転送して結果を返す。常駐プロセスが無い (または別の module を扱っている) 場合は None
+    module には module_identity で解決した識別子を渡す
+    """
+    if not hasattr(socket, "AF_UNIX"):
+        return None
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(socket_path)
+        except OSError:
+            return None
+        with sock.makefile("rwb") as sock_file:
+            _write_message(sock_file, {"module": module, "argv": argv, "cwd": os.getcwd()})
+            response = _read_message(sock_file)
+    if response is None or "error" in response:
+        return None
+    result: dict[str, Any] = response
+    return result
@@ -32,7 +32,8 @@ ENV_CONTENT_TEMPLATE = """from logging.config import fileConfig
 
 from alembic import context
 from sqlalchemy import engine_from_config, pool
-{imports:""}
+from sqlalchemy.engine import Connection
+{imports}
 
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
@@ -47,7 +48,11 @@ if config.config_file_name is not None:
 # for 'autogenerate' support
 # from myapp import mymodel
 # target_metadata = mymodel.Base.metadata
-target_metadata = {metadata:None}
+target_metadata = config.attributes.get("target_metadata", {metadata})
+if callable(target_metadata):
+    # PhantomAlembic(target_metadata=...) passes a provider only for
+    # autogenerate and check; models are imported (once per session) here.
+    target_metadata = target_metadata()
 
 # other values from the config, defined by the needs of env.py,
 # can be acquired:
@@ -56,7 +61,7 @@ target_metadata = {metadata:None}
 
 
 def run_migrations_offline() -> None:
-    \"\"\"Run migrations in 'offline' mode.\"\"\"
+    \"\"\"Run migrations in 'offline' mode.
 
     This configures the context with just a URL
     and not an Engine, though an Engine is acceptable
@@ -72,31 +77,150 @@ def run_migrations_offline() -> None:
         url=url,
         target_metadata=target_metadata,
         literal_binds=True,
-        dialect_opts={"paramstyle": "named"},
+        dialect_opts={{"paramstyle": "named"}},
     )
 
     with context.begin_transaction():
         context.run_migrations()
 
 
+def do_run_migrations(connection: Connection) -> None:
+    context.configure(connection=connection, target_metadata=target_metadata)
+
+    with context.begin_transaction():
+        context.run_migrations()
+
+
 def run_migrations_online() -> None:
-    \"\"\"Run migrations in 'online' mode.\"\"\"
+    \"\"\"Run migrations in 'online' mode.
 
-    In this scenario we need to create an Engine
-    and associate a connection with the context.
+    An Engine or Connection passed by the caller through
+    config.attributes["connection"] is used as is; otherwise
+    we create an Engine and associate a connection with the context.
 
     \"\"\"
-    connectable = engine_from_config(
-        config.get_section(config.config_ini_section, {}),
+    connectable = config.attributes.get("connection", None)
+
+    if connectable is None:
+        connectable = engine_from_config(
+            config.get_section(config.config_ini_section, {{}}),
+            prefix="sqlalchemy.",
+            poolclass=pool.NullPool,
+        )
+
+    if isinstance(connectable, Connection):
+        do_run_migrations(connectable)
+    else:
+        with connectable.connect() as connection:
+            do_run_migrations(connection)
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
+"""
+
+ASYNC_ENV_CONTENT_TEMPLATE = """import asyncio
+from logging.config import fileConfig
+
+from alembic import context
+from sqlalchemy import pool
+from sqlalchemy.engine import Connection
+from sqlalchemy.ext.asyncio import async_engine_from_config
+{imports}
+
+# this is the Alembic Config object, which provides
+# access to the values within the .ini file in use.
+config = context.config
+
+# Interpret the config file for Python logging.
+# This line sets up loggers basically.
+if config.config_file_name is not None:
+    fileConfig(config.config_file_name)
+
+# add your model's MetaData object here
+# for 'autogenerate' support
+# from myapp import mymodel
+# target_metadata = mymodel.Base.metadata
+target_metadata = config.attributes.get("target_metadata", {metadata})
+if callable(target_metadata):
+    # PhantomAlembic(target_metadata=...) passes a provider only for
+    # autogenerate and check; models are imported (once per session) here.
+    target_metadata = target_metadata()
+
+# other values from the config, defined by the needs of env.py,
+# can be acquired:
+# my_important_option = config.get_main_option("my_important_option")
+# ... etc.
+
+
+def run_migrations_offline() -> None:
+    \"\"\"Run migrations in 'offline' mode.
+
+    This configures the context with just a URL
+    and not an Engine, though an Engine is acceptable
+    here as well.  By skipping the Engine creation
+    we don't even need a DBAPI to be available.
+
+    Calls to context.execute() here emit the given string to the
+    script output.
+
+    \"\"\"
+    url = config.get_main_option("sqlalchemy.url")
+    context.configure(
+        url=url,
+        target_metadata=target_metadata,
+        literal_binds=True,
+        dialect_opts={{"paramstyle": "named"}},
+    )
+
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def do_run_migrations(connection: Connection) -> None:
+    context.configure(connection=connection, target_metadata=target_metadata)
+
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+async def run_async_migrations() -> None:
+    \"\"\"Create an async Engine and run the migrations
+    on one of its connections.
+
+    \"\"\"
+    connectable = async_engine_from_config(
+        config.get_section(config.config_ini_section, {{}}),
         prefix="sqlalchemy.",
         poolclass=pool.NullPool,
     )
 
-    with connectable.connect() as connection:
-        context.configure(connection=connection, target_metadata=target_metadata)
+    async with connectable.connect() as connection:
+        await connection.run_sync(do_run_migrations)
+
+    await connectable.dispose()
+
 
-        with context.begin_transaction():
-            context.run_migrations()
+def run_migrations_online() -> None:
+    \"\"\"Run migrations in 'online' mode.
+
+    A (sync) Connection passed by the caller through
+    config.attributes["connection"], e.g. from
+    AsyncConnection.run_sync(), is used as is; otherwise
+    we create an async Engine in a new event loop.
+
+    \"\"\"
+    connectable = config.attributes.get("connection", None)
+
+    if connectable is None:
+        asyncio.run(run_async_migrations())
+    elif isinstance(connectable, Connection):
+        do_run_migrations(connectable)
+    else:
+        with connectable.connect() as connection:
+            do_run_migrations(connection)
 
 
 if context.is_offline_mode():
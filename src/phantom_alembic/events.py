@@ -0,0 +1,215 @@
+"""
+コマンドの各フェーズとマイグレーションの各ステップの所要時間を observer に通知するイベント
+
+observer は Event を受け取る callable で、PhantomAlembic.add_observer で登録する。
+observer が1つも無い場合は計測自体を行わない
+"""
+
+import json
+import time
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from functools import wraps
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    ContextManager,
+    Generator,
+    NamedTuple,
+    Optional,
+    TextIO,
+    Union,
+)
+
+if TYPE_CHECKING:
+    from alembic.runtime.migration import (
+        MigrationContext,
+        MigrationInfo,
+        RevisionStep,
+        StampStep,
+    )
+
+
+class Event(NamedTuple):
+    """
+    start は time.perf_counter() の値 (単調増加)、duration は秒
+    """
+
+    name: str
+    start: float
+    duration: float
+    attributes: dict[str, Any]
+
+
+Observer = Callable[[Event], None]
+
+
+def fan_out(*observers: Optional[Observer]) -> Observer:
+    """
+    None を除いた全ての observer にイベントを配信する observer
+    """
+    targets = [observer for observer in observers if observer is not None]
+
+    def dispatch(event: Event) -> None:
+        for observer in targets:
+            observer(event)
+
+    return dispatch
+
+
+_running_step: ContextVar[Optional["StepTimer"]] = ContextVar("phantom_alembic_running_step", default=None)
+
+
+def report_rows(count: int) -> None:
+    """
+    実行中のマイグレーションが処理した行数を報告する (データ移行の進み具合と処理速度の表示に使う)
+    StepTimer が計測していない場合やマイグレーションの外で呼んだ場合は何もしない
+    """
+    timer = _running_step.get()
+    if timer is not None:
+        timer.add_rows(count)
+
+
+def phase(emit: Optional[Observer], name: str, **attributes: Any) -> ContextManager[None]:
+    if emit is None:
+        return nullcontext()
+    return _timed(emit, name, attributes)
+
+
+@contextmanager
+def _timed(emit: Observer, name: str, attributes: dict[str, Any]) -> Generator[None, None, None]:
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException as e:
+        emit(Event(name, start, time.perf_counter() - start, {**attributes, "error": type(e).__name__}))
+        raise
+    emit(Event(name, start, time.perf_counter() - start, attributes))
+
+
+class StepTimer:
+    """
+    env.py の実行開始から接続してマイグレーションを始めるまでを "connect"、
+    実行するステップの解決 (リビジョンの読み込みを含む) を "plan"、各ステップを "migration" として通知する
+    ステップの終わりは alembic の on_version_apply で検出し、失敗したステップは error 付きの "migration" になる。
+    ステップの実行中に report_rows で報告された行数は "rows" として都度通知し、"migration" にも合計を載せる
+    """
+
+    def __init__(self, emit: Observer) -> None:
+        self._emit = emit
+        self._mark = time.perf_counter()
+        self._rows = 0
+
+    def wrap(self, fn: Callable[[Any, "MigrationContext"], Any]) -> Callable[[Any, "MigrationContext"], Any]:
+        """
+        EnvironmentContext の fn (マイグレーションのステップを返す関数) を包む
+        """
+
+        def timed_fn(rev: Any, context: "MigrationContext") -> Any:
+            self._lap("connect", dialect=context.dialect.name)
+            context.on_version_apply_callbacks = (*context.on_version_apply_callbacks, self.on_version_apply)
+            steps = list(fn(rev, context))
+            for step in steps:
+                step.migration_fn = self._counted(step, step.migration_fn)
+            self._lap("plan", steps=len(steps))
+            return steps
+
+        return timed_fn
+
+    def _counted(
+        self, step: "Union[RevisionStep, StampStep]", migration_fn: Callable[..., None]
+    ) -> Callable[..., None]:
+        @wraps(migration_fn)
+        def counted_fn(**kw: Any) -> None:
+            self._rows = 0
+            token = _running_step.set(self)
+            try:
+                migration_fn(**kw)
+            except BaseException as e:
+                self._lap("migration", **self._step_attributes(step.info), error=type(e).__name__)
+                raise
+            finally:
+                _running_step.reset(token)
+
+        return counted_fn
+
+    def add_rows(self, count: int) -> None:
+        self._rows += count
+        self._emit(Event("rows", self._mark, time.perf_counter() - self._mark, {"rows": self._rows}))
+
+    def _lap(self, name: str, **attributes: Any) -> None:
+        now = time.perf_counter()
+        self._emit(Event(name, self._mark, now - self._mark, attributes))
+        self._mark = now
+
+    def on_version_apply(self, ctx: "MigrationContext", step: "MigrationInfo", heads: set[str], run_args: Any) -> None:
+        self._lap("migration", **self._step_attributes(step))
+
+    def _step_attributes(self, step: "MigrationInfo") -> dict[str, Any]:
+        return {
+            "revision": step.up_revision_id,
+            "source": list(step.source_revision_ids),
+            "destination": list(step.destination_revision_ids),
+            "upgrade": step.is_upgrade,
+            "stamp": step.is_stamp,
+            "rows": self._rows,
+        }
+
+
+class JsonLinesSink:
+    """
+    イベントを1行1 JSON で書き出す observer (start はこの sink を作った時点からの経過秒)
+    """
+
+    def __init__(self, stream: TextIO) -> None:
+        self._stream = stream
+        self._origin = time.perf_counter()
+
+    def __call__(self, event: Event) -> None:
+        record = {"event": event.name, "start": event.start - self._origin, "duration": event.duration}
+        self._stream.write(json.dumps({**record, **event.attributes}, default=str) + "\n")
+        self._stream.flush()
+
+
+class ProgressLine:
+    """
+    マイグレーションの進み具合を表示する observer
+    端末では実行中のステップの行数と処理速度で同じ行を書き換え続け、それ以外では終わったステップごとに1行を書く
+    """
+
+    def __init__(self, stream: TextIO, live: Optional[bool] = None) -> None:
+        self._stream = stream
+        self._live = stream.isatty() if live is None else live
+        self._total = 0
+        self._done = 0
+
+    def __call__(self, event: Event) -> None:
+        if event.name == "plan":
+            self._total, self._done = event.attributes.get("steps", 0), 0
+        elif event.name == "rows" and self._live:
+            self._write(f"{self._position(self._done + 1)} running {self._rows(event)}", end="")
+        elif event.name == "migration":
+            self._done += 1
+            attributes = event.attributes
+            outcome = "failed" if "error" in attributes else "stamped" if attributes.get("stamp") else "applied"
+            step = f"{' '.join(attributes['source']) or 'base'} -> {' '.join(attributes['destination']) or 'base'}"
+            self._write(f"{self._position(self._done)} {step} {outcome} {self._rows(event)}", end="\n")
+
+    def _position(self, index: int) -> str:
+        return f"[{index}/{self._total}]"
+
+    def _rows(self, event: Event) -> str:
+        rows = event.attributes.get("rows", 0)
+        if not rows:
+            return f"{event.duration:.3f}s"
+        rate = rows / event.duration if event.duration > 0 else 0.0
+        return f"{event.duration:.3f}s {rows} rows ({rate:.0f} rows/s)"
+
+    def _write(self, line: str, end: str) -> None:
+        if self._live:
+            # カーソルを行頭に戻し、前の表示の残りを消してから書く
+            self._stream.write(f"\r\033[K{line}{end}")
+        else:
+            self._stream.write(line + end)
+        self._stream.flush()
@@ -0,0 +1,66 @@
+import os
+from contextlib import contextmanager
+from pathlib import Path
+from typing import BinaryIO, Generator
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None  # type: ignore[assignment]
+
+
+@contextmanager
+def file_lock(path: Path, shared: bool = False) -> Generator[None, None, None]:
+    """
+    path をロックファイルとして advisory lock を取る (shared=True なら共有ロック)。fcntl が無い環境ではロックしない
+    ロックを待っている間にロックファイルが消された・置き換えられた場合は開き直す
+    (親ディレクトリごと消された場合は FileNotFoundError)
+    """
+    while True:
+        f = open(path, "a+b")
+        try:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            if _is_current(f, path):
+                break
+        except BaseException:
+            f.close()
+            raise
+        f.close()
+    with f:
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+@contextmanager
+def try_file_lock(path: Path) -> Generator[bool, None, None]:
+    """
+    待たずに排他ロックを試み、取れたかどうかを返す (他でロックされていれば False)
+    """
+    try:
+        f = open(path, "a+b")
+    except FileNotFoundError:
+        yield False
+        return
+    with f:
+        if fcntl is not None:
+            try:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+        try:
+            yield _is_current(f, path)
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def _is_current(f: BinaryIO, path: Path) -> bool:
+    try:
+        return os.stat(path).st_ino == os.fstat(f.fileno()).st_ino
+    except FileNotFoundError:
+        return False
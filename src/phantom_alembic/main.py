@@ -1,55 +1,36 @@
-import importlib
 import os
 import sys
-from argparse import ArgumentParser
+from argparse import ArgumentParser, Namespace
+from contextlib import ExitStack
+from pathlib import Path
+from typing import Any, Callable
 
+from . import daemon
 from .core import PhantomAlembic
+from .events import JsonLinesSink, ProgressLine
+from .loader import load_object
+from .profiling import (
+    DEFAULT_PROFILE_PATH,
+    DEFAULT_SAMPLE_INTERVAL,
+    normalize_profile_argument,
+    profiling,
+)
 
 
 def load_object_from_path(path_str: str) -> PhantomAlembic:
     """
-    'path/to/file.py:object' または 'module:object' 形式の文字列からオブジェクトをロードする
+    'path/to/file.py:object' または 'module:object' 形式の文字列から PhantomAlembic をロードする
+    object が PhantomAlembic を返す callable (ファクトリ) の場合は呼び出した結果を使う。
+    'path/to/pyproject.toml' の場合は [tool.phantom_alembic] テーブルから構築する (アプリケーションのモジュールは import しない)
     """
-    if ":" not in path_str:
-        raise ValueError("Path must be in format 'path/to/file.py:object' or 'module:object'")
-
-    path, attr_name = path_str.split(":", 1)
-
-    if os.path.exists(path) or path.endswith(".py"):
-        if path.endswith(".py"):
-            module_name = os.path.basename(path)[:-3]  # .pyを除去
-        else:
-            module_name = os.path.basename(path)
-
-        abs_path = os.path.abspath(path)
-
-        if not abs_path.endswith(".py") and os.path.isfile(abs_path + ".py"):
-            abs_path += ".py"
-
-        spec = importlib.util.spec_from_file_location(module_name, abs_path)
-        if spec is None:
-            raise ImportError(f"Could not load spec for {abs_path}")
-
-        module = importlib.util.module_from_spec(spec)
-        sys.modules[module_name] = module
-        ldr = spec.loader
-        if ldr is None:
-            raise ImportError(f"Could not load spec for {abs_path}")
-        ldr.exec_module(module)
-    else:
-        try:
-            module = importlib.import_module(path)
-        except ImportError:
-            original_path = sys.path.copy()
-            sys.path.insert(0, os.getcwd())
-            try:
-                module = importlib.import_module(path)
-            finally:
-                sys.path = original_path
-
-    obj = module
-    for part in attr_name.split("."):
-        obj = getattr(obj, part)
+    if path_str.endswith(".toml"):
+        from .pyproject import load_from_pyproject
+
+        return load_from_pyproject(Path(path_str))
+
+    obj = load_object(path_str)
+    if not isinstance(obj, PhantomAlembic) and callable(obj):
+        obj = obj()
 
     if not isinstance(obj, PhantomAlembic):
         raise ValueError(f"Object {obj} is not a PhantomAlembic")
@@ -57,18 +38,261 @@ def load_object_from_path(path_str: str) -> PhantomAlembic:
     return obj
 
 
-def main() -> None:
+def build_parser() -> ArgumentParser:
     parser = ArgumentParser()
+    parser.add_argument(
+        "--socket",
+        default=os.environ.get(daemon.SOCKET_ENV),
+        type=str,
+        help=f"path of the daemon socket (defaults to ${daemon.SOCKET_ENV})",
+    )
+    parser.add_argument(
+        "--timings", action="store_true", help="write per-phase and per-migration timings to stderr as JSON lines"
+    )
+    parser.add_argument("--timings-file", default=None, type=str, help="append the --timings output to this file")
+    parser.add_argument(
+        "--profile",
+        default=None,
+        type=str,
+        metavar="PATH",
+        help=f"profile with cProfile and write a pstats dump (--profile[=PATH], default: {DEFAULT_PROFILE_PATH})",
+    )
+    parser.add_argument(
+        "--sample", action="store_true", help="sample the stack periodically and print the hottest functions at exit"
+    )
+    parser.add_argument(
+        "--sample-interval",
+        default=DEFAULT_SAMPLE_INTERVAL,
+        type=float,
+        metavar="SECONDS",
+        help=f"interval between --sample samples (default: {DEFAULT_SAMPLE_INTERVAL})",
+    )
     parser.add_argument("module", type=str)
     subcommands = parser.add_subparsers(dest="command")
     revision_parser = subcommands.add_parser("revision")
     revision_parser.add_argument("--message", "-m", default=None, type=str, nargs="?")
     revision_parser.add_argument("--autogenerate", "-a", action="store_true")
+    add_autogenerate_arguments(revision_parser)
     upgrade_parser = subcommands.add_parser("upgrade")
     upgrade_parser.add_argument("revision", type=str)
-    args = parser.parse_args()
-    phantom_alembic = load_object_from_path(args.module)
+    upgrade_parser.add_argument(
+        "--urls-file", default=None, type=str, help="upgrade every database URL listed in this file (one per line)"
+    )
+    upgrade_parser.add_argument("--jobs", "-j", default=None, type=int, help="number of worker processes")
+    upgrade_parser.add_argument("--fail-fast", action="store_true", help="stop starting new upgrades after a failure")
+    upgrade_parser.add_argument(
+        "--progress",
+        action="store_true",
+        help="print a line per migration with its duration and reported rows (always shown on a terminal)",
+    )
+    add_offline_arguments(upgrade_parser)
+    downgrade_parser = subcommands.add_parser("downgrade")
+    downgrade_parser.add_argument("revision", type=str)
+    add_offline_arguments(downgrade_parser)
+    subcommands.add_parser("current")
+    check_parser = subcommands.add_parser("check", help="exit with 1 if autogenerate detects new upgrade operations")
+    add_autogenerate_arguments(check_parser)
+    subcommands.add_parser("check-head", help="exit with 1 unless the database is at the head revision(s)")
+    subcommands.add_parser("serve")
+    bundle_parser = subcommands.add_parser("bundle", help="compile env.py and all revisions into a single bundle")
+    bundle_parser.add_argument(
+        "--output", "-o", default=None, type=str, help="bundle path (default: bundle_path or <versions>.bundle)"
+    )
+    archive_parser = subcommands.add_parser(
+        "archive", help="move old revisions into a compressed archive that everyday commands do not load"
+    )
+    archive_parser.add_argument(
+        "--before", required=True, type=str, help="archive every ancestor of this revision (it stays active)"
+    )
+    squash_parser = subcommands.add_parser(
+        "squash", help="record the schema at a revision as a baseline that empty databases start from"
+    )
+    squash_parser.add_argument("--to", required=True, type=str, help="revision to record the baseline at")
+    squash_parser.add_argument(
+        "--dialect", default=None, type=str, help="SQL dialect of the baseline (default: that of sqlalchemy.url)"
+    )
+    return parser
+
+
+def add_autogenerate_arguments(parser: ArgumentParser) -> None:
+    parser.add_argument(
+        "--schema", dest="schemas", action="append", default=None, help="compare only this schema (repeatable)"
+    )
+    parser.add_argument(
+        "--table",
+        dest="tables",
+        action="append",
+        default=None,
+        help="compare only tables matching this pattern, e.g. 'user_*' or 'billing.*' (repeatable)",
+    )
+    parser.add_argument(
+        "--reflection-cache",
+        default=None,
+        type=str,
+        metavar="DIR",
+        help="reuse reflected schema information stored in DIR while the database revision is unchanged",
+    )
+
+
+def autogenerate_options(args: Namespace) -> dict[str, Any]:
+    return {
+        "schemas": args.schemas,
+        "tables": args.tables,
+        "reflection_cache_dir": Path(args.reflection_cache) if args.reflection_cache is not None else None,
+    }
+
+
+def add_offline_arguments(parser: ArgumentParser) -> None:
+    parser.add_argument("--sql", action="store_true", help="emit SQL instead of connecting to the database")
+    parser.add_argument(
+        "--output", "-o", default=None, type=str, help="file to write --sql output to (default: stdout)"
+    )
+
+
+def run_offline(run: Callable[..., object], args: Namespace) -> None:
+    if args.output is None:
+        run(args.revision, sql=True)
+        return
+    with open(args.output, "w", encoding="utf-8") as output:
+        run(args.revision, sql=True, output=output)
+
+
+def run_command(phantom_alembic: PhantomAlembic, args: Namespace) -> None:
+    if not args.timings and args.timings_file is None:
+        dispatch_command(phantom_alembic, args)
+        return
+    with ExitStack() as stack:
+        stream = (
+            sys.stderr
+            if args.timings_file is None
+            else stack.enter_context(open(args.timings_file, "a", encoding="utf-8"))
+        )
+        sink = JsonLinesSink(stream)
+        phantom_alembic.add_observer(sink)
+        stack.callback(phantom_alembic.remove_observer, sink)
+        dispatch_command(phantom_alembic, args)
+
+
+def dispatch_command(phantom_alembic: PhantomAlembic, args: Namespace) -> None:
     if args.command == "revision":
-        phantom_alembic.revision(message=args.message, autogenerate=args.autogenerate)
+        phantom_alembic.revision(message=args.message, autogenerate=args.autogenerate, **autogenerate_options(args))
+    elif args.command == "upgrade" and args.urls_file is not None:
+        upgrade_many(phantom_alembic, args)
+    elif args.command == "upgrade" and args.sql:
+        run_offline(phantom_alembic.upgrade, args)
     elif args.command == "upgrade":
+        upgrade(phantom_alembic, args)
+    elif args.command == "downgrade" and args.sql:
+        run_offline(phantom_alembic.downgrade, args)
+    elif args.command == "downgrade":
+        phantom_alembic.downgrade(revision=args.revision)
+    elif args.command == "current":
+        heads = phantom_alembic.heads()
+        for revision in phantom_alembic.current():
+            print(f"{revision} (head)" if revision in heads else revision)
+    elif args.command == "check-head":
+        check_head(phantom_alembic)
+    elif args.command == "check":
+        check(phantom_alembic, args)
+    elif args.command == "bundle":
+        path = phantom_alembic.bundle(Path(args.output) if args.output is not None else None)
+        print(f"wrote {path}", file=sys.stderr)
+    elif args.command == "archive":
+        archived = phantom_alembic.archive(args.before)
+        print(f"archived {len(archived)} revision(s) before {args.before}", file=sys.stderr)
+    elif args.command == "squash":
+        baseline = phantom_alembic.squash(args.to, dialect=args.dialect)
+        print(
+            f"recorded a {baseline.dialect} baseline at {baseline.revision} ({len(baseline.statements)} statements)",
+            file=sys.stderr,
+        )
+
+
+def upgrade(phantom_alembic: PhantomAlembic, args: Namespace) -> None:
+    if not args.progress and not sys.stderr.isatty():
         phantom_alembic.upgrade(revision=args.revision)
+        return
+    progress = ProgressLine(sys.stderr)
+    phantom_alembic.add_observer(progress)
+    try:
+        report = phantom_alembic.upgrade(revision=args.revision, report=True)
+    finally:
+        phantom_alembic.remove_observer(progress)
+    assert report is not None
+    rows = f", {report.rows} rows" if report.rows else ""
+    print(f"{len(report.migrations)} migration(s) in {report.duration:.3f}s{rows}", file=sys.stderr)
+
+
+def check_head(phantom_alembic: PhantomAlembic) -> None:
+    current, heads = phantom_alembic.current(), phantom_alembic.heads()
+    if set(current) == set(heads):
+        print(f"database is up to date ({', '.join(heads) or 'base'})", file=sys.stderr)
+        return
+    print(f"database is at {', '.join(current) or 'base'}, head is {', '.join(heads) or 'base'}", file=sys.stderr)
+    sys.exit(1)
+
+
+def check(phantom_alembic: PhantomAlembic, args: Namespace) -> None:
+    from alembic.util import AutogenerateDiffsDetected
+
+    try:
+        phantom_alembic.check(**autogenerate_options(args))
+    except AutogenerateDiffsDetected as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+
+
+def read_urls_file(path: str) -> list[str]:
+    with open(path, "r", encoding="utf-8") as f:
+        return [ln.strip() for ln in f if ln.strip() and not ln.lstrip().startswith("#")]
+
+
+def upgrade_many(phantom_alembic: PhantomAlembic, args: Namespace) -> None:
+    results = phantom_alembic.upgrade_many(
+        read_urls_file(args.urls_file), args.revision, max_workers=args.jobs, fail_fast=args.fail_fast
+    )
+    for result in results:
+        status = "ok" if result.success else "skipped" if result.error == "skipped" else "failed"
+        print(f"{status}\t{result.duration:.3f}s\t{mask_url(result.url)}")
+        if result.error is not None and result.error != "skipped":
+            print(result.error, file=sys.stderr)
+    failed = sum(1 for result in results if not result.success)
+    print(f"{len(results) - failed} succeeded, {failed} failed", file=sys.stderr)
+    if failed:
+        sys.exit(1)
+
+
+def mask_url(url: str) -> str:
+    from sqlalchemy.engine import make_url
+
+    try:
+        return make_url(url).render_as_string(hide_password=True)
+    except Exception:
+        return url
+
+
+def main() -> None:
+    parser = build_parser()
+    argv = normalize_profile_argument(sys.argv[1:])
+    args = parser.parse_args(argv)
+    if args.command == "serve":
+        if args.socket is None:
+            parser.error(f"serve requires --socket or ${daemon.SOCKET_ENV}")
+        phantom_alembic = load_object_from_path(args.module)
+
+        def execute(command_argv: list[str]) -> None:
+            run_command(phantom_alembic, parser.parse_args(command_argv))
+
+        daemon.serve(args.socket, daemon.module_identity(args.module), execute)
+        return
+    profiled = args.profile is not None or args.sample
+    # プロファイリングはこのプロセスでの実行が対象のため、常駐プロセスには転送しない
+    if args.socket is not None and not profiled:
+        response = daemon.forward(args.socket, daemon.module_identity(args.module), argv)
+        if response is not None:
+            sys.stdout.write(response["stdout"])
+            sys.stderr.write(response["stderr"])
+            sys.exit(response["exit_code"])
+    with profiling(args.profile, args.sample_interval if args.sample else None):
+        phantom_alembic = load_object_from_path(args.module)
+        run_command(phantom_alembic, args)
@@ -0,0 +1,33 @@
+"""
+autogenerate / check でだけ使う target_metadata を、実際に必要になったときに初めて解決する provider
+
+PhantomAlembic は autogenerate / check のときだけ provider を config.attributes["target_metadata"] に渡し、
+既定の env.py はそれが callable なら呼び出して MetaData を得る。upgrade などではモデルを import しない
+"""
+
+from typing import Any, Callable, Optional, Union
+
+from .events import Observer, phase
+from .loader import load_object
+
+MetadataSource = Union[str, Callable[[], Any]]
+
+
+class MetadataProvider:
+    """
+    'module:attribute' 形式のパス、または MetaData (あるいはそのシーケンス) を返す callable を
+    初回の呼び出しで解決し、以降は同じ結果を返す
+    """
+
+    def __init__(self, source: MetadataSource, emit: Optional[Observer] = None) -> None:
+        self._source = source
+        self._emit = emit
+        self._resolved = False
+        self._metadata: Any = None
+
+    def __call__(self) -> Any:
+        if not self._resolved:
+            with phase(self._emit, "target_metadata"):
+                self._metadata = load_object(self._source) if isinstance(self._source, str) else self._source()
+            self._resolved = True
+        return self._metadata
@@ -0,0 +1,133 @@
+"""
+複数のデータベース (テナント) に対する upgrade をプロセスプールで並列に実行する
+
+alembic.context / alembic.op はモジュールグローバルなプロキシのためスレッドでは並列化できない。
+各ワーカープロセスはリビジョンストアを一度だけ読み込み、同じリビジョンマップを担当する全 URL で使い回す
+
+ワーカーには PhantomAlembic そのものではなく、pickle できる設定 (_WorkerConfig) だけを渡してワーカー側で組み立て直す。
+そのため add_observer で登録した observer と target_metadata はワーカーには渡らない
+"""
+
+import time
+import traceback
+from pathlib import Path
+from tempfile import TemporaryDirectory, mkdtemp
+from typing import TYPE_CHECKING, Iterable, NamedTuple, Optional
+
+if TYPE_CHECKING:
+    from concurrent.futures import Future
+
+    from .core import PhantomAlembic, PhantomAlembicContext
+    from .store import StoreBackend
+
+
+class UpgradeResult(NamedTuple):
+    url: str
+    success: bool
+    duration: float
+    error: Optional[str] = None
+
+
+class _WorkerConfig(NamedTuple):
+    """
+    ワーカーで PhantomAlembic を組み立て直すための設定 (ストアはリソースを開いていない新しいハンドル)
+    """
+
+    store: "StoreBackend"
+    ini_content: Optional[str]
+    env_content: str
+    use_async_engine: bool
+    bundle_path: Optional[Path]
+
+    @classmethod
+    def of(cls, phantom_alembic: "PhantomAlembic") -> "_WorkerConfig":
+        return cls(
+            phantom_alembic.open_store(),
+            phantom_alembic.ini_content,
+            phantom_alembic.env_content,
+            phantom_alembic.use_async_engine,
+            phantom_alembic.bundle_path,
+        )
+
+    def phantom_alembic(self) -> "PhantomAlembic":
+        from .core import PhantomAlembic
+
+        return PhantomAlembic(
+            self.store,
+            ini_content=self.ini_content,
+            env_content=self.env_content,
+            use_async_engine=self.use_async_engine,
+            bundle_path=self.bundle_path,
+        )
+
+
+_worker_context: Optional["PhantomAlembicContext"] = None
+
+
+def _init_worker(worker_config: _WorkerConfig, scratch_root: str) -> None:
+    from .core import PhantomAlembicBundleContext, PhantomAlembicMemoryContext
+
+    global _worker_context
+    phantom_alembic = worker_config.phantom_alembic()
+    dir_path = Path(mkdtemp(dir=scratch_root))
+    if phantom_alembic.bundle_path is not None:
+        _worker_context = PhantomAlembicBundleContext(phantom_alembic, dir_path, phantom_alembic.load_bundle())
+    else:
+        _worker_context = PhantomAlembicMemoryContext(phantom_alembic, dir_path)
+    _worker_context.__enter__()
+
+
+def _upgrade_one(url: str, revision: str) -> UpgradeResult:
+    from . import commands
+
+    assert _worker_context is not None
+    config = _worker_context.alembic_config
+    config.set_main_option("sqlalchemy.url", url.replace("%", "%%"))
+    start = time.perf_counter()
+    try:
+        commands.upgrade(config, _worker_context.script_directory, revision, baseline=_worker_context.baseline)
+    except Exception:
+        return UpgradeResult(url, False, time.perf_counter() - start, traceback.format_exc())
+    return UpgradeResult(url, True, time.perf_counter() - start)
+
+
+def upgrade_many(
+    phantom_alembic: "PhantomAlembic",
+    urls: Iterable[str],
+    revision: str,
+    max_workers: Optional[int] = None,
+    fail_fast: bool = False,
+) -> list[UpgradeResult]:
+    """
+    urls の各データベースを revision まで upgrade し、入力と同じ順序で結果を返す
+
+    fail_fast の場合は最初の失敗以降、未着手のものを実行せずに失敗 (error="skipped") として返す
+    ワーカーでのマイグレーションは observer に通知されない
+    """
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    urls = list(urls)
+    with TemporaryDirectory() as scratch_root:
+        with ProcessPoolExecutor(
+            max_workers=max_workers,
+            initializer=_init_worker,
+            initargs=(_WorkerConfig.of(phantom_alembic), scratch_root),
+        ) as executor:
+            futures = [executor.submit(_upgrade_one, url, revision) for url in urls]
+            if fail_fast:
+                for future in as_completed(futures):
+                    if future.exception() is not None or not future.result().success:
+                        for f in futures:
+                            f.cancel()
+                        break
+    return [_result(url, future) for url, future in zip(urls, futures)]
+
+
+def _result(url: str, future: "Future[UpgradeResult]") -> UpgradeResult:
+    if future.cancelled():
+        return UpgradeResult(url, False, 0.0, "skipped")
+    exception = future.exception()
+    if exception is not None:
+        # ワーカーの初期化失敗などで _upgrade_one 自体が結果を返せなかった場合
+        return UpgradeResult(url, False, 0.0, repr(exception))
+    return future.result()
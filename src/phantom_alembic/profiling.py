@@ -0,0 +1,107 @@
+"""
+phantom_alembic コマンドのプロファイリング
+
+--profile は cProfile で計測して pstats 形式のダンプを書き出す。
+--sample は別スレッドからメインスレッドのスタックを一定間隔で採取する軽量なサンプリングで、
+本番規模のマイグレーションでも実行速度をほとんど落とさずに、終了時に時間を使った関数の上位を表示する
+"""
+
+import cProfile
+import sys
+import threading
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from types import FrameType
+from typing import Generator, Optional, TextIO
+
+DEFAULT_PROFILE_PATH = "phantom_alembic.prof"
+DEFAULT_SAMPLE_INTERVAL = 0.005
+
+FunctionKey = tuple[str, int, str]
+
+
+def _function_key(frame: FrameType) -> FunctionKey:
+    code = frame.f_code
+    return (code.co_filename, code.co_firstlineno, code.co_name)
+
+
+class Sampler:
+    """
+    対象スレッドのスタックを interval 秒ごとに採取し、関数ごとのサンプル数を数える
+    self は最上位フレームだった回数、total はスタック上にあった回数
+    """
+
+    def __init__(self, interval: float = DEFAULT_SAMPLE_INTERVAL, thread_id: Optional[int] = None) -> None:
+        self._interval = interval
+        self._thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.samples = 0
+        self.self_counts: Counter[FunctionKey] = Counter()
+        self.total_counts: Counter[FunctionKey] = Counter()
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="phantom_alembic-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self._interval):
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is None:
+                continue
+            self.samples += 1
+            self.self_counts[_function_key(frame)] += 1
+            on_stack = set()
+            while frame is not None:
+                on_stack.add(_function_key(frame))
+                frame = frame.f_back
+            self.total_counts.update(on_stack)
+
+    def summary(self, limit: int = 20) -> str:
+        lines = [f"{self.samples} samples every {self._interval * 1000:g} ms", "   self%  total%  function"]
+        for key, count in self.self_counts.most_common(limit):
+            filename, lineno, name = key
+            self_ratio, total_ratio = count / self.samples * 100, self.total_counts[key] / self.samples * 100
+            lines.append(f"{self_ratio:7.1f} {total_ratio:7.1f}  {name} ({filename}:{lineno})")
+        return "\n".join(lines)
+
+
+@contextmanager
+def profiling(
+    profile_path: Optional[str] = None,
+    sample_interval: Optional[float] = None,
+    stream: Optional[TextIO] = None,
+) -> Generator[None, None, None]:
+    """
+    profile_path が指定されれば cProfile のダンプを書き出し、sample_interval が指定されればサンプリングして
+    終了時に上位の関数を stream (既定は標準エラー出力) に表示する。どちらも無ければ何もしない
+    """
+    with ExitStack() as stack:
+        output = stream if stream is not None else sys.stderr
+        # ExitStack は登録と逆順に後始末するため、サンプリングの停止 → cProfile の停止と書き出し → 集計の表示 の順になる
+        sampler = Sampler(sample_interval) if sample_interval is not None else None
+        if sampler is not None:
+            stack.callback(lambda: print(sampler.summary(), file=output))
+        if profile_path is not None:
+            profile = cProfile.Profile()
+            stack.callback(print, f"wrote profile to {profile_path} (python -m pstats {profile_path})", file=output)
+            stack.callback(profile.dump_stats, profile_path)
+            stack.callback(profile.disable)
+            profile.enable()
+        if sampler is not None:
+            sampler.start()
+            stack.callback(sampler.stop)
+        yield
+
+
+def normalize_profile_argument(argv: list[str]) -> list[str]:
+    """
+    値を省略した --profile を --profile=<DEFAULT_PROFILE_PATH> にする
+    (argparse の nargs="?" では、後に続く module を値として取り込んでしまうため)
+    """
+    return [f"--profile={DEFAULT_PROFILE_PATH}" if arg == "--profile" else arg for arg in argv]
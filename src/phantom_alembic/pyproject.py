@@ -0,0 +1,60 @@
+"""
+pyproject.toml の [tool.phantom_alembic] テーブルから PhantomAlembic を構築する
+
+    [tool.phantom_alembic]
+    version_data_path = "migrations/versions.jsonl"
+    store_backend = "jsonl"                            # "sqlite" なら version_data_path を SQLite のストアとして開く
+    ini_file = "alembic.ini"                           # ini_content として読み込む (ini_content で直接書いてもよい)
+    env_file = "migrations/env.py"                     # env_content として読み込む (省略時は既定のテンプレート)
+    target_metadata = "myapp.models:Base.metadata"     # revision --autogenerate のときだけ import される
+    in_memory = true
+    use_async_engine = false
+    cache_dir = ".cache/phantom_alembic"
+    bundle_path = "migrations/versions.jsonl.bundle"
+
+パスは pyproject.toml のあるディレクトリからの相対パスとして解釈する。
+アプリケーションのモジュールを import せずに設定が決まるため、upgrade などの起動が軽い
+"""
+
+import sys
+from pathlib import Path
+from typing import Any
+
+from .core import PhantomAlembic
+
+if sys.version_info >= (3, 11):
+    import tomllib
+else:
+    import tomli as tomllib
+
+TABLE = "phantom_alembic"
+
+_PATH_KEYS = {"version_data_path", "cache_dir", "bundle_path"}
+_VALUE_KEYS = {"ini_content", "env_content", "target_metadata", "in_memory", "use_async_engine", "store_backend"}
+_FILE_KEYS = {"ini_file": "ini_content", "env_file": "env_content"}
+
+
+def load_from_pyproject(path: Path) -> PhantomAlembic:
+    with open(path, "rb") as f:
+        data = tomllib.load(f)
+    table = data.get("tool", {}).get(TABLE)
+    if table is None:
+        raise ValueError(f"[tool.{TABLE}] is not defined in {path}")
+    return phantom_alembic_from_table(table, path.resolve().parent)
+
+
+def phantom_alembic_from_table(table: dict[str, Any], base_path: Path) -> PhantomAlembic:
+    unknown = set(table) - _PATH_KEYS - _VALUE_KEYS - set(_FILE_KEYS)
+    if unknown:
+        raise ValueError(f"unknown keys in [tool.{TABLE}]: {', '.join(sorted(unknown))}")
+    if "version_data_path" not in table:
+        raise ValueError(f"[tool.{TABLE}] requires version_data_path")
+    kwargs: dict[str, Any] = {key: table[key] for key in _VALUE_KEYS if key in table}
+    kwargs.update({key: base_path / table[key] for key in _PATH_KEYS if key in table})
+    for file_key, content_key in _FILE_KEYS.items():
+        if file_key not in table:
+            continue
+        if content_key in table:
+            raise ValueError(f"[tool.{TABLE}] accepts only one of {file_key} and {content_key}")
+        kwargs[content_key] = (base_path / table[file_key]).read_text(encoding="utf-8")
+    return PhantomAlembic(**kwargs)
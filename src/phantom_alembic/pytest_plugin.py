@@ -0,0 +1,88 @@
+"""
+テストごとにマイグレーション済みのデータベースを用意する pytest プラグイン
+
+    pytest -p phantom_alembic.pytest_plugin   (conftest.py の pytest_plugins = ["phantom_alembic.pytest_plugin"] でもよい)
+
+    [pytest]
+    phantom_alembic = myapp/migrations.py:pa          # CLI と同じ形式 (pyproject.toml も可)
+    phantom_alembic_database_url = postgresql://localhost/myapp_test   # 省略時はテストごとの SQLite ファイル
+
+phantom_alembic_database フィクスチャはテストごとに、テンプレートからコピーしたデータベースの URL を返す。
+テンプレートは pytest のキャッシュディレクトリ (無効な場合は basetemp の親) にリビジョンストアのハッシュごとに保存され、
+pytest-xdist のワーカー間でも共有される
+"""
+
+from pathlib import Path
+from typing import TYPE_CHECKING, Generator
+from uuid import uuid4
+
+import pytest
+
+if TYPE_CHECKING:
+    from .core import PhantomAlembic
+    from .template import DatabaseTemplate
+
+
+def pytest_addoption(parser: pytest.Parser) -> None:
+    group = parser.getgroup("phantom_alembic")
+    group.addoption(
+        "--phantom-alembic",
+        default=None,
+        help="PhantomAlembic to migrate test databases with ('path/to/file.py:object', 'module:object' or a pyproject)",
+    )
+    parser.addini("phantom_alembic", "PhantomAlembic to migrate test databases with", default=None)
+    parser.addini(
+        "phantom_alembic_database_url",
+        "server URL for test databases (a unique database is cloned per test); defaults to a SQLite file per test",
+        default=None,
+    )
+    parser.addini("phantom_alembic_template_dir", "directory for migrated template databases", default=None)
+    parser.addini("phantom_alembic_revision", "revision the template databases are migrated to", default="head")
+
+
+@pytest.fixture(scope="session")
+def phantom_alembic(pytestconfig: pytest.Config) -> "PhantomAlembic":
+    from .main import load_object_from_path
+
+    path = pytestconfig.getoption("phantom_alembic") or pytestconfig.getini("phantom_alembic")
+    if not path:
+        raise pytest.UsageError(
+            "phantom_alembic is not configured: set --phantom-alembic, the phantom_alembic ini option "
+            "or override the phantom_alembic fixture"
+        )
+    return load_object_from_path(str(path))
+
+
+@pytest.fixture(scope="session")
+def phantom_alembic_template(
+    phantom_alembic: "PhantomAlembic", pytestconfig: pytest.Config, tmp_path_factory: pytest.TempPathFactory
+) -> "DatabaseTemplate":
+    template_dir: Path
+    configured = pytestconfig.getini("phantom_alembic_template_dir")
+    if configured:
+        template_dir = pytestconfig.rootpath / str(configured)
+    elif getattr(pytestconfig, "cache", None) is not None:
+        template_dir = pytestconfig.cache.mkdir("phantom_alembic")
+    else:
+        # pytest-xdist では basetemp がワーカーごとに分かれるため、共通の親ディレクトリを使う
+        template_dir = tmp_path_factory.getbasetemp().parent / "phantom_alembic"
+    return phantom_alembic.database_template(template_dir, str(pytestconfig.getini("phantom_alembic_revision")))
+
+
+@pytest.fixture
+def phantom_alembic_database(
+    phantom_alembic_template: "DatabaseTemplate", pytestconfig: pytest.Config, tmp_path: Path
+) -> Generator[str, None, None]:
+    from sqlalchemy.engine import make_url
+
+    server_url = pytestconfig.getini("phantom_alembic_database_url")
+    if not server_url or make_url(str(server_url)).get_backend_name() == "sqlite":
+        url = make_url(f"sqlite:///{tmp_path / 'phantom_alembic.sqlite3'}")
+    else:
+        base = make_url(str(server_url))
+        url = base.set(database=f"{base.database}_{uuid4().hex[:12]}")
+    phantom_alembic_template.clone(url)
+    try:
+        yield url.render_as_string(hide_password=False)
+    finally:
+        phantom_alembic_template.drop(url)
@@ -0,0 +1,192 @@
+"""
+autogenerate の比較対象を絞り込むスコープと、データベースのリビジョンをキーにしたリフレクション結果のキャッシュ
+
+どちらも EnvironmentContext の fn の中で MigrationContext.opts と dialect に差し込むため、env.py を変更する必要はない。
+スコープは include_name (リフレクションの前に評価される) と include_object (メタデータ側) の両方に適用する
+"""
+
+import hashlib
+import pickle
+from contextlib import ExitStack, contextmanager
+from fnmatch import fnmatchcase
+from pathlib import Path
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Generator,
+    Iterable,
+    NamedTuple,
+    Optional,
+)
+
+from .store import atomic_write
+
+if TYPE_CHECKING:
+    from alembic.runtime.migration import MigrationContext
+    from sqlalchemy.engine import Dialect
+
+
+class ReflectionScope(NamedTuple):
+    """
+    schemas: 比較するスキーマ名 (None なら env.py の設定のまま)
+    tables: 比較するテーブル名の fnmatch パターン ("schema.table" の形式も可、None なら全テーブル)
+    """
+
+    schemas: Optional[tuple[str, ...]] = None
+    tables: Optional[tuple[str, ...]] = None
+
+    @classmethod
+    def of(cls, schemas: Optional[Iterable[str]], tables: Optional[Iterable[str]]) -> Optional["ReflectionScope"]:
+        if not schemas and not tables:
+            return None
+        return cls(tuple(schemas) if schemas else None, tuple(tables) if tables else None)
+
+    def include_schema(self, name: Optional[str], default_schema: Optional[str]) -> bool:
+        if self.schemas is None:
+            return True
+        return (name if name is not None else default_schema) in self.schemas or (name is None and "" in self.schemas)
+
+    def include_table(self, name: str, schema: Optional[str], default_schema: Optional[str]) -> bool:
+        if not self.include_schema(schema, default_schema):
+            return False
+        if self.tables is None:
+            return True
+        qualified = f"{schema if schema is not None else default_schema}.{name}"
+        return any(fnmatchcase(qualified if "." in pattern else name, pattern) for pattern in self.tables)
+
+
+def _combined(ours: Callable[..., bool], theirs: Optional[Callable[..., bool]]) -> Callable[..., bool]:
+    if theirs is None:
+        return ours
+    return lambda *args: ours(*args) and theirs(*args)
+
+
+@contextmanager
+def scoped(context: "MigrationContext", scope: ReflectionScope) -> Generator[None, None, None]:
+    default_schema = context.dialect.default_schema_name
+
+    def include_name(name: Optional[str], type_: str, parent_names: dict[str, Optional[str]]) -> bool:
+        if type_ == "schema":
+            return scope.include_schema(name, default_schema)
+        if type_ == "table" and name is not None:
+            return scope.include_table(name, parent_names.get("schema_name"), default_schema)
+        return True
+
+    def include_object(obj: Any, name: Optional[str], type_: str, reflected: bool, compare_to: Any) -> bool:
+        if type_ == "table" and name is not None:
+            return scope.include_table(name, obj.schema, default_schema)
+        return True
+
+    opts = context.opts
+    original = {key: opts[key] for key in ["include_name", "include_object", "include_schemas"] if key in opts}
+    opts["include_name"] = _combined(include_name, original.get("include_name"))
+    opts["include_object"] = _combined(include_object, original.get("include_object"))
+    if scope.schemas is not None:
+        opts["include_schemas"] = True
+    try:
+        yield
+    finally:
+        for key in ["include_name", "include_object", "include_schemas"]:
+            opts.pop(key, None)
+        opts.update(original)
+
+
+class ReflectionCache:
+    """
+    Inspector の info_cache (リフレクション結果) を、接続先・データベースのリビジョン・スコープごとに保存し、
+    同じ状態のデータベースに対する次回の autogenerate で読み込んでリフレクションを省略する
+
+    キャッシュは pickle のため、信頼できるローカルのディレクトリだけを指定すること
+    """
+
+    def __init__(self, root: Path) -> None:
+        self._root = root
+
+    @property
+    def root(self) -> Path:
+        return self._root
+
+    def path_for(self, context: "MigrationContext", heads: Iterable[str], scope: Optional[ReflectionScope]) -> Path:
+        import sqlalchemy
+
+        assert context.connection is not None
+        url = context.connection.engine.url.render_as_string(hide_password=True)
+        key = repr((sqlalchemy.__version__, url, tuple(sorted(heads)), scope))
+        return self.root / f"{hashlib.sha256(key.encode('utf-8')).hexdigest()[:32]}.pickle"
+
+    def _load(self, path: Path) -> dict[Any, Any]:
+        try:
+            with open(path, "rb") as f:
+                snapshot = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError, TypeError, ValueError):
+            return {}
+        return snapshot if isinstance(snapshot, dict) else {}
+
+    def _save(self, path: Path, info_cache: dict[Any, Any]) -> None:
+        try:
+            data = pickle.dumps(info_cache)
+        except (pickle.PicklingError, TypeError, AttributeError):
+            return
+        path.parent.mkdir(parents=True, exist_ok=True)
+        atomic_write(path, data)
+
+    @contextmanager
+    def installed(
+        self, context: "MigrationContext", heads: Iterable[str], scope: Optional[ReflectionScope]
+    ) -> Generator[None, None, None]:
+        """
+        この間に context の接続から作られる Inspector に、保存済みのリフレクション結果を読み込ませる
+        """
+        from sqlalchemy.engine.reflection import Inspector
+
+        path = self.path_for(context, heads, scope)
+        snapshot = self._load(path)
+        dialect = context.dialect
+        inspectors: list[Inspector] = []
+        base: type[Inspector] = getattr(dialect, "inspector", Inspector)
+
+        class SnapshotInspector(base):  # type: ignore[valid-type, misc]
+            # Inspector._construct は基底クラスの _init_connection を直接呼ぶため、
+            # そこで代入される空の info_cache を受け取った時点で保存済みの結果を読み込む
+            @property
+            def info_cache(self) -> dict[Any, Any]:
+                return self._snapshot_info_cache
+
+            @info_cache.setter
+            def info_cache(self, info_cache: dict[Any, Any]) -> None:
+                info_cache.update(snapshot)
+                self._snapshot_info_cache = info_cache
+                inspectors.append(self)
+
+        with ExitStack() as stack:
+            stack.callback(_restore_inspector, dialect, vars(dialect).get("inspector"))
+            setattr(dialect, "inspector", SnapshotInspector)
+            yield
+        if inspectors:
+            info_cache = dict(snapshot)
+            for inspector in inspectors:
+                info_cache.update(inspector.info_cache)
+            self._save(path, info_cache)
+
+
+def _restore_inspector(dialect: "Dialect", inspector: Optional[type]) -> None:
+    if inspector is None:
+        vars(dialect).pop("inspector", None)
+    else:
+        setattr(dialect, "inspector", inspector)
+
+
+@contextmanager
+def autogenerate_configured(
+    context: "MigrationContext",
+    heads: Iterable[str],
+    scope: Optional[ReflectionScope],
+    cache: Optional[ReflectionCache],
+) -> Generator[None, None, None]:
+    with ExitStack() as stack:
+        if scope is not None:
+            stack.enter_context(scoped(context, scope))
+        if cache is not None:
+            stack.enter_context(cache.installed(context, heads, scope))
+        yield
@@ -0,0 +1,94 @@
+"""
+upgrade(report=True) の結果として返すレポート (適用したステップごとの所要時間・結果・処理行数)
+
+StepTimer が通知する "migration" イベントから組み立てる。upgrade が失敗した場合は、
+失敗したステップまでのレポートを送出する例外に付けておき、partial_report で取り出せるようにする
+"""
+
+import time
+from contextlib import contextmanager
+from typing import Generator, NamedTuple, Optional
+
+from .events import Event
+
+_REPORT_ATTRIBUTE = "phantom_alembic_report"
+
+
+class MigrationReport(NamedTuple):
+    """
+    outcome は "applied" / "stamped" (ベースラインなど、リビジョンを stamp しただけのステップ) / "failed"
+    """
+
+    revision: Optional[str]
+    source: tuple[str, ...]
+    destination: tuple[str, ...]
+    outcome: str
+    duration: float
+    rows: int = 0
+    error: Optional[str] = None
+
+
+class UpgradeReport(NamedTuple):
+    revision: str
+    duration: float
+    migrations: list[MigrationReport]
+
+    @property
+    def rows(self) -> int:
+        return sum(migration.rows for migration in self.migrations)
+
+
+class ReportCollector:
+    """
+    "migration" イベントを MigrationReport として溜める observer
+    """
+
+    def __init__(self, revision: str) -> None:
+        self.revision = revision
+        self.migrations: list[MigrationReport] = []
+        self._start = time.perf_counter()
+
+    def report(self) -> UpgradeReport:
+        return UpgradeReport(self.revision, time.perf_counter() - self._start, list(self.migrations))
+
+    def __call__(self, event: Event) -> None:
+        if event.name != "migration":
+            return
+        attributes = event.attributes
+        error = attributes.get("error")
+        self.migrations.append(
+            MigrationReport(
+                attributes["revision"],
+                tuple(attributes["source"]),
+                tuple(attributes["destination"]),
+                "failed" if error is not None else "stamped" if attributes["stamp"] else "applied",
+                event.duration,
+                attributes.get("rows", 0),
+                error,
+            )
+        )
+
+
+@contextmanager
+def collect_report(revision: str, enabled: bool) -> Generator[Optional[ReportCollector], None, None]:
+    """
+    enabled のときだけ ReportCollector を作る (無効なら None を返し、計測も行わない)
+    ブロック内で例外が送出された場合は、それまでのレポートを例外に付けてから送出し直す
+    """
+    if not enabled:
+        yield None
+        return
+    collector = ReportCollector(revision)
+    try:
+        yield collector
+    except BaseException as e:
+        setattr(e, _REPORT_ATTRIBUTE, collector.report())
+        raise
+
+
+def partial_report(error: BaseException) -> Optional[UpgradeReport]:
+    """
+    upgrade(report=True) が送出した例外から、失敗したステップ (outcome="failed") までのレポートを取り出す
+    """
+    report: Optional[UpgradeReport] = getattr(error, _REPORT_ATTRIBUTE, None)
+    return report
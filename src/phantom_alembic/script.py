@@ -0,0 +1,230 @@
+import re
+from pathlib import Path
+from types import CodeType, ModuleType
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Iterator,
+    Mapping,
+    Optional,
+    Sequence,
+    TypeVar,
+)
+
+from alembic import util
+from alembic.config import Config
+from alembic.runtime.migration import MigrationStep, RevisionStep, StampStep
+from alembic.script import Script, ScriptDirectory
+from alembic.script.revision import Revision, RevisionMap
+from mako.template import Template
+
+from .defaults import SCRIPT_MAKO_STRING
+from .events import Observer, phase
+from .store import RevisionMetadata
+
+if TYPE_CHECKING:
+    from alembic.script.revision import _RevIdType
+
+    from .archive import ArchiveSegment
+
+_T = TypeVar("_T", bound="PhantomScriptDirectory")
+_S = TypeVar("_S", bound=MigrationStep)
+
+
+def load_module_from_source(filename: str, source: str, path: Path) -> ModuleType:
+    """
+    ソース文字列からモジュールを生成する (alembic の load_python_file と同じ module id を使う)
+    """
+    return load_module_from_code(filename, compile(source, str(path), "exec", dont_inherit=True), path)
+
+
+def load_module_from_code(filename: str, code: CodeType, path: Path) -> ModuleType:
+    module = ModuleType(re.sub(r"\W", "_", filename))
+    module.__file__ = str(path)
+    exec(code, module.__dict__)
+    return module
+
+
+class LazyScript(Script):
+    """
+    インデックスのグラフ情報だけで構築し、モジュールは実際に参照されたときに初めて読み込む Script
+    """
+
+    def __init__(self, metadata: RevisionMetadata, path: Path, load_module: Callable[[], ModuleType]) -> None:
+        self._module: Optional[ModuleType] = None
+        self._load_module = load_module
+        self.path = str(path)
+        Revision.__init__(
+            self,
+            metadata.revision,
+            metadata.down_revision,
+            branch_labels=util.to_tuple(metadata.branch_labels, default=()),
+            dependencies=util.to_tuple(metadata.depends_on, default=()),
+        )
+
+    @property
+    def module(self) -> ModuleType:
+        if self._module is None:
+            self._module = self._load_module()
+        return self._module
+
+    @module.setter
+    def module(self, module: ModuleType) -> None:
+        self._module = module
+
+
+class ArchiveStubScript(LazyScript):
+    """
+    アーカイブへ移したリビジョンの代わりにリビジョンマップへ載せる根 (down_revision / depends_on を持たない)
+    """
+
+    def __init__(self, metadata: RevisionMetadata, path: Path) -> None:
+        super().__init__(metadata._replace(down_revision=None, depends_on=None), path, self._archived)
+
+    def _archived(self) -> ModuleType:
+        raise util.CommandError(f"Revision {self.revision} is archived and its module is not loaded")
+
+
+class PhantomScriptDirectory(ScriptDirectory):
+    """
+    versions.jsonl のレコードから直接リビジョンマップを構築する ScriptDirectory
+
+    index にグラフ情報があるリビジョンはモジュールを実行せずにリビジョンマップへ載せ、
+    upgrade などで実際に必要になったものだけを読み込む
+
+    アーカイブセグメントがある場合は、まず末尾セグメントとスタブだけでリビジョンマップを作る。
+    マイグレーションの経路がスタブを通るか末尾セグメントだけでは解決できないときに限り、
+    アーカイブを読み込んでリビジョンマップを作り直してから経路を求め直す
+    """
+
+    _records: Mapping[str, str]
+    _metadata: Mapping[str, Optional[RevisionMetadata]]
+    _env_content: str
+    _archive: Optional["ArchiveSegment"] = None
+    _archived: Optional[Mapping[str, str]] = None
+    emit: Optional[Observer] = None
+
+    @classmethod
+    def from_records(
+        cls,
+        config: Config,
+        records: Mapping[str, str],
+        env_content: str,
+        metadata: Optional[Mapping[str, Optional[RevisionMetadata]]] = None,
+        emit: Optional[Observer] = None,
+        archive: Optional["ArchiveSegment"] = None,
+    ) -> "PhantomScriptDirectory":
+        script_directory = cls._from_config(config, emit)
+        script_directory._records = records
+        script_directory._metadata = metadata if metadata is not None else {}
+        script_directory._env_content = env_content
+        script_directory._archive = archive
+        script_directory.revision_map = RevisionMap(script_directory._load_revisions)
+        return script_directory
+
+    @classmethod
+    def _from_config(cls: type[_T], config: Config, emit: Optional[Observer] = None) -> _T:
+        # ScriptDirectory.from_config が解釈する設定はそのまま引き継ぎ、読み込み元だけを差し替える
+        base = ScriptDirectory.from_config(config)
+        script_directory = cls.__new__(cls)
+        script_directory.__dict__.update(base.__dict__)
+        script_directory.emit = emit
+        return script_directory
+
+    def _load_revisions(self) -> Iterator[Script]:
+        yield from self._scripts(self._records, self._metadata)
+        if self._archived is not None:
+            yield from self._scripts(
+                {name: content for name, content in self._archived.items() if name not in self._records},
+                self._metadata,
+            )
+        elif self._archive is not None:
+            yield from self._archive_stubs()
+
+    def _scripts(
+        self, records: Mapping[str, str], metadata_by_name: Mapping[str, Optional[RevisionMetadata]]
+    ) -> Iterator[Script]:
+        for name in sorted(records):
+            if not name.endswith(".py"):
+                continue
+            path = self._singular_version_location / name
+            metadata = metadata_by_name.get(name)
+            if metadata is not None:
+                yield LazyScript(metadata, path, self._module_loader(records, name, path))
+                continue
+            module = self._module_loader(records, name, path)()
+            if not hasattr(module, "revision"):
+                raise util.CommandError(f"Could not determine revision id from filename {name}.")
+            yield Script(module, module.revision, path)
+
+    def _archive_stubs(self) -> Iterator[Script]:
+        assert self._archive is not None
+        revisions: set[str] = set()
+        referenced: Optional[set[str]] = set()
+        for name in self._records:
+            metadata = self._metadata.get(name)
+            if metadata is not None:
+                revisions.add(metadata.revision)
+                if referenced is not None:
+                    referenced.update(metadata.references)
+            elif name.endswith(".py"):
+                # 静的に読めないリビジョンがある場合は、どのスタブが参照されているか分からないので全て載せる
+                referenced = None
+        for name, metadata in self._archive.stubs().items():
+            if metadata.revision not in revisions and (referenced is None or metadata.revision in referenced):
+                yield ArchiveStubScript(metadata, self._singular_version_location / name)
+
+    def _load_archive(self) -> None:
+        assert self._archive is not None
+        with phase(self.emit, "archive.load", path=str(self._archive.path)):
+            archived = self._archive.load()
+        self._archived = archived
+        self._metadata = {**archived.metadata, **self._metadata}
+        self._archive = None
+        self.revision_map = RevisionMap(self._load_revisions)
+
+    def _planned(self, plan: Callable[[], Sequence[_S]]) -> list[_S]:
+        if self._archive is None:
+            return list(plan())
+        try:
+            steps = list(plan())
+        except util.CommandError:
+            steps = None
+        if steps is not None and not any(
+            isinstance(step, RevisionStep) and isinstance(step.revision, ArchiveStubScript) for step in steps
+        ):
+            return steps
+        self._load_archive()
+        return list(plan())
+
+    def _upgrade_revs(self, destination: str, current_rev: str) -> list[RevisionStep]:
+        return self._planned(lambda: super(PhantomScriptDirectory, self)._upgrade_revs(destination, current_rev))
+
+    def _downgrade_revs(self, destination: str, current_rev: Optional[str]) -> list[RevisionStep]:
+        return self._planned(lambda: super(PhantomScriptDirectory, self)._downgrade_revs(destination, current_rev))
+
+    def _stamp_revs(self, revision: "_RevIdType", heads: "_RevIdType") -> list[StampStep]:
+        return self._planned(lambda: super(PhantomScriptDirectory, self)._stamp_revs(revision, heads))
+
+    def _module_loader(self, records: Mapping[str, str], name: str, path: Path) -> Callable[[], ModuleType]:
+        return self._observed(name, lambda: load_module_from_source(name, records[name], path))
+
+    def _observed(self, name: str, load: Callable[[], ModuleType]) -> Callable[[], ModuleType]:
+        emit = self.emit
+        if emit is None:
+            return load
+
+        def observed_load() -> ModuleType:
+            with phase(emit, "revision.import", file=name):
+                return load()
+
+        return observed_load
+
+    def run_env(self) -> None:
+        load_module_from_source("env.py", self._env_content, Path(self.env_py_location))
+
+    def _generate_template(self, src: Path, dest: Path, **kw: Any) -> None:
+        with util.status(f"Generating {dest.absolute()}", **self.messaging_opts):
+            with open(dest, "wb") as f:
+                f.write(Template(SCRIPT_MAKO_STRING).render_unicode(**kw).encode(self.output_encoding))
@@ -0,0 +1,175 @@
+"""
+1つのコンテキスト (リビジョンマップと Config) の上で複数のコマンドを続けて実行するセッション
+
+PhantomAlembic.upgrade() などはコマンドごとにツリーを構築し、終了時にリビジョンストアを書き直す。
+セッションではリビジョンマップを一度だけ構築し、revision で追加されたリビジョンはそのマップに差分として載せ、
+リビジョンストアへの書き込みはセッション終了時の1回にまとめる
+"""
+
+from contextlib import contextmanager
+from pathlib import Path
+from typing import TYPE_CHECKING, Generator, Optional, Sequence, TextIO, Union
+
+from .events import fan_out
+from .report import UpgradeReport, collect_report
+
+if TYPE_CHECKING:
+    from alembic.script import Script, ScriptDirectory
+    from sqlalchemy.engine import Connection, Engine
+
+    from .core import PhantomAlembic, PhantomAlembicContext
+
+    Connectable = Union[Engine, Connection]
+
+
+class PhantomAlembicSession:
+    def __init__(self, phantom_alembic: "PhantomAlembic", context: "PhantomAlembicContext") -> None:
+        self._phantom_alembic = phantom_alembic
+        self._context = context
+        self._script_directory: Optional["ScriptDirectory"] = None
+        # target_metadata はセッション内で一度だけ解決する
+        self._metadata_provider = phantom_alembic._metadata_provider()
+
+    @property
+    def context(self) -> "PhantomAlembicContext":
+        return self._context
+
+    @property
+    def script_directory(self) -> "ScriptDirectory":
+        if self._script_directory is None:
+            self._script_directory = self._phantom_alembic._prepare_script_directory(self._context)
+        return self._script_directory
+
+    @contextmanager
+    def _configured(
+        self, connection: Optional["Connectable"], sql: bool, output: Optional[TextIO]
+    ) -> Generator[None, None, None]:
+        # Config はセッション内で共有するため、コマンドごとの接続・出力先は終了後に戻す
+        config = self._context.alembic_config
+        self._phantom_alembic._configure(config, connection, sql, output)
+        try:
+            yield
+        finally:
+            config.attributes.pop("connection", None)
+            config.attributes.pop("target_metadata", None)
+            config.output_buffer = None
+
+    def revision(
+        self,
+        message: Optional[str] = None,
+        autogenerate: bool = False,
+        connection: Optional["Connectable"] = None,
+        schemas: Optional[Sequence[str]] = None,
+        tables: Optional[Sequence[str]] = None,
+        reflection_cache_dir: Optional[Path] = None,
+    ) -> None:
+        from . import commands
+
+        with self._phantom_alembic._phase("command", command="revision"), self._configured(connection, False, None):
+            if autogenerate:
+                self._phantom_alembic._configure_target_metadata(self._context.alembic_config, self._metadata_provider)
+            commands.revision(
+                self._context.alembic_config,
+                self.script_directory,
+                message=message if message is not None else "empty message",
+                autogenerate=autogenerate,
+                **self._phantom_alembic._autogenerate_options(schemas, tables, reflection_cache_dir),
+            )
+
+    def upgrade(
+        self,
+        revision: str,
+        connection: Optional["Connectable"] = None,
+        sql: bool = False,
+        output: Optional[TextIO] = None,
+        report: bool = False,
+    ) -> Optional[UpgradeReport]:
+        """
+        report は PhantomAlembic.upgrade と同じ
+        """
+        from . import commands
+
+        emit = self._phantom_alembic.emit
+        with (
+            collect_report(revision, report) as collector,
+            self._phantom_alembic._phase("command", command="upgrade", revision=revision),
+            self._configured(connection, sql, output),
+        ):
+            commands.upgrade(
+                self._context.alembic_config,
+                self.script_directory,
+                revision,
+                sql=sql,
+                emit=fan_out(collector, emit) if collector is not None else emit,
+                baseline=self._context.baseline,
+            )
+        return collector.report() if collector is not None else None
+
+    def downgrade(
+        self,
+        revision: str,
+        connection: Optional["Connectable"] = None,
+        sql: bool = False,
+        output: Optional[TextIO] = None,
+    ) -> None:
+        from . import commands
+
+        with (
+            self._phantom_alembic._phase("command", command="downgrade", revision=revision),
+            self._configured(connection, sql, output),
+        ):
+            commands.downgrade(
+                self._context.alembic_config, self.script_directory, revision, sql=sql, emit=self._phantom_alembic.emit
+            )
+
+    def stamp(
+        self,
+        revision: Union[str, Sequence[str]],
+        connection: Optional["Connectable"] = None,
+        sql: bool = False,
+        output: Optional[TextIO] = None,
+        purge: bool = False,
+    ) -> None:
+        from . import commands
+
+        with self._phantom_alembic._phase("command", command="stamp"), self._configured(connection, sql, output):
+            commands.stamp(
+                self._context.alembic_config,
+                self.script_directory,
+                revision,
+                sql=sql,
+                purge=purge,
+                emit=self._phantom_alembic.emit,
+            )
+
+    def check(
+        self,
+        connection: Optional["Connectable"] = None,
+        schemas: Optional[Sequence[str]] = None,
+        tables: Optional[Sequence[str]] = None,
+        reflection_cache_dir: Optional[Path] = None,
+    ) -> None:
+        from . import commands
+
+        with self._phantom_alembic._phase("command", command="check"), self._configured(connection, False, None):
+            self._phantom_alembic._configure_target_metadata(self._context.alembic_config, self._metadata_provider)
+            commands.check(
+                self._context.alembic_config,
+                self.script_directory,
+                **self._phantom_alembic._autogenerate_options(schemas, tables, reflection_cache_dir),
+            )
+
+    def current(self, connection: Optional["Connectable"] = None) -> tuple[str, ...]:
+        return self._phantom_alembic.current(connection)
+
+    def heads(self) -> tuple[str, ...]:
+        return tuple(sorted(self.script_directory.get_heads()))
+
+    def history(self, base: str = "base", head: str = "heads") -> list["Script"]:
+        """
+        head から base に向かう順でリビジョンを返す
+        """
+        return list(self.script_directory.walk_revisions(base, head))
+
+    def is_up_to_date(self, connection: Optional["Connectable"] = None) -> bool:
+        return set(self.current(connection)) == set(self.heads())
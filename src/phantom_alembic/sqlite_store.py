@@ -0,0 +1,210 @@
+"""
+1つの SQLite ファイルにリビジョンを保存するストア
+
+レコードはファイル名を主キーに、revision id にもインデックスを張った表に置く。load で読むのは
+ファイル名とグラフ情報だけで、内容は参照されたレコードだけを SELECT するため、リビジョンが数万件あっても
+起動時に全件をデコードしない。書き込みは変更のあった行の UPSERT / DELETE のみ
+
+WAL モードで開き、load は close まで読み取りトランザクションを保つため、読み込み側は書き込みを待たずに
+load 時点のスナップショットを読み続ける。書き込みは BEGIN IMMEDIATE で他の書き込みと直列化し、
+変更した行だけを書き換えるので、並行して追加されたレコードを消すことはない
+"""
+
+import hashlib
+import json
+import sqlite3
+from contextlib import closing
+from pathlib import Path
+from typing import Any, Hashable, Iterable, Iterator, Mapping, Optional
+
+from .store import (
+    MemoryRecords,
+    RevisionMetadata,
+    RevisionRecords,
+    StoreBackend,
+    read_revision_metadata,
+    record_digest,
+)
+
+SCHEMA_VERSION = 1
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS revisions (
+    name TEXT PRIMARY KEY,
+    revision TEXT,
+    metadata TEXT,
+    digest TEXT NOT NULL,
+    content TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS revisions_revision ON revisions (revision);
+CREATE TABLE IF NOT EXISTS store (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO store (key, value) VALUES ('generation', 0);
+"""
+
+
+def _dump_metadata(metadata: Optional[RevisionMetadata]) -> Optional[str]:
+    return None if metadata is None else json.dumps(list(metadata))
+
+
+def _load_metadata(value: Optional[str]) -> Optional[RevisionMetadata]:
+    return None if value is None else RevisionMetadata.from_json(json.loads(value))
+
+
+class SQLiteRecords(RevisionRecords):
+    def __init__(
+        self,
+        connection: sqlite3.Connection,
+        metadata: Mapping[str, Optional[RevisionMetadata]],
+        digests: dict[str, str],
+    ) -> None:
+        self._connection = connection
+        self._metadata = metadata
+        self._digests = digests
+        self._cache: dict[str, str] = {}
+
+    @property
+    def metadata(self) -> Mapping[str, Optional[RevisionMetadata]]:
+        return self._metadata
+
+    def digest(self, name: str) -> str:
+        return self._digests[name]
+
+    def name_for_revision(self, revision: str) -> str:
+        row = self._connection.execute("SELECT name FROM revisions WHERE revision = ?", (revision,)).fetchone()
+        if row is None:
+            raise KeyError(revision)
+        name: str = row[0]
+        return name
+
+    def __getitem__(self, name: str) -> str:
+        if name not in self._cache:
+            if name not in self._metadata:
+                raise KeyError(name)
+            row = self._connection.execute("SELECT content FROM revisions WHERE name = ?", (name,)).fetchone()
+            if row is None:
+                raise KeyError(name)
+            self._cache[name] = row[0]
+        return self._cache[name]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._metadata)
+
+    def __len__(self) -> int:
+        return len(self._metadata)
+
+
+class SQLiteStore(StoreBackend):
+    def __init__(self, path: Path) -> None:
+        self._path = path
+        self._connection: Optional[sqlite3.Connection] = None
+
+    @property
+    def path(self) -> Path:
+        return self._path
+
+    def _connect(self) -> sqlite3.Connection:
+        """
+        書き込み用に開く (スキーマが無ければ作る)
+        """
+        connection = sqlite3.connect(self.path, check_same_thread=False)
+        try:
+            if self._schema_version(connection) == 0:
+                with connection:
+                    connection.executescript(SCHEMA + f"PRAGMA user_version = {SCHEMA_VERSION};")
+                connection.execute("PRAGMA journal_mode = WAL")
+        except BaseException:
+            connection.close()
+            raise
+        return connection
+
+    def _open(self) -> Optional[sqlite3.Connection]:
+        """
+        読み込み用に開く。スキーマは作らず、ファイルやスキーマがまだ無ければ None を返す
+        """
+        if not self.path.exists():
+            return None
+        connection = sqlite3.connect(self.path, check_same_thread=False)
+        try:
+            if self._schema_version(connection) == 0:
+                connection.close()
+                return None
+        except BaseException:
+            connection.close()
+            raise
+        return connection
+
+    def _schema_version(self, connection: sqlite3.Connection) -> int:
+        (version,) = connection.execute("PRAGMA user_version").fetchone()
+        if version not in (0, SCHEMA_VERSION):
+            raise ValueError(f"{self.path} has an unsupported store schema version: {version}")
+        return int(version)
+
+    def load(self) -> RevisionRecords:
+        self.close()
+        connection = self._open()
+        if connection is None:
+            return MemoryRecords({}, {})
+        self._connection = connection
+        connection.execute("BEGIN")
+        metadata: dict[str, Optional[RevisionMetadata]] = {}
+        digests: dict[str, str] = {}
+        for name, value, digest in connection.execute("SELECT name, metadata, digest FROM revisions ORDER BY name"):
+            metadata[name] = _load_metadata(value)
+            digests[name] = digest
+        return SQLiteRecords(connection, metadata, digests)
+
+    def close(self) -> None:
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def reopen(self) -> "SQLiteStore":
+        return SQLiteStore(self.path)
+
+    def put(self, records: Mapping[str, str], removed: Iterable[str] = ()) -> bool:
+        removed = set(removed)
+        if not records and (not removed or not self.path.exists()):
+            return False
+        self.close()
+        with closing(self._connect()) as connection, connection:
+            connection.execute("BEGIN IMMEDIATE")
+            digests = dict(connection.execute("SELECT name, digest FROM revisions"))
+            rows: list[tuple[Any, ...]] = []
+            for name, content in records.items():
+                digest = record_digest(name, content)
+                if digests.get(name) == digest:
+                    continue
+                metadata = read_revision_metadata(content)
+                revision = metadata.revision if metadata is not None else None
+                rows.append((name, revision, _dump_metadata(metadata), digest, content))
+            deleted = [(name,) for name in removed if name in digests]
+            if not rows and not deleted:
+                return False
+            connection.executemany(
+                "INSERT INTO revisions (name, revision, metadata, digest, content) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (name) DO UPDATE SET revision = excluded.revision, metadata = excluded.metadata, "
+                "digest = excluded.digest, content = excluded.content",
+                rows,
+            )
+            connection.executemany("DELETE FROM revisions WHERE name = ?", deleted)
+            connection.execute("UPDATE store SET value = value + 1 WHERE key = 'generation'")
+        return True
+
+    def digest(self) -> str:
+        h = hashlib.sha256()
+        connection = self._open()
+        if connection is not None:
+            with closing(connection):
+                for name, digest in connection.execute("SELECT name, digest FROM revisions ORDER BY name"):
+                    h.update(f"{name}\0{digest}\n".encode("utf-8"))
+        return h.hexdigest()
+
+    def signature(self) -> Optional[Hashable]:
+        connection = self._open()
+        if connection is None:
+            return (self.path.stat().st_ino, 0) if self.path.exists() else None
+        with closing(connection):
+            (generation,) = connection.execute("SELECT value FROM store WHERE key = 'generation'").fetchone()
+        return (self.path.stat().st_ino, generation)
@@ -0,0 +1,551 @@
+import ast
+import hashlib
+import json
+import mmap
+import os
+import stat
+from abc import ABC, abstractmethod
+from pathlib import Path
+from tempfile import mkstemp
+from typing import (
+    Any,
+    Hashable,
+    Iterable,
+    Iterator,
+    Mapping,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Union,
+)
+
+from .lock import file_lock
+
+INDEX_FORMAT_VERSION = 3
+STORE_BACKENDS = ("jsonl", "sqlite")
+
+
+def atomic_write(path: Path, data: bytes, durable: bool = True) -> None:
+    """
+    同じディレクトリの一時ファイルに書き込んでから rename することで、書き込み途中の状態を残さない
+    durable=False の場合は fsync しない (作り直せるキャッシュのファイル向け)
+    """
+    fd, temp_name = mkstemp(prefix=f".{path.name}.", suffix=".tmp", dir=path.parent)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            if durable:
+                f.flush()
+                os.fsync(f.fileno())
+        if path.exists():
+            os.chmod(temp_name, stat.S_IMODE(os.stat(path).st_mode))
+        else:
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(temp_name, 0o666 & ~umask)
+        os.replace(temp_name, path)
+    except BaseException:
+        if os.path.exists(temp_name):
+            os.unlink(temp_name)
+        raise
+
+
+def file_hash(path: Path) -> str:
+    h = hashlib.sha256()
+    try:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+    except FileNotFoundError:
+        pass
+    return h.hexdigest()
+
+
+def _stat_signature(st: os.stat_result) -> tuple[int, int, int]:
+    return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+def serialize_record(name: str, content: str) -> bytes:
+    return (json.dumps({"name": name, "content": content}) + "\n").encode("utf-8")
+
+
+def record_digest(name: str, content: str) -> str:
+    return hashlib.sha256(serialize_record(name, content)).hexdigest()
+
+
+RevisionIds = Union[str, Tuple[str, ...], None]
+
+
+def _literal_revision_ids(node: ast.expr) -> RevisionIds:
+    value = ast.literal_eval(node)
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, (tuple, list)) and all(isinstance(v, str) for v in value):
+        return tuple(value)
+    raise ValueError(f"Unsupported revision identifier: {value!r}")
+
+
+class RevisionMetadata(NamedTuple):
+    revision: str
+    down_revision: RevisionIds
+    branch_labels: RevisionIds
+    depends_on: RevisionIds
+
+    @property
+    def references(self) -> Tuple[str, ...]:
+        """
+        このリビジョンが参照するリビジョン (down_revision と depends_on)
+        """
+        return tuple(
+            revision
+            for ids in (self.down_revision, self.depends_on)
+            for revision in ((ids,) if isinstance(ids, str) else ids or ())
+        )
+
+    @classmethod
+    def from_json(cls, value: list[Any]) -> "RevisionMetadata":
+        revision, *ids = value
+        down_revision, branch_labels, depends_on = (tuple(v) if isinstance(v, list) else v for v in ids)
+        return cls(revision, down_revision, branch_labels, depends_on)
+
+
+def read_revision_metadata(content: str) -> Optional[RevisionMetadata]:
+    """
+    リビジョンファイルを実行せずに、トップレベルの代入文から
+    revision / down_revision / branch_labels / depends_on を読み取る
+
+    リテラルで書かれていないなど静的に読み取れない場合は None を返す
+    """
+    try:
+        tree = ast.parse(content)
+    except SyntaxError:
+        return None
+    values: dict[str, RevisionIds] = {}
+    for node in tree.body:
+        if isinstance(node, ast.Assign):
+            targets, value = node.targets, node.value
+        elif isinstance(node, ast.AnnAssign) and node.value is not None:
+            targets, value = [node.target], node.value
+        else:
+            continue
+        for target in targets:
+            if isinstance(target, ast.Name) and target.id in RevisionMetadata._fields:
+                try:
+                    values[target.id] = _literal_revision_ids(value)
+                except ValueError:
+                    return None
+    revision = values.get("revision")
+    if not isinstance(revision, str) or "down_revision" not in values:
+        return None
+    return RevisionMetadata(revision, values["down_revision"], values.get("branch_labels"), values.get("depends_on"))
+
+
+class IndexEntry(NamedTuple):
+    name: str
+    offset: int
+    length: int
+    metadata: Optional[RevisionMetadata]
+
+    @property
+    def revision(self) -> Optional[str]:
+        return self.metadata.revision if self.metadata is not None else None
+
+    def to_json(self) -> list[Any]:
+        return [self.name, self.offset, self.length, None if self.metadata is None else list(self.metadata)]
+
+    @classmethod
+    def from_json(cls, value: list[Any]) -> "IndexEntry":
+        name, offset, length, metadata = value
+        return cls(name, offset, length, None if metadata is None else RevisionMetadata.from_json(metadata))
+
+
+class RevisionRecords(Mapping[str, str]):
+    """
+    ファイル名 -> リビジョンファイルの内容 の Mapping と、各レコードのグラフ情報 (どのストアから読んでも同じ形)
+    """
+
+    @property
+    @abstractmethod
+    def metadata(self) -> Mapping[str, Optional[RevisionMetadata]]:
+        """
+        ファイル名 -> グラフ情報 (静的に読み取れないレコードは None)
+        """
+
+    def digest(self, name: str) -> str:
+        """
+        レコードのハッシュ (内容が変われば変わる値。書き込んだレコードは record_digest と一致する)
+        """
+        return record_digest(name, self[name])
+
+    def heads(self) -> Optional[Tuple[str, ...]]:
+        """
+        インデックスのグラフ情報から head を求める (静的に読めないリビジョンがある場合は None)
+        リビジョン以外のレコード (ベースラインなど) は無視する
+        """
+        revisions: set[str] = set()
+        down_revisions: set[str] = set()
+        for name, metadata in self.metadata.items():
+            if not name.endswith(".py"):
+                continue
+            if metadata is None:
+                return None
+            revisions.add(metadata.revision)
+            down_revision = metadata.down_revision
+            down_revisions.update((down_revision,) if isinstance(down_revision, str) else down_revision or ())
+        return tuple(sorted(revisions - down_revisions))
+
+    def name_for_revision(self, revision: str) -> str:
+        for name, metadata in self.metadata.items():
+            if metadata is not None and metadata.revision == revision:
+                return name
+        raise KeyError(revision)
+
+
+class MemoryRecords(RevisionRecords):
+    def __init__(self, contents: Mapping[str, str], metadata: Mapping[str, Optional[RevisionMetadata]]) -> None:
+        self._contents = contents
+        self._metadata = metadata
+
+    @property
+    def metadata(self) -> Mapping[str, Optional[RevisionMetadata]]:
+        return self._metadata
+
+    def __getitem__(self, name: str) -> str:
+        return self._contents[name]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._contents)
+
+    def __len__(self) -> int:
+        return len(self._contents)
+
+
+class VersionRecords(RevisionRecords):
+    """
+    versions.jsonl から読み込んだレコード
+
+    内容は mmap 上のオフセットから、実際に参照されたときに初めてデコードする
+    """
+
+    def __init__(self, buffer: "mmap.mmap | bytes", entries: Mapping[str, IndexEntry]) -> None:
+        self._buffer = buffer
+        self._entries = entries
+        self._names_by_revision = {e.revision: e.name for e in entries.values() if e.revision is not None}
+        self._metadata: Optional[dict[str, Optional[RevisionMetadata]]] = None
+        self._cache: dict[str, str] = {}
+
+    @property
+    def entries(self) -> Mapping[str, IndexEntry]:
+        return self._entries
+
+    @property
+    def metadata(self) -> Mapping[str, Optional[RevisionMetadata]]:
+        if self._metadata is None:
+            self._metadata = {name: entry.metadata for name, entry in self._entries.items()}
+        return self._metadata
+
+    def raw(self, name: str) -> bytes:
+        entry = self._entries[name]
+        return bytes(self._buffer[entry.offset : entry.offset + entry.length])
+
+    def digest(self, name: str) -> str:
+        # このストアが書いた行は serialize_record の結果そのものなので、デコードせずに行のハッシュを取る
+        line = self.raw(name)
+        return hashlib.sha256(line if line.endswith(b"\n") else line + b"\n").hexdigest()
+
+    def name_for_revision(self, revision: str) -> str:
+        return self._names_by_revision[revision]
+
+    def __getitem__(self, name: str) -> str:
+        if name not in self._cache:
+            content: str = json.loads(self.raw(name))["content"]
+            self._cache[name] = content
+        return self._cache[name]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._entries)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class StoreBackend(ABC):
+    """
+    リビジョンストアのバックエンド
+
+    load で全レコードのファイル名とグラフ情報を読み、内容は参照されたときに取り出す。
+    put は変更のあったレコードだけを書き込み、実際に書き込んだかどうかを返す
+    """
+
+    @property
+    def path(self) -> Optional[Path]:
+        """
+        ストアのファイル (ファイルを持たないストアは None)
+        """
+        return None
+
+    @abstractmethod
+    def load(self) -> RevisionRecords: ...
+
+    def close(self) -> None:
+        """
+        load が返したレコードの読み込みに使っているリソースを解放する
+        """
+
+    def reopen(self) -> "StoreBackend":
+        """
+        同じストアを指す別のハンドル (そちらの load / close はこのハンドルが読み込んだレコードに影響しない)
+        load が返すレコードがリソースを持たないストアはそのまま自身を返してよい
+        """
+        return self
+
+    @abstractmethod
+    def put(self, records: Mapping[str, str], removed: Iterable[str] = ()) -> bool:
+        """
+        records を追加・更新し、removed のレコードを削除する (その他のレコードには触れない)
+        """
+
+    def save(self, records: Mapping[str, str]) -> bool:
+        """
+        records をストアの内容とする (records に無いレコードは削除する)
+        """
+        return self.put(records, [name for name in self.load() if name not in records])
+
+    @abstractmethod
+    def digest(self) -> str:
+        """
+        ストア全体の内容のハッシュ (キャッシュやバンドルのキーに使う)
+        """
+
+    @abstractmethod
+    def signature(self) -> Optional[Hashable]:
+        """
+        内容が変わると必ず変わる安価な値 (ストアがまだ存在しなければ None)
+        """
+
+
+def open_store(path: Path, backend: str = "jsonl") -> StoreBackend:
+    """
+    backend で指定したバックエンドで開く ("jsonl" は VersionStore、"sqlite" は SQLiteStore)
+    拡張子からは推測しない (既存の .db ファイルなどを意図せず SQLite のストアとして書き換えないため)
+    """
+    if backend == "sqlite":
+        from .sqlite_store import SQLiteStore
+
+        return SQLiteStore(path)
+    if backend != "jsonl":
+        raise ValueError(f"unknown store backend: {backend!r} (expected one of {', '.join(STORE_BACKENDS)})")
+    return VersionStore(path)
+
+
+class MemoryStore(StoreBackend):
+    """
+    ファイルを一切読み書きしないストア (テストやアプリケーションへの組み込み用)
+    """
+
+    def __init__(self, records: Optional[Mapping[str, str]] = None) -> None:
+        self._contents: dict[str, str] = {}
+        self._metadata: dict[str, Optional[RevisionMetadata]] = {}
+        self._generation = 0
+        if records:
+            self.put(records)
+
+    def load(self) -> MemoryRecords:
+        return MemoryRecords(dict(self._contents), dict(self._metadata))
+
+    def put(self, records: Mapping[str, str], removed: Iterable[str] = ()) -> bool:
+        changed = {name: content for name, content in records.items() if self._contents.get(name) != content}
+        removed = {name for name in removed if name in self._contents}
+        if not changed and not removed:
+            return False
+        for name in removed:
+            del self._contents[name]
+            del self._metadata[name]
+        for name, content in changed.items():
+            self._contents[name] = content
+            self._metadata[name] = read_revision_metadata(content)
+        self._generation += 1
+        return True
+
+    def digest(self) -> str:
+        h = hashlib.sha256()
+        for name in sorted(self._contents):
+            h.update(serialize_record(name, self._contents[name]))
+        return h.hexdigest()
+
+    def signature(self) -> Optional[Hashable]:
+        return (id(self), self._generation)
+
+
+class VersionStore(StoreBackend):
+    """
+    versions.jsonl の読み書きを行う
+
+    ファイル名・revision id からレコードのオフセットを引くインデックスを `<versions.jsonl>.idx` に置き、
+    各リビジョンのグラフ情報 (revision / down_revision / branch_labels / depends_on) も合わせて保持する。
+    versions.jsonl 自体は mmap で開く。インデックスが無い・古い場合は JSONL を走査して作り直すので、
+    従来の素の JSONL もそのまま読める。インデックスはいつでも作り直せる生成物なので、
+    リポジトリには commit せず .gitignore に入れる
+
+    load 時点のレコードを覚えておき、save/put では変更のあったレコードだけを書き換える
+    (変更のない行はバイト列のまま残し、新しいレコードは末尾に追加する)。load 前や close 後は読み込み直してから書く
+
+    書き込みは `<versions.jsonl>.lock` の排他ロックを取り、load 以降に他のプロセスが書き込んでいれば
+    その内容に自分の変更 (追加・更新・削除したレコード) だけを重ねてから rename する。
+    ロックファイルは中身の無いファイルのまま残るので、インデックスと同じく .gitignore に入れる。
+    読み込みはロックを取らず、rename で置き換わる前のファイルを mmap したまま一貫したスナップショットとして読み続ける
+    """
+
+    def __init__(self, path: Path) -> None:
+        self._path = path
+        self._records: Optional[VersionRecords] = None
+        self._loaded_signature: Optional[Hashable] = None
+        self._file: Optional[mmap.mmap] = None
+
+    @property
+    def path(self) -> Path:
+        return self._path
+
+    def digest(self) -> str:
+        return file_hash(self.path)
+
+    def signature(self) -> Optional[Hashable]:
+        try:
+            return _stat_signature(os.stat(self.path))
+        except FileNotFoundError:
+            return None
+
+    @property
+    def index_path(self) -> Path:
+        return self.path.with_name(self.path.name + ".idx")
+
+    @property
+    def lock_path(self) -> Path:
+        return self.path.with_name(self.path.name + ".lock")
+
+    def load(self) -> VersionRecords:
+        self.close()
+        if not self.path.exists():
+            self._records = VersionRecords(b"", {})
+            self._loaded_signature = None
+            return self._records
+        with open(self.path, "rb") as f:
+            st = os.fstat(f.fileno())
+            self._loaded_signature = _stat_signature(st)
+            buffer: "mmap.mmap | bytes" = b""
+            if st.st_size > 0:
+                self._file = buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        entries = self._read_index(st)
+        if entries is None:
+            entries = self._scan(buffer)
+            self._write_index(entries, st)
+        self._records = VersionRecords(buffer, entries)
+        return self._records
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self._records = None
+
+    def reopen(self) -> "VersionStore":
+        return VersionStore(self.path)
+
+    def _loaded(self) -> VersionRecords:
+        return self._records if self._records is not None else self.load()
+
+    def save(self, records: Mapping[str, str]) -> bool:
+        """
+        records をストアの内容とする (records に無いレコードは削除する)
+        """
+        removed = {name for name in self._loaded() if name not in records}
+        return self._write(self._changed(records), removed)
+
+    def put(self, records: Mapping[str, str], removed: Iterable[str] = ()) -> bool:
+        """
+        records を追加・更新し、removed のレコードを削除する (その他のレコードには触れない)
+        """
+        return self._write(self._changed(records), {name for name in removed if name in self._loaded()})
+
+    def _changed(self, records: Mapping[str, str]) -> dict[str, str]:
+        current = self._loaded()
+        return {name: content for name, content in records.items() if name not in current or current[name] != content}
+
+    def _write(self, changed: Mapping[str, str], removed: set[str]) -> bool:
+        if not changed and not removed:
+            return False
+        with file_lock(self.lock_path):
+            current = self._loaded()
+            if self.signature() != self._loaded_signature:
+                # load 以降に他のプロセスが書き込んだレコードを失わないよう、最新の内容を土台にする
+                current = self.load()
+            self._write_locked(current, changed, removed)
+        return True
+
+    def _write_locked(self, current: VersionRecords, changed: Mapping[str, str], removed: set[str]) -> None:
+        lines: dict[str, bytes] = {}
+        metadata: dict[str, Optional[RevisionMetadata]] = {}
+        for name, entry in current.entries.items():
+            if name in removed:
+                continue
+            if name in changed:
+                lines[name] = serialize_record(name, changed[name])
+                metadata[name] = read_revision_metadata(changed[name])
+            else:
+                line = current.raw(name)
+                lines[name] = line if line.endswith(b"\n") else line + b"\n"
+                metadata[name] = entry.metadata
+        for name, content in changed.items():
+            if name not in lines:
+                lines[name] = serialize_record(name, content)
+                metadata[name] = read_revision_metadata(content)
+        data = b"".join(lines.values())
+        self.close()
+        atomic_write(self.path, data)
+        entries: dict[str, IndexEntry] = {}
+        offset = 0
+        for name, line in lines.items():
+            entries[name] = IndexEntry(name, offset, len(line), metadata[name])
+            offset += len(line)
+        st = os.stat(self.path)
+        self._write_index(entries, st)
+        self._records = VersionRecords(data, entries)
+        self._loaded_signature = _stat_signature(st)
+
+    def _scan(self, buffer: "mmap.mmap | bytes") -> dict[str, IndexEntry]:
+        entries: dict[str, IndexEntry] = {}
+        offset = 0
+        size = len(buffer)
+        while offset < size:
+            end = buffer.find(b"\n", offset)
+            end = size if end < 0 else end + 1
+            line = buffer[offset:end]
+            if line.strip():
+                item = json.loads(line)
+                name = item["name"]
+                entries[name] = IndexEntry(name, offset, end - offset, read_revision_metadata(item["content"]))
+            offset = end
+        return entries
+
+    def _read_index(self, st: os.stat_result) -> Optional[dict[str, IndexEntry]]:
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return None
+        # rename で置き換えられたファイルはサイズと mtime が偶然一致しても inode で見分ける
+        if index.get("format") != INDEX_FORMAT_VERSION or tuple(index.get("signature", ())) != _stat_signature(st):
+            return None
+        return {e[0]: IndexEntry.from_json(e) for e in index["records"]}
+
+    def _write_index(self, entries: Mapping[str, IndexEntry], st: os.stat_result) -> None:
+        index = {
+            "format": INDEX_FORMAT_VERSION,
+            "signature": _stat_signature(st),
+            "records": [e.to_json() for e in entries.values()],
+        }
+        try:
+            atomic_write(self.index_path, json.dumps(index).encode("utf-8"))
+        except OSError:
+            # 読み取り専用のファイルシステムなどではインデックスを残せないが、読み込み自体は続けられる
+            pass
@@ -0,0 +1,176 @@
+"""
+マイグレーション済みのテンプレートデータベースを作っておき、テスト用のデータベースをそのコピーとして作る
+
+テンプレートはリビジョンストア・env_content・ini_content・revision のハッシュごとに1回だけ作る。
+SQLite はテンプレートディレクトリ内のファイルをコピーし、PostgreSQL は同じサーバー上のテンプレートデータベースから
+CREATE DATABASE ... TEMPLATE で作る。テンプレートの作成はファイルロックで排他するため、
+pytest-xdist のワーカーが同時に要求しても作成は1回だけになる
+"""
+
+import os
+import shutil
+from pathlib import Path
+from tempfile import mkstemp
+from typing import TYPE_CHECKING, Union
+
+from .cache import content_hash
+from .lock import file_lock
+
+if TYPE_CHECKING:
+    from sqlalchemy.engine import URL, Connection
+
+    from .core import PhantomAlembic
+
+TEMPLATE_PREFIX = "phantom_alembic_"
+
+
+class DatabaseTemplate:
+    def __init__(
+        self,
+        phantom_alembic: "PhantomAlembic",
+        template_dir: Path,
+        revision: str = "head",
+        maintenance_database: str = "postgres",
+    ) -> None:
+        self._phantom_alembic = phantom_alembic
+        self._template_dir = template_dir
+        self._revision = revision
+        self._maintenance_database = maintenance_database
+
+    @property
+    def template_dir(self) -> Path:
+        return self._template_dir
+
+    @property
+    def revision(self) -> str:
+        return self._revision
+
+    def key(self) -> str:
+        """
+        テンプレートを識別するハッシュ (リビジョンストアの内容が変われば別のテンプレートになる)
+        """
+        pa = self._phantom_alembic
+        return content_hash(
+            pa.open_store().digest().encode("utf-8"),
+            pa.env_content.encode("utf-8"),
+            (pa.ini_content or "").encode("utf-8"),
+            self.revision.encode("utf-8"),
+        )
+
+    def clone(self, url: Union[str, "URL"]) -> "URL":
+        """
+        url のデータベースをテンプレートのコピーとして作り直す (既にあれば置き換える)
+        """
+        from sqlalchemy.engine import make_url
+
+        target = make_url(url)
+        with self._phantom_alembic._phase("template.clone", dialect=target.get_backend_name()):
+            if target.get_backend_name() == "sqlite":
+                self._clone_sqlite(target)
+            elif target.get_backend_name() == "postgresql":
+                self._clone_postgresql(target)
+            else:
+                raise ValueError(f"Cannot clone a template database for {target.get_backend_name()}")
+        return target
+
+    def drop(self, url: Union[str, "URL"]) -> None:
+        """
+        clone で作ったデータベースを削除する
+        """
+        from sqlalchemy.engine import make_url
+
+        target = make_url(url)
+        if target.get_backend_name() == "sqlite":
+            Path(self._sqlite_path(target)).unlink(missing_ok=True)
+        elif target.get_backend_name() == "postgresql":
+            with self._maintenance_connection(target) as connection:
+                connection.exec_driver_sql(f"DROP DATABASE IF EXISTS {self._quote(connection, target.database)}")
+        else:
+            raise ValueError(f"Cannot drop a database for {target.get_backend_name()}")
+
+    def _sqlite_path(self, url: "URL") -> str:
+        if not url.database or url.database == ":memory:":
+            raise ValueError("A file-based SQLite URL is required to clone the template database")
+        return url.database
+
+    def sqlite_template(self) -> Path:
+        """
+        SQLite のテンプレートファイルのパス (無ければマイグレーションして作る)
+        """
+        self.template_dir.mkdir(parents=True, exist_ok=True)
+        key = self.key()[:32]
+        path = self.template_dir / f"{key}.sqlite3"
+        if path.exists():
+            return path
+        with file_lock(self.template_dir / f"{key}.lock"):
+            if path.exists():
+                return path
+            # 途中で失敗したテンプレートを他のワーカーが使わないよう、一時ファイルで作ってから置き換える
+            fd, tmp = mkstemp(dir=self.template_dir, prefix=f".{key}.", suffix=".sqlite3")
+            os.close(fd)
+            try:
+                with self._phantom_alembic._phase("template.build", dialect="sqlite"):
+                    self._migrate(f"sqlite:///{tmp}")
+                os.replace(tmp, path)
+            finally:
+                Path(tmp).unlink(missing_ok=True)
+        return path
+
+    def _clone_sqlite(self, target: "URL") -> None:
+        template = self.sqlite_template()
+        destination = Path(self._sqlite_path(target))
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        for suffix in ["-journal", "-wal", "-shm"]:
+            destination.with_name(destination.name + suffix).unlink(missing_ok=True)
+        shutil.copyfile(template, destination)
+
+    def _migrate(self, url: Union[str, "URL"]) -> None:
+        from sqlalchemy import create_engine, pool
+
+        engine = create_engine(url, poolclass=pool.NullPool)
+        try:
+            self._phantom_alembic.upgrade(self.revision, connection=engine)
+        finally:
+            engine.dispose()
+
+    def _maintenance_connection(self, url: "URL") -> "Connection":
+        from sqlalchemy import create_engine, pool
+
+        engine = create_engine(
+            url.set(database=self._maintenance_database), poolclass=pool.NullPool, isolation_level="AUTOCOMMIT"
+        )
+        return engine.connect()
+
+    def _quote(self, connection: "Connection", name: str | None) -> str:
+        if not name:
+            raise ValueError("A database name is required")
+        return connection.dialect.identifier_preparer.quote(name)
+
+    def postgresql_template(self, url: "URL") -> str:
+        """
+        url と同じサーバー上のテンプレートデータベースの名前 (無ければマイグレーションして作る)
+        """
+        from sqlalchemy import text
+
+        name = f"{TEMPLATE_PREFIX}{self.key()[:32]}"
+        self.template_dir.mkdir(parents=True, exist_ok=True)
+        with file_lock(self.template_dir / f"{name}.lock"), self._maintenance_connection(url) as connection:
+            exists = text("SELECT 1 FROM pg_database WHERE datname = :name")
+            if connection.execute(exists, {"name": name}).scalar() is not None:
+                return name
+            building = f"{name}_building"
+            connection.exec_driver_sql(f"DROP DATABASE IF EXISTS {self._quote(connection, building)}")
+            connection.exec_driver_sql(f"CREATE DATABASE {self._quote(connection, building)}")
+            with self._phantom_alembic._phase("template.build", dialect="postgresql"):
+                self._migrate(url.set(database=building))
+            connection.exec_driver_sql(
+                f"ALTER DATABASE {self._quote(connection, building)} RENAME TO {self._quote(connection, name)}"
+            )
+        return name
+
+    def _clone_postgresql(self, target: "URL") -> None:
+        template = self.postgresql_template(target)
+        with self._maintenance_connection(target) as connection:
+            database = self._quote(connection, target.database)
+            connection.exec_driver_sql(f"DROP DATABASE IF EXISTS {database}")
+            connection.exec_driver_sql(f"CREATE DATABASE {database} TEMPLATE {self._quote(connection, template)}")
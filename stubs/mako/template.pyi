@@ -0,0 +1,5 @@
+from typing import Any
+
+class Template:
+    def __init__(self, text: str | None = None, filename: str | None = None, **kwargs: Any) -> None: ...
+    def render_unicode(self, *args: Any, **data: Any) -> str: ...
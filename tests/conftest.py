@@ -5,6 +5,10 @@ from typing import Generator
 
 import pytest
 
+from phantom_alembic.store import VersionStore
+
+pytest_plugins = ["phantom_alembic.pytest_plugin"]
+
 
 @pytest.fixture
 def fixture_path() -> Generator[Path, None, None]:
@@ -52,3 +56,34 @@ def e2e_upgrade_reference_alembic_assets(e2e_upgrade_assets: Path) -> Generator[
 @pytest.fixture
 def e2e_upgrade_sut_alembic_assets(e2e_upgrade_assets: Path) -> Generator[Path, None, None]:
     yield e2e_upgrade_assets / "sut"
+
+
+REVISION_TEMPLATE = """
+import sqlalchemy as sa
+from alembic import op
+
+revision = "{rev}"
+down_revision = {down!r}
+
+
+def upgrade():
+    op.create_table("t_{rev}", sa.Column("id", sa.Integer, primary_key=True))
+
+
+def downgrade():
+    op.drop_table("t_{rev}")
+"""
+
+CHAIN = [("a1", None), ("b2", "a1"), ("c3", "b2"), ("d4", "c3")]
+
+
+@pytest.fixture
+def chain_revisions() -> dict[str, str]:
+    return {f"{rev}_.py": REVISION_TEMPLATE.format(rev=rev, down=down) for rev, down in CHAIN}
+
+
+@pytest.fixture
+def version_data_path(tmp_path: Path, chain_revisions: dict[str, str]) -> Path:
+    path = tmp_path / "versions.jsonl"
+    VersionStore(path).put(chain_revisions)
+    return path
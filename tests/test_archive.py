@@ -0,0 +1,60 @@
+from pathlib import Path
+
+import pytest
+from sqlalchemy import create_engine, inspect
+
+from phantom_alembic import PhantomAlembic
+from phantom_alembic.archive import ArchiveSegment
+from phantom_alembic.events import Event
+from phantom_alembic.store import VersionStore
+
+
+def tables(url: str) -> set[str]:
+    engine = create_engine(url)
+    try:
+        return set(inspect(engine).get_table_names()) - {"alembic_version"}
+    finally:
+        engine.dispose()
+
+
+def test_archive_moves_ancestors_and_keeps_a_stub(version_data_path: Path) -> None:
+    sut = PhantomAlembic(version_data_path=version_data_path)
+    assert sut.archive("c3") == ["a1_.py", "b2_.py"]
+
+    assert sorted(VersionStore(version_data_path).load()) == ["c3_.py", "d4_.py"]
+    archive = ArchiveSegment(version_data_path.with_name("versions.jsonl.archive"))
+    assert [m.revision for m in archive.stubs().values()] == ["b2"]
+    assert sorted(archive.load()) == ["a1_.py", "b2_.py"]
+    assert sut.heads() == ("d4",)
+    with pytest.raises(ValueError):
+        sut.archive("b2")
+
+
+def test_upgrade_opens_the_archive_only_when_the_path_crosses_it(version_data_path: Path, tmp_path: Path) -> None:
+    sut = PhantomAlembic(version_data_path=version_data_path)
+    events: list[Event] = []
+    sut.add_observer(events.append)
+    old, new = f"sqlite:///{tmp_path / 'old.db'}", f"sqlite:///{tmp_path / 'new.db'}"
+    sut.upgrade("b2", connection=create_engine(old))
+    sut.archive("c3")
+    events.clear()
+
+    sut.upgrade("head", connection=create_engine(old))
+    assert tables(old) == {"t_a1", "t_b2", "t_c3", "t_d4"}
+    assert "archive.load" not in [event.name for event in events]
+
+    sut.upgrade("head", connection=create_engine(new))
+    assert tables(new) == {"t_a1", "t_b2", "t_c3", "t_d4"}
+    assert [event.name for event in events].count("archive.load") == 1
+
+    sut.downgrade("base", connection=create_engine(new))
+    assert tables(new) == set()
+
+
+def test_disk_context_materializes_the_archive_without_writing_it_back(version_data_path: Path, tmp_path: Path) -> None:
+    sut = PhantomAlembic(version_data_path=version_data_path, in_memory=False)
+    sut.archive("c3")
+    url = f"sqlite:///{tmp_path / 'app.db'}"
+    sut.upgrade("head", connection=create_engine(url))
+    assert tables(url) == {"t_a1", "t_b2", "t_c3", "t_d4"}
+    assert sorted(VersionStore(version_data_path).load()) == ["c3_.py", "d4_.py"]
@@ -0,0 +1,81 @@
+from pathlib import Path
+from typing import Callable
+
+import pytest
+from sqlalchemy import create_engine, inspect
+
+from phantom_alembic import PhantomAlembic
+from phantom_alembic.baseline import read_baseline
+from phantom_alembic.events import Event
+from phantom_alembic.sqlite_store import SQLiteStore
+from phantom_alembic.store import StoreBackend, VersionStore
+
+
+def state(url: str) -> tuple[set[str], list[str]]:
+    engine = create_engine(url)
+    try:
+        with engine.connect() as connection:
+            versions = [row[0] for row in connection.exec_driver_sql("SELECT version_num FROM alembic_version")]
+        return set(inspect(engine).get_table_names()) - {"alembic_version"}, versions
+    finally:
+        engine.dispose()
+
+
+def test_squash_records_only_the_migration_statements(version_data_path: Path) -> None:
+    sut = PhantomAlembic(version_data_path=version_data_path)
+    baseline = sut.squash("c3", dialect="sqlite")
+    assert (baseline.revision, baseline.dialect) == ("c3", "sqlite")
+    assert [statement.split("(")[0].strip() for statement in baseline.statements] == [
+        "CREATE TABLE t_a1",
+        "CREATE TABLE t_b2",
+        "CREATE TABLE t_c3",
+    ]
+    assert read_baseline(VersionStore(version_data_path).load(), "sqlite") == baseline
+
+
+def test_empty_database_starts_from_the_baseline(version_data_path: Path, tmp_path: Path) -> None:
+    sut = PhantomAlembic(version_data_path=version_data_path)
+    sut.squash("c3", dialect="sqlite")
+    events: list[Event] = []
+    sut.add_observer(events.append)
+    fresh, existing = f"sqlite:///{tmp_path / 'fresh.db'}", f"sqlite:///{tmp_path / 'existing.db'}"
+
+    sut.upgrade("head", connection=create_engine(fresh))
+    assert state(fresh) == ({"t_a1", "t_b2", "t_c3", "t_d4"}, ["d4"])
+    assert [e.attributes["file"] for e in events if e.name == "revision.import"] == ["d4_.py"]
+
+    sut.upgrade("a1", connection=create_engine(existing))
+    sut.upgrade("head", connection=create_engine(existing))
+    assert state(existing) == ({"t_a1", "t_b2", "t_c3", "t_d4"}, ["d4"])
+
+    sut.downgrade("base", connection=create_engine(fresh))
+    assert state(fresh) == (set(), [])
+
+
+def test_baseline_is_skipped_when_the_target_is_older(version_data_path: Path, tmp_path: Path) -> None:
+    sut = PhantomAlembic(version_data_path=version_data_path, in_memory=False)
+    sut.squash("c3", dialect="sqlite")
+    url = f"sqlite:///{tmp_path / 'app.db'}"
+    sut.upgrade("b2", connection=create_engine(url))
+    assert state(url) == ({"t_a1", "t_b2"}, ["b2"])
+    assert read_baseline(VersionStore(version_data_path).load(), "sqlite") is not None
+
+
+@pytest.mark.parametrize(
+    "store",
+    [lambda p: VersionStore(p / "versions.jsonl"), lambda p: SQLiteStore(p / "versions.sqlite3")],
+    ids=["jsonl", "sqlite"],
+)
+def test_baseline_is_read_from_the_context_of_a_store_instance(
+    store: Callable[[Path], StoreBackend], chain_revisions: dict[str, str], tmp_path: Path
+) -> None:
+    backend = store(tmp_path)
+    backend.put(chain_revisions)
+    sut = PhantomAlembic(backend)
+    sut.squash("c3", dialect="sqlite")
+    url = f"sqlite:///{tmp_path / 'app.db'}"
+    sut.upgrade("head", connection=create_engine(url))
+    assert state(url) == ({"t_a1", "t_b2", "t_c3", "t_d4"}, ["d4"])
+    with sut.session() as session:
+        session.upgrade("head", connection=create_engine(f"sqlite:///{tmp_path / 'other.db'}"))
+    assert state(f"sqlite:///{tmp_path / 'other.db'}") == ({"t_a1", "t_b2", "t_c3", "t_d4"}, ["d4"])
@@ -0,0 +1,52 @@
+import shutil
+from pathlib import Path
+
+import pytest
+from sqlalchemy import create_engine, text
+
+from phantom_alembic import PhantomAlembic
+from phantom_alembic.archive import ArchiveSegment
+from phantom_alembic.bundle import BundleError
+from phantom_alembic.store import MemoryRecords, VersionStore
+
+
+def test_upgrade_from_bundle(e2e_upgrade_sut_alembic_assets: Path, tmp_path: Path) -> None:
+    version_data_path = tmp_path / "versions.jsonl"
+    shutil.copy(e2e_upgrade_sut_alembic_assets / "versions.jsonl", version_data_path)
+    bundle_path = PhantomAlembic(version_data_path).bundle(tmp_path / "migrations.bundle")
+    sut = PhantomAlembic(version_data_path, bundle_path=bundle_path)
+
+    engine = create_engine(f"sqlite:///{tmp_path / 'app.db'}")
+    with engine.begin() as connection:
+        sut.upgrade("head", connection=connection)
+        assert connection.execute(text("SELECT version_num FROM alembic_version")).fetchall() == [("517ac74ab831",)]
+    engine.dispose()
+
+
+def test_stale_bundle_is_rejected(e2e_upgrade_sut_alembic_assets: Path, tmp_path: Path) -> None:
+    version_data_path = tmp_path / "versions.jsonl"
+    shutil.copy(e2e_upgrade_sut_alembic_assets / "versions.jsonl", version_data_path)
+    bundle_path = PhantomAlembic(version_data_path).bundle(tmp_path / "migrations.bundle")
+    store = VersionStore(version_data_path)
+    store.load()
+    store.put({"ffff_.py": 'revision = "ffff"\ndown_revision = "517ac74ab831"\n'})
+    store.close()
+
+    with pytest.raises(BundleError, match="stale"):
+        PhantomAlembic(version_data_path, bundle_path=bundle_path).load_bundle()
+
+
+def test_bundle_is_stale_when_the_archive_changes(e2e_upgrade_sut_alembic_assets: Path, tmp_path: Path) -> None:
+    version_data_path = tmp_path / "versions.jsonl"
+    shutil.copy(e2e_upgrade_sut_alembic_assets / "versions.jsonl", version_data_path)
+    sut = PhantomAlembic(version_data_path, bundle_path=tmp_path / "migrations.bundle")
+    sut.archive("517ac74ab831")
+    sut.bundle()
+    sut.load_bundle()
+
+    archive = ArchiveSegment(version_data_path.with_name("versions.jsonl.archive"))
+    records = archive.load()
+    edited = MemoryRecords({name: content + "\n" for name, content in records.items()}, records.metadata)
+    archive.write(edited, archive.stubs())
+    with pytest.raises(BundleError, match="stale"):
+        sut.load_bundle()
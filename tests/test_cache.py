@@ -0,0 +1,115 @@
+import os
+import shutil
+import threading
+from pathlib import Path
+
+from phantom_alembic import PhantomAlembic
+from phantom_alembic.cache import LOCK_FILENAME, MANIFEST_FILENAME, MaterializationCache
+from phantom_alembic.lock import file_lock
+
+
+def test_cached_context_reuses_tree(tmp_path: Path, e2e_upgrade_sut_alembic_assets: Path) -> None:
+    version_data_path = tmp_path / "versions.jsonl"
+    shutil.copy(e2e_upgrade_sut_alembic_assets / "versions.jsonl", version_data_path)
+    cache_dir = tmp_path / "cache"
+    pa = PhantomAlembic(version_data_path, in_memory=False, cache_dir=cache_dir)
+
+    with pa.context() as context:
+        first_dir = context.dir_path
+        env_mtime = (context.migrations_path / "env.py").stat().st_mtime_ns
+        version_files = sorted(p.name for p in context.version_path.glob("*.py"))
+        (context.version_path / "__pycache__").mkdir()
+        (context.version_path / "__pycache__" / "marker.pyc").write_bytes(b"")
+    assert version_files
+
+    with pa.context() as context:
+        assert context.dir_path == first_dir
+        assert (context.migrations_path / "env.py").stat().st_mtime_ns == env_mtime
+        assert (context.version_path / "__pycache__" / "marker.pyc").exists()
+        (context.version_path / version_files[0]).unlink()
+    assert (first_dir / MANIFEST_FILENAME).exists()
+
+    with pa.context() as context:
+        assert sorted(p.name for p in context.version_path.glob("*.py")) == version_files[1:]
+
+
+def test_cached_context_keeps_an_entry_per_store(tmp_path: Path, e2e_upgrade_sut_alembic_assets: Path) -> None:
+    cache_dir = tmp_path / "cache"
+    dir_paths = []
+    for name in ["a", "b"]:
+        (tmp_path / name).mkdir()
+        shutil.copy(e2e_upgrade_sut_alembic_assets / "versions.jsonl", tmp_path / name / "versions.jsonl")
+        with PhantomAlembic(tmp_path / name / "versions.jsonl", in_memory=False, cache_dir=cache_dir).context() as c:
+            dir_paths.append(c.dir_path)
+    assert dir_paths[0] != dir_paths[1]
+    assert sorted(p for p in cache_dir.iterdir() if p.is_dir()) == sorted(dir_paths)
+
+
+def test_evict_removes_oldest_entries(tmp_path: Path) -> None:
+    cache = MaterializationCache(tmp_path, max_bytes=10, max_age=None)
+    for name in ["a", "b"]:
+        (tmp_path / name).mkdir()
+        (tmp_path / name / "file").write_bytes(b"x" * 8)
+    cache.evict(keep=[tmp_path / "b"])
+    assert not (tmp_path / "a").exists()
+    assert (tmp_path / "b").exists()
+
+
+def test_evict_keeps_entries_in_use_by_another_store(tmp_path: Path, e2e_upgrade_sut_alembic_assets: Path) -> None:
+    cache_dir = tmp_path / "cache"
+    sut = []
+    for name in ["a", "b"]:
+        (tmp_path / name).mkdir()
+        shutil.copy(e2e_upgrade_sut_alembic_assets / "versions.jsonl", tmp_path / name / "versions.jsonl")
+        sut.append(
+            PhantomAlembic(tmp_path / name / "versions.jsonl", in_memory=False, cache_dir=cache_dir, cache_max_bytes=1)
+        )
+
+    with sut[0].context() as a:
+        with sut[1].context() as b:
+            pass
+        assert a.version_path.is_dir()
+    assert (a.dir_path / MANIFEST_FILENAME).exists()
+    # 使用中でなくなったエントリは次の evict で消える
+    assert not b.dir_path.exists()
+
+
+def test_evict_skips_locked_entries(tmp_path: Path) -> None:
+    cache = MaterializationCache(tmp_path, max_bytes=0, max_age=None)
+    for name in ["a", "b"]:
+        (tmp_path / name).mkdir()
+        (tmp_path / name / "file").write_bytes(b"x")
+    with file_lock(tmp_path / "a" / LOCK_FILENAME, shared=True):
+        cache.evict()
+    assert (tmp_path / "a").exists()
+    assert not (tmp_path / "b").exists()
+
+
+def test_reused_entry_is_marked_as_recently_used(tmp_path: Path, e2e_upgrade_sut_alembic_assets: Path) -> None:
+    version_data_path = tmp_path / "versions.jsonl"
+    shutil.copy(e2e_upgrade_sut_alembic_assets / "versions.jsonl", version_data_path)
+    pa = PhantomAlembic(version_data_path, in_memory=False, cache_dir=tmp_path / "cache")
+    with pa.context() as context:
+        manifest_path = context.dir_path / MANIFEST_FILENAME
+    os.utime(manifest_path, (0, 0))
+    with pa.context():
+        pass
+    assert manifest_path.stat().st_mtime > 0
+
+
+def test_commands_on_the_same_entry_run_concurrently(tmp_path: Path, e2e_upgrade_sut_alembic_assets: Path) -> None:
+    version_data_path = tmp_path / "versions.jsonl"
+    shutil.copy(e2e_upgrade_sut_alembic_assets / "versions.jsonl", version_data_path)
+    pa = PhantomAlembic(version_data_path, in_memory=False, cache_dir=tmp_path / "cache")
+
+    def run_another_command() -> None:
+        with pa.context():
+            pass
+
+    with pa.context() as context:
+        # 実行中のコマンドはエントリを共有ロックするだけなので、他のコマンドも同じエントリに入れる
+        inner = threading.Thread(target=run_another_command, daemon=True)
+        inner.start()
+        inner.join(timeout=10)
+        assert not inner.is_alive()
+        assert (context.dir_path / MANIFEST_FILENAME).exists()
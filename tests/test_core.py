@@ -0,0 +1,199 @@
+import asyncio
+import io
+import sqlite3
+from pathlib import Path
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from phantom_alembic import PhantomAlembic
+from phantom_alembic.store import MemoryStore, StoreBackend, VersionStore, open_store
+
+LOGGING_INI_CONTENT = """
+[loggers]
+keys = root
+
+[handlers]
+keys =
+
+[formatters]
+keys =
+
+[logger_root]
+handlers =
+"""
+
+
+def test_memory_context_does_not_materialize_revisions(e2e_upgrade_sut_alembic_assets: Path) -> None:
+    sut = PhantomAlembic(version_data_path=e2e_upgrade_sut_alembic_assets / "versions.jsonl", env_content="")
+    with sut.memory_context() as context:
+        assert list(context.version_path.iterdir()) == []
+        assert sorted(s.revision for s in context.script_directory.walk_revisions()) == [
+            "517ac74ab831",
+            "e0f3b1da8144",
+        ]
+
+
+def test_memory_context_revision_does_not_announce_the_temporary_directory(
+    e2e_upgrade_sut_alembic_assets: Path, capsys: pytest.CaptureFixture[str]
+) -> None:
+    sut = PhantomAlembic(version_data_path=e2e_upgrade_sut_alembic_assets / "versions.jsonl")
+    sut.revision("next")
+    assert "Creating directory" not in capsys.readouterr().out
+
+
+def test_memory_context_resolves_graph_without_importing_revisions(tmp_path: Path) -> None:
+    version_data_path = tmp_path / "versions.jsonl"
+    store = VersionStore(version_data_path)
+    store.load()
+    store.put(
+        {
+            f"{rev}_.py": f'revision = "{rev}"\ndown_revision = {down!r}\nraise RuntimeError("imported {rev}")\n'
+            for rev, down in [("a1", None), ("b2", "a1"), ("c3", "b2")]
+        }
+    )
+    sut = PhantomAlembic(version_data_path=version_data_path, env_content="")
+    with sut.memory_context() as context:
+        script_directory = context.script_directory
+        assert script_directory.get_heads() == ["c3"]
+        assert [s.revision for s in script_directory.walk_revisions()] == ["c3", "b2", "a1"]
+        with pytest.raises(RuntimeError, match="imported c3"):
+            script_directory._upgrade_revs("c3", "b2")
+
+
+def test_upgrade_uses_caller_supplied_connection(e2e_upgrade_sut_alembic_assets: Path, tmp_path: Path) -> None:
+    sut = PhantomAlembic(version_data_path=e2e_upgrade_sut_alembic_assets / "versions.jsonl")
+    engine = create_engine(f"sqlite:///{tmp_path / 'app.db'}")
+    with engine.begin() as connection:
+        sut.upgrade("head", connection=connection)
+        assert connection.execute(text("SELECT version_num FROM alembic_version")).fetchall() == [("517ac74ab831",)]
+    engine.dispose()
+
+
+def test_upgrade_async_with_async_engine(e2e_upgrade_sut_alembic_assets: Path, tmp_path: Path) -> None:
+    sut = PhantomAlembic(version_data_path=e2e_upgrade_sut_alembic_assets / "versions.jsonl", use_async_engine=True)
+    database_path = tmp_path / "app.db"
+
+    async def run() -> None:
+        engine = create_async_engine(f"sqlite+aiosqlite:///{database_path}")
+        await sut.upgrade_async("head", connection=engine)
+        await engine.dispose()
+
+    asyncio.run(run())
+    with sqlite3.connect(database_path) as conn:
+        assert conn.execute("SELECT version_num FROM alembic_version").fetchall() == [("517ac74ab831",)]
+
+
+def test_upgrade_async_without_connection_uses_async_env(e2e_upgrade_sut_alembic_assets: Path, tmp_path: Path) -> None:
+    database_path = tmp_path / "app.db"
+    sut = PhantomAlembic(
+        version_data_path=e2e_upgrade_sut_alembic_assets / "versions.jsonl",
+        ini_content=f"[alembic]\nsqlalchemy.url = sqlite+aiosqlite:///{database_path}\n" + LOGGING_INI_CONTENT,
+        use_async_engine=True,
+    )
+    asyncio.run(sut.upgrade_async("head"))
+    with sqlite3.connect(database_path) as conn:
+        assert conn.execute("SELECT version_num FROM alembic_version").fetchall() == [("517ac74ab831",)]
+
+
+def test_upgrade_sql_writes_ddl_to_output(e2e_upgrade_sut_alembic_assets: Path, tmp_path: Path) -> None:
+    database_path = tmp_path / "app.db"
+    sut = PhantomAlembic(
+        version_data_path=e2e_upgrade_sut_alembic_assets / "versions.jsonl",
+        ini_content=f"[alembic]\nsqlalchemy.url = sqlite:///{database_path}\n" + LOGGING_INI_CONTENT,
+    )
+    output = io.StringIO()
+    sut.upgrade("e0f3b1da8144:head", sql=True, output=output)
+    assert "CREATE TABLE user_profiles" in output.getvalue()
+    assert "CREATE TABLE users" not in output.getvalue()
+    assert not database_path.exists()
+
+
+def test_current_and_heads_without_importing_revisions(e2e_upgrade_sut_alembic_assets: Path, tmp_path: Path) -> None:
+    sut = PhantomAlembic(version_data_path=e2e_upgrade_sut_alembic_assets / "versions.jsonl")
+    engine = create_engine(f"sqlite:///{tmp_path / 'app.db'}")
+    assert sut.heads() == ("517ac74ab831",)
+    assert sut.current(engine) == ()
+    assert not sut.is_up_to_date(engine)
+    sut.upgrade("e0f3b1da8144", connection=engine)
+    assert sut.current(engine) == ("e0f3b1da8144",)
+    assert not sut.is_up_to_date(engine)
+    sut.upgrade("head", connection=engine)
+    assert sut.is_up_to_date(engine)
+    engine.dispose()
+
+
+def test_current_with_async_engine(e2e_upgrade_sut_alembic_assets: Path, tmp_path: Path) -> None:
+    database_path = tmp_path / "app.db"
+    sut = PhantomAlembic(
+        version_data_path=e2e_upgrade_sut_alembic_assets / "versions.jsonl",
+        ini_content=f"[alembic]\nsqlalchemy.url = sqlite+aiosqlite:///{database_path}\n" + LOGGING_INI_CONTENT,
+        use_async_engine=True,
+    )
+    assert sut.current() == ()
+    asyncio.run(sut.upgrade_async("head"))
+    assert sut.current() == ("517ac74ab831",)
+    assert sut.is_up_to_date()
+
+
+def test_current_expands_here_like_alembic(e2e_upgrade_sut_alembic_assets: Path, tmp_path: Path) -> None:
+    sut = PhantomAlembic(
+        version_data_path=e2e_upgrade_sut_alembic_assets / "versions.jsonl",
+        ini_content="[alembic]\nsqlalchemy.url = sqlite:///%(here)s/app.db\n" + LOGGING_INI_CONTENT,
+        in_memory=False,
+        cache_dir=tmp_path / "cache",
+    )
+    sut.upgrade("head")
+    # %(here)s は upgrade と同じく alembic.ini を置いたディレクトリ (キャッシュエントリ) に展開される
+    assert sut.current() == ("517ac74ab831",)
+    assert sut.is_up_to_date()
+
+
+@pytest.mark.parametrize("backend", ["sqlite", "memory"])
+def test_revision_and_upgrade_with_other_store_backends(
+    e2e_upgrade_sut_alembic_assets: Path, tmp_path: Path, backend: str
+) -> None:
+    records = dict(VersionStore(e2e_upgrade_sut_alembic_assets / "versions.jsonl").load())
+    store: StoreBackend
+    if backend == "memory":
+        store = MemoryStore(records)
+        sut = PhantomAlembic(store)
+    else:
+        open_store(tmp_path / "versions.sqlite3", backend).put(records)
+        sut = PhantomAlembic(tmp_path / "versions.sqlite3", store_backend=backend)
+        store = sut.open_store()
+    engine = create_engine(f"sqlite:///{tmp_path / 'app.db'}")
+    assert sut.heads() == ("517ac74ab831",)
+    sut.revision("next")
+    assert len(store.load()) == 3
+    store.close()
+    assert sut.heads() != ("517ac74ab831",)
+    sut.upgrade("head", connection=engine)
+    assert sut.is_up_to_date(engine)
+    engine.dispose()
+
+
+@pytest.mark.parametrize("backend", ["jsonl", "sqlite"])
+def test_store_instance_stays_open_for_sessions(
+    e2e_upgrade_sut_alembic_assets: Path, tmp_path: Path, backend: str
+) -> None:
+    store = open_store(tmp_path / "versions", backend)
+    store.put(dict(VersionStore(e2e_upgrade_sut_alembic_assets / "versions.jsonl").load()))
+    store.close()
+    sut = PhantomAlembic(store)
+    engine = create_engine(f"sqlite:///{tmp_path / 'app.db'}")
+    with sut.session() as session:
+        assert sut.heads() == ("517ac74ab831",)
+        session.upgrade("head", connection=engine)
+    assert sut.is_up_to_date(engine)
+    assert len(store.load()) == 2
+    engine.dispose()
+
+
+def test_context_exit_keeps_revisions_added_concurrently(e2e_upgrade_sut_alembic_assets: Path) -> None:
+    version_data_path = e2e_upgrade_sut_alembic_assets / "versions.jsonl"
+    sut = PhantomAlembic(version_data_path=version_data_path, in_memory=False)
+    with sut.context():
+        VersionStore(version_data_path).put({"concurrent_.py": 'revision = "concurrent"\ndown_revision = None\n'})
+    assert "concurrent_.py" in VersionStore(version_data_path).load()
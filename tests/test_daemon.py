@@ -0,0 +1,68 @@
+import sys
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from threading import Thread
+from typing import Generator
+
+import pytest
+
+from phantom_alembic import daemon
+
+
+def execute(argv: list[str]) -> None:
+    if argv == ["fail"]:
+        sys.exit(3)
+    print(" ".join(argv))
+
+
+@pytest.fixture
+def socket_path() -> Generator[str, None, None]:
+    # AF_UNIX のパス長制限に収まるよう短いディレクトリを使う
+    with TemporaryDirectory(dir="/tmp") as temp_dir:
+        yield str(Path(temp_dir) / "pa.sock")
+
+
+def test_forward_runs_command_in_daemon(socket_path: str) -> None:
+    with daemon.PhantomAlembicServer(socket_path, "app:pa", execute) as server:
+        thread = Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            assert daemon.forward(socket_path, "app:pa", ["upgrade", "head"]) == {
+                "exit_code": 0,
+                "stdout": "upgrade head\n",
+                "stderr": "",
+            }
+            result = daemon.forward(socket_path, "app:pa", ["fail"])
+            assert result is not None and result["exit_code"] == 3
+            assert daemon.forward(socket_path, "other:pa", ["upgrade", "head"]) is None
+        finally:
+            server.shutdown()
+            thread.join()
+
+
+def test_forward_without_daemon_returns_none(socket_path: str) -> None:
+    assert daemon.forward(socket_path, "app:pa", ["upgrade", "head"]) is None
+
+
+@pytest.mark.parametrize("module", ["pyproject.toml", "app.py:pa", "app:pa"])
+def test_forward_from_another_directory_runs_locally(
+    socket_path: str, tmp_path: Path, monkeypatch: pytest.MonkeyPatch, module: str
+) -> None:
+    project_dir = tmp_path / "project"
+    other_dir = tmp_path / "other"
+    for directory in (project_dir, other_dir):
+        directory.mkdir()
+        (directory / "pyproject.toml").write_text("[tool.phantom_alembic]\n")
+        (directory / "app.py").write_text("pa = None\n")
+    monkeypatch.chdir(project_dir)
+    with daemon.PhantomAlembicServer(socket_path, daemon.module_identity(module), execute) as server:
+        thread = Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            assert daemon.forward(socket_path, daemon.module_identity(module), ["current"]) is not None
+            # 同じ指定でも別のディレクトリでは別のプロジェクトを指すので、常駐プロセスには転送しない
+            monkeypatch.chdir(other_dir)
+            assert daemon.forward(socket_path, daemon.module_identity(module), ["current"]) is None
+        finally:
+            server.shutdown()
+            thread.join()
@@ -0,0 +1,84 @@
+import io
+import json
+from pathlib import Path
+
+import pytest
+from sqlalchemy import create_engine
+
+from phantom_alembic import PhantomAlembic, partial_report
+from phantom_alembic.events import Event, JsonLinesSink, ProgressLine, StepTimer
+from phantom_alembic.store import VersionStore
+
+
+def test_observer_receives_phase_and_migration_events(e2e_upgrade_sut_alembic_assets: Path, tmp_path: Path) -> None:
+    sut = PhantomAlembic(version_data_path=e2e_upgrade_sut_alembic_assets / "versions.jsonl")
+    events: list[Event] = []
+    stream = io.StringIO()
+    sut.add_observer(events.append)
+    sut.add_observer(JsonLinesSink(stream))
+    engine = create_engine(f"sqlite:///{tmp_path / 'app.db'}")
+    sut.upgrade("head", connection=engine)
+    engine.dispose()
+
+    names = [event.name for event in events]
+    for name in ["context.enter", "config", "script_directory", "revision.import", "connect", "plan", "context.exit"]:
+        assert name in names
+    assert names[-1] == "command"
+    migrations = [event for event in events if event.name == "migration"]
+    assert [event.attributes["revision"] for event in migrations] == ["e0f3b1da8144", "517ac74ab831"]
+    assert all(event.duration >= 0 for event in events)
+    assert [json.loads(line)["event"] for line in stream.getvalue().splitlines()] == names
+
+
+def test_no_observer_means_no_emitter(e2e_upgrade_sut_alembic_assets: Path) -> None:
+    sut = PhantomAlembic(version_data_path=e2e_upgrade_sut_alembic_assets / "versions.jsonl")
+    assert sut.emit is None
+    sut.add_observer(print)
+    assert sut.emit is not None
+    sut.remove_observer(print)
+    assert sut.emit is None
+
+
+def test_upgrade_does_not_instrument_steps_without_report_or_observers(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    version_data_path = tmp_path / "versions.jsonl"
+    VersionStore(version_data_path).put({"a1_.py": 'revision = "a1"\ndown_revision = None\ndef upgrade():\n    pass\n'})
+
+    def wrap(self: StepTimer, fn: object) -> object:
+        raise AssertionError("steps must not be instrumented")
+
+    monkeypatch.setattr(StepTimer, "wrap", wrap)
+    engine = create_engine(f"sqlite:///{tmp_path / 'app.db'}")
+    assert PhantomAlembic(version_data_path=version_data_path).upgrade("head", connection=engine) is None
+    engine.dispose()
+
+
+def test_upgrade_reports_each_migration_with_reported_rows(tmp_path: Path) -> None:
+    version_data_path = tmp_path / "versions.jsonl"
+    VersionStore(version_data_path).put(
+        {
+            "a1_.py": 'from phantom_alembic import report_rows\nrevision = "a1"\ndown_revision = None\n'
+            "def upgrade():\n    report_rows(100)\n    report_rows(50)\n",
+            "b2_.py": 'revision = "b2"\ndown_revision = "a1"\ndef upgrade():\n    raise RuntimeError("boom")\n',
+        }
+    )
+    sut = PhantomAlembic(version_data_path=version_data_path)
+    stream = io.StringIO()
+    sut.add_observer(ProgressLine(stream, live=False))
+    engine = create_engine(f"sqlite:///{tmp_path / 'app.db'}")
+
+    report = sut.upgrade("a1", connection=engine, report=True)
+    assert report is not None
+    assert [(m.destination, m.outcome, m.rows) for m in report.migrations] == [(("a1",), "applied", 150)]
+    assert report.rows == 150 and report.duration >= report.migrations[0].duration
+    with pytest.raises(RuntimeError) as excinfo:
+        sut.upgrade("head", connection=engine, report=True)
+    failed = partial_report(excinfo.value)
+    assert failed is not None
+    assert [(m.destination, m.outcome, m.error) for m in failed.migrations] == [(("b2",), "failed", "RuntimeError")]
+    engine.dispose()
+
+    lines = stream.getvalue().splitlines()
+    assert lines[0].startswith("[1/1] base -> a1 applied ") and lines[0].endswith("rows/s)")
+    assert lines[1].startswith("[1/1] a1 -> b2 failed ")
@@ -0,0 +1,34 @@
+import shutil
+from pathlib import Path
+
+import pytest
+import sqlalchemy as sa
+from alembic.util import AutogenerateDiffsDetected
+
+from phantom_alembic import PhantomAlembic
+
+
+def test_metadata_provider_is_resolved_once_per_session_and_only_for_autogenerate(
+    e2e_upgrade_sut_alembic_assets: Path, tmp_path: Path
+) -> None:
+    shutil.copy(e2e_upgrade_sut_alembic_assets / "versions.jsonl", tmp_path / "versions.jsonl")
+    calls = []
+
+    def provide_metadata() -> sa.MetaData:
+        calls.append(1)
+        metadata = sa.MetaData()
+        sa.Table("widget", metadata, sa.Column("id", sa.Integer, primary_key=True))
+        return metadata
+
+    sut = PhantomAlembic(tmp_path / "versions.jsonl", target_metadata=provide_metadata)
+    engine = sa.create_engine(f"sqlite:///{tmp_path / 'app.db'}")
+    with sut.session() as session:
+        session.upgrade("head", connection=engine)
+        assert calls == []
+        with pytest.raises(AutogenerateDiffsDetected):
+            session.check(connection=engine)
+        session.revision("add widget", autogenerate=True, connection=engine)
+        session.upgrade("head", connection=engine)
+        session.check(connection=engine)
+    engine.dispose()
+    assert calls == [1]
@@ -0,0 +1,65 @@
+import pickle
+import sqlite3
+from pathlib import Path
+
+from phantom_alembic import PhantomAlembic
+from phantom_alembic.baseline import Baseline, baseline_name
+from phantom_alembic.parallel import _WorkerConfig
+from phantom_alembic.store import VersionStore
+
+ENV_CONTENT = """
+from alembic import context
+from sqlalchemy import engine_from_config, pool
+
+config = context.config
+connectable = engine_from_config(
+    config.get_section(config.config_ini_section, {}), prefix="sqlalchemy.", poolclass=pool.NullPool
+)
+with connectable.connect() as connection:
+    context.configure(connection=connection)
+    with context.begin_transaction():
+        context.run_migrations()
+"""
+
+
+def test_upgrade_many_reports_each_target(e2e_upgrade_sut_alembic_assets: Path, tmp_path: Path) -> None:
+    sut = PhantomAlembic(
+        version_data_path=e2e_upgrade_sut_alembic_assets / "versions.jsonl",
+        ini_content="[alembic]\n",
+        env_content=ENV_CONTENT,
+    )
+    urls = [f"sqlite:///{tmp_path / name}" for name in ["a.db", "missing/b.db", "c.db"]]
+    results = sut.upgrade_many(urls, "head", max_workers=2)
+    assert [r.url for r in results] == urls
+    assert [r.success for r in results] == [True, False, True]
+    assert results[1].error is not None and "unable to open database file" in results[1].error
+    with sqlite3.connect(tmp_path / "c.db") as conn:
+        assert conn.execute("SELECT version_num FROM alembic_version").fetchall() == [("517ac74ab831",)]
+
+
+def test_upgrade_many_starts_empty_databases_from_the_baseline(
+    e2e_upgrade_sut_alembic_assets: Path, tmp_path: Path
+) -> None:
+    version_data_path = e2e_upgrade_sut_alembic_assets / "versions.jsonl"
+    baseline = Baseline("517ac74ab831", "sqlite", ["CREATE TABLE from_baseline (id INTEGER)"])
+    VersionStore(version_data_path).put({baseline_name("sqlite"): baseline.dumps()})
+    sut = PhantomAlembic(version_data_path=version_data_path, ini_content="[alembic]\n", env_content=ENV_CONTENT)
+    results = sut.upgrade_many([f"sqlite:///{tmp_path / 'a.db'}"], "head", max_workers=1)
+    assert [r.success for r in results] == [True]
+    with sqlite3.connect(tmp_path / "a.db") as conn:
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        assert tables == {"alembic_version", "from_baseline"}
+        assert conn.execute("SELECT version_num FROM alembic_version").fetchall() == [("517ac74ab831",)]
+
+
+def test_worker_config_does_not_carry_observers(e2e_upgrade_sut_alembic_assets: Path) -> None:
+    sut = PhantomAlembic(
+        version_data_path=e2e_upgrade_sut_alembic_assets / "versions.jsonl",
+        env_content=ENV_CONTENT,
+        target_metadata=lambda: None,
+    )
+    sut.add_observer(lambda event: None)
+    worker = pickle.loads(pickle.dumps(_WorkerConfig.of(sut))).phantom_alembic()
+    assert worker.emit is None
+    assert worker.env_content == ENV_CONTENT
+    assert worker.heads() == ("517ac74ab831",)
@@ -0,0 +1,36 @@
+import io
+import pstats
+import time
+from pathlib import Path
+
+from phantom_alembic.profiling import (
+    DEFAULT_PROFILE_PATH,
+    normalize_profile_argument,
+    profiling,
+)
+
+
+def busy_function(seconds: float) -> None:
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+def test_profiling_writes_pstats_and_sample_summary(tmp_path: Path) -> None:
+    profile_path = tmp_path / "out.prof"
+    stream = io.StringIO()
+    with profiling(str(profile_path), sample_interval=0.001, stream=stream):
+        busy_function(0.1)
+
+    stats = pstats.Stats(str(profile_path))
+    assert any(name == "busy_function" for _, _, name in stats.stats)  # type: ignore[attr-defined]
+    assert "busy_function" in stream.getvalue()
+
+
+def test_bare_profile_flag_uses_default_path() -> None:
+    assert normalize_profile_argument(["--profile", "app:pa", "upgrade", "head"]) == [
+        f"--profile={DEFAULT_PROFILE_PATH}",
+        "app:pa",
+        "upgrade",
+        "head",
+    ]
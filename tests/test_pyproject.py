@@ -0,0 +1,74 @@
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+from sqlalchemy import create_engine
+
+from phantom_alembic import PhantomAlembic
+from phantom_alembic.main import load_object_from_path
+from phantom_alembic.sqlite_store import SQLiteStore
+from phantom_alembic.store import VersionStore
+
+MODELS = """
+import sqlalchemy as sa
+
+metadata = sa.MetaData()
+sa.Table("widget", metadata, sa.Column("id", sa.Integer, primary_key=True))
+"""
+
+
+def test_pyproject_table_imports_models_only_for_autogenerate(
+    e2e_upgrade_sut_alembic_assets: Path, tmp_path: Path
+) -> None:
+    shutil.copy(e2e_upgrade_sut_alembic_assets / "versions.jsonl", tmp_path / "versions.jsonl")
+    (tmp_path / "lazy_models_for_test.py").write_text(MODELS, encoding="utf-8")
+    (tmp_path / "pyproject.toml").write_text(
+        '[tool.phantom_alembic]\nversion_data_path = "versions.jsonl"\n'
+        f'target_metadata = "{tmp_path / "lazy_models_for_test.py"}:metadata"\n',
+        encoding="utf-8",
+    )
+    sut = load_object_from_path(str(tmp_path / "pyproject.toml"))
+    assert sut.version_data_path == tmp_path / "versions.jsonl"
+
+    engine = create_engine(f"sqlite:///{tmp_path / 'app.db'}")
+    sut.upgrade("head", connection=engine)
+    assert "lazy_models_for_test" not in sys.modules
+    sut.revision("add widget", autogenerate=True, connection=engine)
+    assert "lazy_models_for_test" in sys.modules
+    engine.dispose()
+    del sys.modules["lazy_models_for_test"]
+
+    store = VersionStore(tmp_path / "versions.jsonl")
+    assert any("op.create_table('widget'" in content for content in store.load().values())
+    store.close()
+
+
+def test_pyproject_selects_the_store_backend(tmp_path: Path) -> None:
+    (tmp_path / "pyproject.toml").write_text(
+        '[tool.phantom_alembic]\nversion_data_path = "versions.db"\nstore_backend = "sqlite"\n', encoding="utf-8"
+    )
+    assert isinstance(load_object_from_path(str(tmp_path / "pyproject.toml")).open_store(), SQLiteStore)
+
+
+def test_factory_is_called(tmp_path: Path) -> None:
+    (tmp_path / "factory_app.py").write_text(
+        "from pathlib import Path\n"
+        "from phantom_alembic import PhantomAlembic\n\n"
+        "def create():\n"
+        "    return PhantomAlembic(Path('versions.jsonl'))\n",
+        encoding="utf-8",
+    )
+    assert isinstance(load_object_from_path(f"{tmp_path / 'factory_app.py'}:create"), PhantomAlembic)
+
+
+def test_cli_module_does_not_import_alembic() -> None:
+    code = "import sys, phantom_alembic.main; print(any(m.split('.')[0] == 'alembic' for m in sys.modules))"
+    assert subprocess.run([sys.executable, "-c", code], capture_output=True, text=True).stdout.strip() == "False"
+
+
+@pytest.mark.parametrize("module", ["asyncio", "concurrent.futures"])
+def test_cli_module_does_not_import_optional_stdlib_modules(module: str) -> None:
+    code = f"import sys, phantom_alembic.main; print({module!r} in sys.modules)"
+    assert subprocess.run([sys.executable, "-c", code], capture_output=True, text=True).stdout.strip() == "False"
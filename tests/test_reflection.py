@@ -0,0 +1,57 @@
+import shutil
+from pathlib import Path
+from typing import Any
+
+import pytest
+import sqlalchemy as sa
+from alembic.util import AutogenerateDiffsDetected
+
+from phantom_alembic import PhantomAlembic
+
+
+def widget_and_gadget() -> sa.MetaData:
+    metadata = sa.MetaData()
+    sa.Table("widget", metadata, sa.Column("id", sa.Integer, primary_key=True))
+    sa.Table("gadget", metadata, sa.Column("id", sa.Integer, primary_key=True))
+    return metadata
+
+
+def test_table_scope_limits_the_comparison(e2e_upgrade_sut_alembic_assets: Path, tmp_path: Path) -> None:
+    shutil.copy(e2e_upgrade_sut_alembic_assets / "versions.jsonl", tmp_path / "versions.jsonl")
+    sut = PhantomAlembic(tmp_path / "versions.jsonl", target_metadata=widget_and_gadget)
+    engine = sa.create_engine(f"sqlite:///{tmp_path / 'app.db'}")
+    sut.upgrade("head", connection=engine)
+    with engine.begin() as connection:
+        connection.execute(sa.text("CREATE TABLE widget (id INTEGER NOT NULL, PRIMARY KEY (id))"))
+
+    sut.check(connection=engine, tables=["widg*"])
+    with pytest.raises(AutogenerateDiffsDetected):
+        sut.check(connection=engine, tables=["gadget"])
+    engine.dispose()
+
+
+def test_reflection_cache_skips_reflection_for_the_same_database_revision(
+    e2e_upgrade_sut_alembic_assets: Path, tmp_path: Path
+) -> None:
+    shutil.copy(e2e_upgrade_sut_alembic_assets / "versions.jsonl", tmp_path / "versions.jsonl")
+    sut = PhantomAlembic(tmp_path / "versions.jsonl", target_metadata=widget_and_gadget)
+    engine = sa.create_engine(f"sqlite:///{tmp_path / 'app.db'}")
+    sut.upgrade("head", connection=engine)
+    with engine.begin() as connection:
+        connection.execute(sa.text("CREATE TABLE widget (id INTEGER NOT NULL, PRIMARY KEY (id))"))
+        connection.execute(sa.text("CREATE TABLE gadget (id INTEGER NOT NULL, PRIMARY KEY (id))"))
+
+    statements: list[str] = []
+
+    def count(conn: Any, cursor: Any, statement: str, *args: Any) -> None:
+        statements.append(statement)
+
+    sa.event.listen(engine, "before_cursor_execute", count)
+    sut.check(connection=engine, tables=["widget", "gadget"], reflection_cache_dir=tmp_path / "reflection")
+    cold = len(statements)
+    statements.clear()
+    sut.check(connection=engine, tables=["widget", "gadget"], reflection_cache_dir=tmp_path / "reflection")
+    engine.dispose()
+
+    assert list((tmp_path / "reflection").glob("*.pickle"))
+    assert len(statements) < cold
@@ -0,0 +1,38 @@
+import shutil
+from pathlib import Path
+
+import pytest
+from sqlalchemy import create_engine
+
+from phantom_alembic import PhantomAlembic
+from phantom_alembic.store import VersionStore
+
+
+@pytest.mark.parametrize("in_memory", [True, False])
+def test_session_runs_commands_on_one_context(
+    e2e_upgrade_sut_alembic_assets: Path, tmp_path: Path, in_memory: bool
+) -> None:
+    version_data_path = tmp_path / "versions.jsonl"
+    shutil.copy(e2e_upgrade_sut_alembic_assets / "versions.jsonl", version_data_path)
+    original = version_data_path.read_bytes()
+    sut = PhantomAlembic(version_data_path, in_memory=in_memory)
+    engine = create_engine(f"sqlite:///{tmp_path / 'app.db'}")
+
+    with sut.session() as session:
+        session.upgrade("head", connection=engine)
+        assert session.current(engine) == ("517ac74ab831",)
+        session.revision(message="add column")
+        (new_head,) = session.heads()
+        assert new_head != "517ac74ab831"
+        assert not session.is_up_to_date(engine)
+        session.upgrade("head", connection=engine)
+        assert session.current(engine) == (new_head,)
+        assert [s.revision for s in session.history()] == [new_head, "517ac74ab831", "e0f3b1da8144"]
+        session.stamp("517ac74ab831", connection=engine)
+        assert session.current(engine) == ("517ac74ab831",)
+        assert version_data_path.read_bytes() == original
+    engine.dispose()
+
+    store = VersionStore(version_data_path)
+    assert store.load().heads() == (new_head,)
+    store.close()
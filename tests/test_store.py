@@ -0,0 +1,153 @@
+import os
+from pathlib import Path
+from typing import Callable
+
+import pytest
+
+from phantom_alembic.sqlite_store import SQLiteStore
+from phantom_alembic.store import (
+    MemoryStore,
+    StoreBackend,
+    VersionStore,
+    open_store,
+    serialize_record,
+)
+
+
+def test_version_store_skips_write_when_nothing_changed(tmp_path: Path) -> None:
+    path = tmp_path / "versions.jsonl"
+    path.write_bytes(b'{"content": "a = 1\\n", "name": "a.py"}\n')
+    inode = path.stat().st_ino
+    sut = VersionStore(path)
+    assert sut.save(sut.load()) is False
+    assert path.stat().st_ino == inode
+
+
+def test_version_store_appends_and_patches_records(tmp_path: Path) -> None:
+    path = tmp_path / "versions.jsonl"
+    original_a = b'{"content": "a = 1\\n", "name": "a.py"}\n'
+    path.write_bytes(original_a + serialize_record("b.py", "b = 1\n"))
+    sut = VersionStore(path)
+    records = dict(sut.load())
+    records["b.py"] = "b = 2\n"
+    records["c.py"] = "c = 1\n"
+    assert sut.save(records) is True
+    assert path.read_bytes() == original_a + serialize_record("b.py", "b = 2\n") + serialize_record("c.py", "c = 1\n")
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["versions.jsonl", "versions.jsonl.idx", "versions.jsonl.lock"]
+
+
+def test_version_store_reads_records_through_index(tmp_path: Path) -> None:
+    path = tmp_path / "versions.jsonl"
+    content = 'revision = "abc"\ndown_revision = None\n'
+    path.write_bytes(serialize_record("a.py", "a = 1\n") + serialize_record("abc_.py", content))
+    VersionStore(path).load()
+    assert (tmp_path / "versions.jsonl.idx").exists()
+    records = VersionStore(path).load()
+    assert records.name_for_revision("abc") == "abc_.py"
+    assert records["abc_.py"] == content
+
+
+def test_version_store_ignores_index_of_a_replaced_file(tmp_path: Path) -> None:
+    path = tmp_path / "versions.jsonl"
+    path.write_bytes(serialize_record("a.py", "a = 1\n"))
+    VersionStore(path).load()
+    st = path.stat()
+    replacement = tmp_path / "replacement.jsonl"
+    replacement.write_bytes(serialize_record("b.py", "b = 1\n"))
+    os.utime(replacement, ns=(st.st_atime_ns, st.st_mtime_ns))
+    os.replace(replacement, path)
+    assert dict(VersionStore(path).load()) == {"b.py": "b = 1\n"}
+
+
+STORE_FACTORIES: list[Callable[[Path], StoreBackend]] = [
+    lambda tmp_path: VersionStore(tmp_path / "versions.jsonl"),
+    lambda tmp_path: SQLiteStore(tmp_path / "versions.sqlite3"),
+    lambda tmp_path: MemoryStore(),
+]
+
+
+@pytest.mark.parametrize("make_store", STORE_FACTORIES, ids=["jsonl", "sqlite", "memory"])
+def test_store_backends_behave_alike(make_store: Callable[[Path], StoreBackend], tmp_path: Path) -> None:
+    sut = make_store(tmp_path)
+    assert dict(sut.load()) == {}
+    empty_digest = sut.digest()
+    assert sut.put({}) is False
+
+    a, b = 'revision = "a1"\ndown_revision = None\n', 'revision = "b2"\ndown_revision = "a1"\n'
+    assert sut.put({"a1_.py": a, "b2_.py": b, "notes.txt": "x"}) is True
+    signature = sut.signature()
+    assert sut.put({"a1_.py": a}) is False
+    assert sut.signature() == signature
+
+    records = sut.load()
+    assert sorted(records) == ["a1_.py", "b2_.py", "notes.txt"]
+    assert records["b2_.py"] == b
+    assert records.heads() == ("b2",)
+    assert records.metadata["b2_.py"] is not None
+    assert records.name_for_revision("b2") == "b2_.py"
+    sut.close()
+
+    assert sut.put({}, removed=["notes.txt"]) is True
+    assert sut.signature() != signature
+    assert sorted(sut.load()) == ["a1_.py", "b2_.py"]
+    assert sut.digest() != empty_digest
+    sut.close()
+
+    assert sut.put({"c3_.py": "revision = make_revision()\n"}) is True
+    assert sut.load().heads() is None
+    sut.close()
+
+    assert sut.save({"a1_.py": a}) is True
+    assert list(sut.load()) == ["a1_.py"]
+    sut.close()
+
+
+def test_open_store_selects_backend_explicitly(tmp_path: Path) -> None:
+    assert isinstance(open_store(tmp_path / "versions.jsonl"), VersionStore)
+    assert isinstance(open_store(tmp_path / "versions.db"), VersionStore)
+    assert isinstance(open_store(tmp_path / "versions.db", "sqlite"), SQLiteStore)
+    with pytest.raises(ValueError):
+        open_store(tmp_path / "versions.db", "postgresql")
+
+
+def test_sqlite_store_reads_without_creating_the_schema(tmp_path: Path) -> None:
+    path = tmp_path / "versions.sqlite3"
+    path.touch()
+    sut = SQLiteStore(path)
+    assert sut.signature() is not None
+    assert sut.digest() == SQLiteStore(tmp_path / "missing.sqlite3").digest()
+    assert dict(sut.load()) == {}
+    sut.close()
+    assert path.stat().st_size == 0
+
+
+@pytest.mark.parametrize("backend", ["jsonl", "sqlite"])
+def test_concurrent_writers_merge_their_changes(tmp_path: Path, backend: str) -> None:
+    path = tmp_path / "versions"
+    open_store(path, backend).put({"base.py": "base = 1\n", "old.py": "old = 1\n"})
+    first, second = open_store(path, backend), open_store(path, backend)
+    first.load()
+    second.load()
+    assert first.put({"first.py": "first = 1\n"}) is True
+    assert second.put({"second.py": "second = 1\n"}, removed=["old.py"]) is True
+    second.close()
+
+    assert dict(open_store(path, backend).load()) == {
+        "base.py": "base = 1\n",
+        "first.py": "first = 1\n",
+        "second.py": "second = 1\n",
+    }
+
+
+@pytest.mark.parametrize("backend", ["jsonl", "sqlite"])
+def test_reader_keeps_its_snapshot_while_another_store_writes(tmp_path: Path, backend: str) -> None:
+    path = tmp_path / "versions"
+    open_store(path, backend).put({"a.py": "a = 1\n"})
+    reader = open_store(path, backend)
+    records = reader.load()
+    open_store(path, backend).put({"a.py": "a = 2\n", "b.py": "b = 1\n"})
+
+    assert dict(records) == {"a.py": "a = 1\n"}
+    reader.close()
+    assert dict(reader.load()) == {"a.py": "a = 2\n", "b.py": "b = 1\n"}
+    reader.close()
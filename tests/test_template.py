@@ -0,0 +1,55 @@
+import shutil
+from pathlib import Path
+
+import pytest
+from sqlalchemy import create_engine, inspect
+
+from phantom_alembic import PhantomAlembic
+from phantom_alembic.events import Event
+
+UPGRADE_SUT_PATH = Path(__file__).parent / "fixtures" / "e2e" / "upgrade" / "sut"
+
+
+def test_template_is_migrated_once_and_copied_per_database(
+    e2e_upgrade_sut_alembic_assets: Path, tmp_path: Path
+) -> None:
+    sut = PhantomAlembic(version_data_path=e2e_upgrade_sut_alembic_assets / "versions.jsonl")
+    events: list[Event] = []
+    sut.add_observer(events.append)
+    template = sut.database_template(tmp_path / "templates")
+
+    for name in ["a.sqlite3", "b.sqlite3"]:
+        template.clone(f"sqlite:///{tmp_path / name}")
+        engine = create_engine(f"sqlite:///{tmp_path / name}")
+        assert set(inspect(engine).get_table_names()) >= {"users", "user_profiles"}
+        assert sut.is_up_to_date(engine)
+        engine.dispose()
+
+    names = [event.name for event in events]
+    assert names.count("template.build") == 1
+    assert names.count("template.clone") == 2
+
+    key = template.key()
+    (e2e_upgrade_sut_alembic_assets / "versions.jsonl").write_bytes(
+        (e2e_upgrade_sut_alembic_assets / "versions.jsonl").read_bytes() + b"\n"
+    )
+    assert template.key() != key
+
+
+def test_clone_requires_a_file_database(e2e_upgrade_sut_alembic_assets: Path, tmp_path: Path) -> None:
+    sut = PhantomAlembic(version_data_path=e2e_upgrade_sut_alembic_assets / "versions.jsonl")
+    with pytest.raises(ValueError):
+        sut.database_template(tmp_path).clone("sqlite://")
+
+
+@pytest.fixture(scope="session")
+def phantom_alembic(tmp_path_factory: pytest.TempPathFactory) -> PhantomAlembic:
+    version_data_path = tmp_path_factory.mktemp("phantom_alembic") / "versions.jsonl"
+    shutil.copy(UPGRADE_SUT_PATH / "versions.jsonl", version_data_path)
+    return PhantomAlembic(version_data_path=version_data_path)
+
+
+def test_phantom_alembic_database_fixture(phantom_alembic: PhantomAlembic, phantom_alembic_database: str) -> None:
+    engine = create_engine(phantom_alembic_database)
+    assert phantom_alembic.is_up_to_date(engine)
+    engine.dispose()